@@ -1,8 +1,8 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from typing import List
-import numpy as np
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 import logging
@@ -10,30 +10,89 @@ import requests
 import re
 import os
 import glob
+import threading
 from pathlib import Path
 
 from models.schemas import (
     FullMetadata, UploadResponse, DocMeta, SummarizeRequest, SummarizeResponse,
-    SearchRequest, SearchResponse, SearchHit, MetaResponse, TextResponse
+    SearchRequest, SearchResponse, SearchHit, MetaResponse, TextResponse,
+    JobResponse, BatchUploadResponse, BatchSearchRequest, BatchSearchResult, BatchSearchResponse
 )
 from utils.storage import (
-    save_file, save_text, get_text, list_docs, get_doc,
-    delete_doc, save_meta, get_meta, FILES as FILES_DIR
+    save_stream, get_text, list_docs, get_doc,
+    delete_doc, save_meta, get_meta, UploadTooLarge, FILES as FILES_DIR,
+    get_page, get_text_range, get_text_head, count_pages, count_chars
 )
-from services.extract import pdf_to_text
 from services.summarize import textrankish_summary
-from services.ocr import ocr_pdf_to_text
-from services.metadata import enrich_from_text
 from services.metadata_compare import compare_metadata  # <-- new imports
-from services import semantic
+from services import semantic, abstractive
 from services.cluster import Clusterer 
 from services.pdf_processing import process_pdf
+from services.ingest import ingest_doc, ingest_batch, preview_of, is_ingested
+from services import jobs
 
 logger = logging.getLogger("smartresearch.api")
 
 # app setup
 app = FastAPI(title="SmartResearch API", version="0.6.2")
 
+# upload size limits (per file, and per batch request)
+MAX_UPLOAD_BYTES = int(os.getenv("SR_MAX_UPLOAD_MB", "250")) * 1024 * 1024
+MAX_BATCH_BYTES = int(os.getenv("SR_MAX_BATCH_MB", "4096")) * 1024 * 1024
+_UPLOAD_LIMITS = {"/api/upload": MAX_UPLOAD_BYTES, "/api/upload_batch": MAX_BATCH_BYTES}
+
+# models loaded in the background at startup ("semantic", "summarizer", comma separated; "none" = fully lazy)
+WARMUP = [w.strip() for w in os.getenv("SR_WARMUP", "semantic").split(",") if w.strip() and w.strip() != "none"]
+_WARMERS = {"semantic": semantic.warmup, "summarizer": abstractive.warmup}
+_warmup_state: Dict[str, str] = {}  # target -> pending | done | failed: <error>
+
+
+class _UploadSizeLimit:
+    """
+    Caps the request body of the upload routes. A declared Content-Length
+    over the limit is refused before anything is read; the bytes that
+    actually arrive are counted too, so a chunked request (no length) or
+    one that under-declares is cut off with 413 instead of being spooled
+    in full by the multipart parser.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = _UPLOAD_LIMITS.get(scope.get("path")) \
+            if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        # small allowance for multipart framing around the file itself
+        cap = limit + 64 * 1024
+        detail = f"Upload larger than {limit // (1024 * 1024)} MB"
+        try:
+            declared = int(dict(scope["headers"]).get(b"content-length") or 0)
+        except ValueError:
+            declared = 0
+        if declared > cap:
+            return await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > cap:
+                    # raised inside request.form(): FastAPI re-raises HTTPExceptions as responses
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, counted_receive, send)
+
+
+app.add_middleware(_UploadSizeLimit)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -43,6 +102,14 @@ app.add_middleware(
 )
 
 
+async def _store_upload(file: UploadFile) -> dict:
+    """stream an UploadFile to disk (chunked, hashed on the fly) off the event loop"""
+    try:
+        return await run_in_threadpool(save_stream, file.filename, file.file, MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
 # cached tf-idf vectors
 _vectorizer = None
 _matrix = None
@@ -74,13 +141,31 @@ def _ensure_tfidf_ready():
     _matrix = _vectorizer.fit_transform(_doc_texts)
 
 
+def _run_warmup():
+    """load the SR_WARMUP models one after another (runs in a background thread)"""
+    for name in WARMUP:
+        fn = _WARMERS.get(name)
+        if fn is None:
+            _warmup_state[name] = "failed: unknown warmup target"
+            continue
+        try:
+            fn()
+            _warmup_state[name] = "done"
+        except Exception as e:
+            _warmup_state[name] = f"failed: {e}"
+            logger.warning(f"Warmup of {name} failed: {e}")
+
+
 @app.on_event("startup")
 def _startup_cache():
-    """warm tf-idf cache so first query isn’t slow"""
+    """warm tf-idf cache so first query isn’t slow; models warm up in the background"""
     try:
         _ensure_tfidf_ready()
     except Exception as e:
         print(f" tf-idf prebuild failed: {e}")
+    if WARMUP:
+        _warmup_state.update({name: "pending" for name in WARMUP})
+        threading.Thread(target=_run_warmup, name="sr-warmup", daemon=True).start()
 
 
 # base endpoints
@@ -90,6 +175,26 @@ def health():
     return {"ok": True}
 
 
+@app.get("/api/ready")
+def ready():
+    """readiness: which models and indexes are loaded (503 until the startup warmup is done)"""
+    sem = semantic.status()
+    body = {
+        "ready": all(state == "done" for state in _warmup_state.values()),
+        "warmup": dict(_warmup_state),
+        "models": {
+            "embedding": {"name": sem["model"], "backend": sem["backend"], "loaded": sem["model_loaded"]},
+            "summarizer": {"name": abstractive.MODEL_NAME, "loaded": abstractive.is_loaded()},
+        },
+        "indexes": {
+            "semantic": {"loaded": sem["index_loaded"], "kind": sem["index"],
+                         "vectors": sem["vectors"], "docs": sem["docs"]},
+            "tfidf": {"loaded": _matrix is not None, "docs": len(_doc_ids or [])},
+        },
+    }
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
+
 @app.get("/api/docs", response_model=List[DocMeta])
 def docs_list():
     """return all indexed docs with minimal metadata and summary from final metadata"""
@@ -107,36 +212,23 @@ def docs_list():
 
 
 from collections import defaultdict
-import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 @app.get("/api/clustered")
 def get_clusters():
     semantic.ensure_loaded()
 
-    chunk_ids = list(getattr(semantic, "_ids", []))
-    X = getattr(semantic, "_vecs", None)
-    lookup = getattr(semantic, "_doc_lookup", {})  # chunk_id -> doc_id
-
-    if X is None or len(chunk_ids) == 0 or X.shape[0] == 0:
-        return []
+    # doc-level vectors = mean of that doc's chunk vectors (kept up to date by semantic)
+    all_ids, X = semantic.doc_vectors(normalized=False)
 
     # docs that exist in your store
     docs = {d["id"]: d for d in list_docs()}
 
-    # group chunk row indices by doc_id
-    doc_to_rows = defaultdict(list)
-    for i, cid in enumerate(chunk_ids):
-        did = lookup.get(cid, cid.split("::")[0])
-        if did in docs:
-            doc_to_rows[did].append(i)
-
-    doc_ids = [did for did, rows in doc_to_rows.items() if rows]
+    keep = [i for i, did in enumerate(all_ids) if did in docs]
+    doc_ids = [all_ids[i] for i in keep]
     if len(doc_ids) == 0:
         return []
-
-    # doc-level vectors = mean of that doc's chunk vectors
-    X_doc = np.vstack([X[doc_to_rows[did]].mean(axis=0) for did in doc_ids])
+    X_doc = X[keep]
 
     # kmeans can't have more clusters than docs
     target_k = 5
@@ -254,11 +346,44 @@ def get_clusters():
 
 
 @app.get("/api/text/{doc_id}", response_model=TextResponse)
-def fetch_text(doc_id: str):
-    """return full text for a given doc"""
-    rec = get_doc(doc_id)
-    text = get_text(doc_id)
-    return TextResponse(id=doc_id, name=rec["name"], text=text, n_chars=len(text))
+def fetch_text(doc_id: str, page: Optional[int] = None, offset: int = 0, limit: Optional[int] = None):
+    """
+    return text for a given doc: the full text by default, a single page
+    with ?page=N (0-based), or a char window with ?offset=&limit=
+    """
+    try:
+        rec = get_doc(doc_id)
+        n_chars = count_chars(doc_id)
+        n_pages = count_pages(doc_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if page is not None:
+        try:
+            text = get_page(doc_id, page)
+        except IndexError:
+            raise HTTPException(status_code=404, detail=f"Page {page} out of range (0-{n_pages - 1})")
+        return TextResponse(id=doc_id, name=rec["name"], text=text, n_chars=n_chars,
+                            n_pages=n_pages, page=page)
+
+    if limit is None and offset == 0:
+        text = get_text(doc_id)
+        return TextResponse(id=doc_id, name=rec["name"], text=text, n_chars=n_chars, n_pages=n_pages)
+
+    offset = max(0, offset)
+    end = None if limit is None else offset + max(0, limit)
+    text = get_text_range(doc_id, offset, end)
+    next_offset = offset + len(text)
+    return TextResponse(
+        id=doc_id, name=rec["name"], text=text, n_chars=n_chars, n_pages=n_pages,
+        offset=offset, next_offset=next_offset if next_offset < n_chars else None,
+    )
+
+
+def _preview(did: str, n: int = 220) -> str:
+    """search-result snippet from the head of the stored text"""
+    txt = get_text_head(did, n + 1)
+    return txt[:n].replace("\n", " ") + ("…" if len(txt) > n else "")
 
 
 @app.get("/api/meta/{doc_id}", response_model=MetaResponse)
@@ -361,76 +486,164 @@ def remove_doc(doc_id: str):
     return {"deleted": doc_id}
 
 
-@app.post("/api/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...)):
-    """handle PDF upload, OCR fallback, metadata enrichment, and indexing"""
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF supported")
+def _upload_result(rec, out, job_id=None) -> UploadResponse:
+    """UploadResponse for a finished ingest_doc()/ingest_batch() entry"""
+    text = out["text"]
+    return UploadResponse(
+        doc=DocMeta(id=rec["id"], name=rec["name"], n_chars=len(text)),
+        preview=preview_of(text),
+        used_ocr=out["used_ocr"],
+        meta=FullMetadata(**out["meta"]),
+        job_id=job_id,
+    )
 
-    # save uploaded file
-    raw = await file.read()
-    rec = save_file(file.filename, raw)
 
-    # extract text from PDF
-    text = pdf_to_text(rec["path"])
-    
-    print(f"\n===== PDF UPLOAD DEBUG: {file.filename} =====")
-    print(text[:1000])  # print first 1000 characters
-    print("==========================================\n")
+# serializes "is anyone ingesting this doc? if not, queue it" for duplicate uploads
+_requeue_lock = threading.Lock()
+
+
+def _retry_job(rec) -> Optional[jobs.Job]:
+    """
+    Job that is (re)ingesting a stored doc whose earlier run failed or never
+    finished (text, metadata or vectors missing), or None if the doc is
+    complete. A live job is reused; otherwise a new one is queued.
+    """
+    with _requeue_lock:
+        job = jobs.latest_for_doc(rec["id"])
+        if job is not None and job.status in ("queued", "running"):
+            return job
+        if is_ingested(rec["id"]):
+            return None
+        logger.info(f"Re-ingesting {rec['id']} ({rec['name']}): earlier run did not finish")
+        return jobs.submit(rec["id"], rec["name"], lambda j: _ingest_job(j, rec))
+
+
+def _stored_result(rec) -> UploadResponse:
+    """
+    UploadResponse for a document that is already stored (duplicate upload).
+    Reuses the saved text/metadata; if the original is still being ingested,
+    or its ingest failed or was cut short, points at the job (re)doing it.
+    """
+    job = _retry_job(rec)
+    if job is not None:
+        return UploadResponse(
+            doc=DocMeta(id=rec["id"], name=rec["name"], n_chars=0),
+            preview="",
+            job_id=job.id,
+            status=job.status,
+            duplicate=True,
+        )
 
-    # fallback OCR if text is very short
-    used_ocr = False
-    if len(text.strip()) < 200:
-        try:
-            ocr_text = ocr_pdf_to_text(rec["path"])
-            if len(ocr_text.strip()) > len(text.strip()):
-                text = ocr_text
-                used_ocr = True
-        except Exception as e:
-            logger.warning(f"OCR failed for {file.filename}: {e}")
+    head = get_text_head(rec["id"], 601)
+    n_chars = count_chars(rec["id"])
+    meta = get_meta(rec["id"])
+    return UploadResponse(
+        doc=DocMeta(id=rec["id"], name=rec["name"], n_chars=n_chars),
+        preview=preview_of(head),
+        meta=FullMetadata(**meta) if isinstance(meta, dict) else None,
+        duplicate=True,
+    )
 
 
-    # save the extracted text
-    save_text(rec["id"], text)
+def _ingest_job(job, rec):
+    """background pipeline for one upload: extract/ocr, embed, metadata, tf-idf"""
+    out = ingest_doc(rec, job)
+    text = out["text"]
+
+    logger.debug(f"Extracted {len(text)} chars from {rec['name']}: {text[:1000]!r}")
 
-    # add to semantic embeddings
     try:
-        semantic.add_doc(rec["id"], text)
+        with job.stage("index"):
+            _ensure_tfidf_ready()
     except Exception as e:
-        logger.warning(f"Failed to add semantic embedding for {rec['id']}: {e}")
-
-    # --- Step 2: store BOTH metadata sources ---
-    pdf_meta = enrich_from_text(text) or {}
+        logger.warning(f"TF-IDF cache build failed after upload {rec['id']}: {e}")
 
-    summary = textrankish_summary(text, max_sentences=5)
+    return _upload_result(rec, out, job.id).model_dump()
 
-    meta_payload = {
-        "pdf": pdf_meta,            # metadata extracted from PDF
-        "external": {},             # no external metadata yet
-        "final": {**pdf_meta,       # copy PDF meta as base
-                "summary": summary,
-                "abstract": summary},  # optional: reuse summary for abstract
-        "confidence": 1.0,          # full confidence in PDF source for now
-        "reliable": True,           # assume reliable until compared
-    }
 
-    save_meta(rec["id"], meta_payload)
-    # --- end Step 2 ---
+def _ingest_batch_job(job, recs, dupes=()):
+    """background pipeline for a batch: parallel extract, pooled embedding, one tf-idf refit"""
+    out = ingest_batch(recs, job) if recs else {"docs": [], "chunks": 0, "failed": [], "failed_ids": []}
+    if recs and not out["docs"]:
+        raise RuntimeError(f"none of the {len(recs)} new documents could be ingested: {', '.join(out['failed'])}")
 
-   # prepare a preview
-    preview = (text[:600] + "…") if len(text) > 600 else text
     try:
-        _ensure_tfidf_ready()
+        with job.stage("index"):
+            _ensure_tfidf_ready()
     except Exception as e:
-        logger.warning(f"TF-IDF cache build failed after upload {rec['id']}: {e}")
+        logger.warning(f"TF-IDF cache build failed after batch upload: {e}")
+
+    return BatchUploadResponse(
+        docs=[_upload_result(d["rec"], d, job.id) for d in out["docs"]]
+        + [_stored_result(rec) for rec in dupes],
+        chunks=out["chunks"],
+        failed=out["failed"],
+    ).model_dump()
+
+
+@app.post("/api/upload", response_model=UploadResponse)
+async def upload_pdf(file: UploadFile = File(...)):
+    """save the PDF and queue extraction/OCR/metadata/indexing as a background job"""
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF supported")
+
+    # stream uploaded file to disk
+    rec = await _store_upload(file)
+
+    # same bytes seen before: hand back the existing doc, skip the pipeline
+    if rec.get("duplicate"):
+        return _stored_result(rec)
+
+    # everything else happens off the request
+    job = jobs.submit(rec["id"], rec["name"], lambda j: _ingest_job(j, rec))
 
     return UploadResponse(
-        doc=DocMeta(id=rec["id"], name=rec["name"], n_chars=len(text)),
-        preview=preview,
-        used_ocr=used_ocr,
-        meta=FullMetadata(**meta_payload)
+        doc=DocMeta(id=rec["id"], name=rec["name"], n_chars=0),
+        preview="",
+        job_id=job.id,
+        status=job.status,
     )
 
+
+@app.post("/api/upload_batch", response_model=JobResponse)
+async def upload_batch(files: List[UploadFile] = File(...)):
+    """save many PDFs and ingest them as one batch job (single index commit at the end)"""
+    bad = [f.filename for f in files if not f.filename.lower().endswith(".pdf")]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Only PDF supported: {', '.join(bad)}")
+
+    recs, dupes, seen = [], [], set()
+    for f in files:
+        rec = await _store_upload(f)
+        if rec.get("duplicate") or rec["id"] in seen:
+            dupes.append(rec)
+        else:
+            recs.append(rec)
+        seen.add(rec["id"])
+
+    job = jobs.submit(
+        None, f"batch of {len(recs) + len(dupes)} files",
+        lambda j: _ingest_batch_job(j, recs, dupes),
+        stages=["extract", "embed", "index"],
+    )
+    return job.to_dict()
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+def job_status(job_id: str):
+    """per-stage progress and timings for a background ingestion job"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/api/jobs", response_model=List[JobResponse])
+def jobs_list():
+    """all tracked ingestion jobs, newest first"""
+    return [j.to_dict() for j in reversed(jobs.list_jobs())]
+
+
 @app.post("/api/move_to_storage")
 def move_to_storage():
     """mock file mover for long-term storage"""
@@ -483,12 +696,29 @@ async def semantic_search(req: SearchRequest):
         if did not in docs:
             continue
         name = docs[did]["name"]
-        txt = get_text(did)
-        prev = txt[:220].replace("\n", " ") + ("…" if len(txt) > 220 else "")
-        hits.append(SearchHit(id=did, name=name, score=float(score), preview=prev))
+        hits.append(SearchHit(id=did, name=name, score=float(score), preview=_preview(did)))
     return SearchResponse(hits=hits)
 
 
+@app.post("/api/semantic_search_batch", response_model=BatchSearchResponse)
+async def semantic_search_batch(req: BatchSearchRequest):
+    """many semantic queries at once: one encoder call, one index search"""
+    docs = {d["id"]: d for d in list_docs()}
+    matches = semantic.search_batch(req.queries, topk=req.topk)
+    previews: Dict[str, str] = {}
+    results = []
+    for q, hits_for_q in zip(req.queries, matches):
+        hits = []
+        for did, score in hits_for_q:
+            if did not in docs:
+                continue
+            if did not in previews:
+                previews[did] = _preview(did)
+            hits.append(SearchHit(id=did, name=docs[did]["name"], score=float(score), preview=previews[did]))
+        results.append(BatchSearchResult(q=q, hits=hits))
+    return BatchSearchResponse(results=results)
+
+
 @app.post("/api/hybrid_search", response_model=SearchResponse)
 async def hybrid_search(req: SearchRequest):
     """combine tf-idf + semantic search with weighted fusion"""
@@ -525,27 +755,51 @@ async def hybrid_search(req: SearchRequest):
         try:
             rec = get_doc(doc_id)
             name = rec["name"]
-            text = get_text(doc_id)
-            preview = text[:220].replace("\n", " ") + ("…" if len(text) > 220 else "")
-            hits.append(SearchHit(id=doc_id, name=name, score=float(score), preview=preview))
+            hits.append(SearchHit(id=doc_id, name=name, score=float(score), preview=_preview(doc_id)))
         except Exception:
             continue
     return SearchResponse(hits=hits)
 
 
+@app.get("/api/query_cache")
+def query_cache_stats():
+    """hit/miss counters of the semantic query vector cache"""
+    return semantic.query_cache_stats()
+
+
+@app.delete("/api/query_cache")
+def query_cache_clear():
+    """drop all cached query vectors"""
+    semantic.clear_query_cache()
+    return {"status": "ok"}
+
+
+@app.get("/api/embed_cache")
+def embed_cache_stats():
+    """size and hit rate of the persistent chunk embedding cache"""
+    return semantic.embed_cache_stats()
+
+
+@app.delete("/api/embed_cache")
+def embed_cache_clear():
+    """drop every cached chunk vector (the next reindex encodes everything again)"""
+    semantic.clear_embed_cache()
+    return {"status": "ok"}
+
+
 @app.get("/api/similar/{doc_id}", response_model=SearchResponse)
-async def similar_docs(doc_id: str, topk: int = 10):
-    """find locally similar docs using semantic embeddings"""
+async def similar_docs(doc_id: str, topk: int = 10, exact: bool = False):
+    """find locally similar docs via the precomputed neighbour graph (exact=true recomputes)"""
     semantic.ensure_loaded()
     docs = {d["id"]: d for d in list_docs()}
-    matches = semantic.similar(doc_id, topk=topk * 2)
+    matches = semantic.similar(doc_id, topk=topk * 2, exact=exact)
 
     hits = []
     for did, score in matches:
         if did == doc_id or score < 0.35 or did not in docs:
             continue
-        txt = get_text(did)
-        prev = txt[:220].replace("\n", " ") + ("…" if len(txt) > 220 else "")
+        prev = _preview(did)
+        other_meta = get_meta(did)
         hits.append(SearchHit(id=did, name=docs[did]["name"], score=float(score), preview=prev, meta=FullMetadata(**other_meta) if isinstance(other_meta, dict) else None ))
 
     hits = sorted(hits, key=lambda x: -x.score)[:topk]
@@ -644,15 +898,13 @@ def external_recommendations(doc_id: str):
 
 @app.post("/api/reindex")
 def reindex():
-    """rebuild semantic embeddings from stored text"""
+    """rebuild semantic embeddings from stored text (unchanged chunks come from the embedding cache)"""
     docs = list_docs()
     if not docs:
         return {"status": "ok", "reindexed": 0}
 
-    semantic._ids.clear()
-    semantic._vecs = np.zeros(
-        (0, semantic._model.get_sentence_embedding_dimension()), dtype="float32"
-    )
+    before = semantic.embed_cache_stats()
+    semantic.reset()
 
     reindexed = 0
     for d in docs:
@@ -664,7 +916,9 @@ def reindex():
         except Exception as e:
             logger.warning(f"Failed to reindex doc {d['id']}: {e}")
             continue
-    return {"status": "ok", "reindexed": reindexed}
+    after = semantic.embed_cache_stats()
+    hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+    return {"status": "ok", "reindexed": reindexed, "cached_chunks": hits, "encoded_chunks": misses}
 
 
 @app.get("/files/{file_id}.pdf")
@@ -0,0 +1,328 @@
+"""
+SmartResearch command-line tools.
+
+    python cli.py upload-batch paper1.pdf paper2.pdf ... [--workers 8]
+    python cli.py import-dir data/samples [--workers 8] [--batch-size 200]
+    python cli.py eval-index [--queries 200] [--k 10]
+    python cli.py check-encoder [--backend int8] [--samples 200]
+    python cli.py embed-server [--address 127.0.0.1:8765]
+    python cli.py shard-server --address 127.0.0.1:8801
+    python cli.py shards [--n 4] [--port 8801]
+
+Runs against the same data store as the API (SMARTRESEARCH_DATA).
+A running API server rebuilds its TF-IDF cache on restart.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from utils.storage import save_stream, list_docs, get_text, DATA_DIR
+from services.ingest import ingest_batch, is_ingested, BATCH_WORKERS
+from services import embed_server, shards, rpc
+
+CHECKPOINT_DIR = DATA_DIR / "import_checkpoints"
+
+
+def cmd_upload_batch(args) -> int:
+    """ingest the given PDFs in one batch (parallel extraction, one index commit)"""
+    paths = [Path(p) for p in args.files]
+    missing = [str(p) for p in paths if not p.is_file() or p.suffix.lower() != ".pdf"]
+    if missing:
+        print(f"not a PDF file: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    t0 = time.time()
+    recs, seen = [], set()
+    for p in paths:
+        with open(p, "rb") as f:
+            rec = save_stream(p.name, f)
+        if (rec.get("duplicate") and is_ingested(rec["id"])) or rec["id"] in seen:
+            print(f"{rec['id']}  {p.name}  already stored as {rec['name']}")
+        else:
+            recs.append(rec)
+        seen.add(rec["id"])
+
+    out = ingest_batch(recs, workers=args.workers) if recs \
+        else {"docs": [], "chunks": 0, "failed": [], "failed_ids": []}
+
+    for d in out["docs"]:
+        rec = d["rec"]
+        flag = " (ocr)" if d["used_ocr"] else ""
+        print(f"{rec['id']}  {rec['name']}  {len(d['text'])} chars{flag}")
+    for name in out["failed"]:
+        print(f"FAILED  {name}", file=sys.stderr)
+
+    print(f"ingested {len(out['docs'])}/{len(recs)} docs, "
+          f"{out['chunks']} chunks in {time.time() - t0:.1f}s")
+    return 1 if out["failed"] else 0
+
+
+def _checkpoint_path(root: Path) -> Path:
+    """one checkpoint file per imported directory"""
+    key = hashlib.sha1(str(root.resolve()).encode("utf-8")).hexdigest()[:16]
+    return CHECKPOINT_DIR / f"{key}.json"
+
+
+def _load_checkpoint(path: Path) -> dict:
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            print(f"checkpoint {path} unreadable, starting over", file=sys.stderr)
+    return {"root": None, "files": {}}
+
+
+def _save_checkpoint(path: Path, state: dict):
+    """write the checkpoint atomically so an interrupted run never corrupts it"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _stamp(p: Path) -> list:
+    """size + mtime: a changed file is imported again"""
+    st = p.stat()
+    return [st.st_size, int(st.st_mtime)]
+
+
+def cmd_import_dir(args) -> int:
+    """walk a directory and ingest every PDF in it, resumably and in batches"""
+    root = Path(args.directory)
+    if not root.is_dir():
+        print(f"not a directory: {root}", file=sys.stderr)
+        return 2
+
+    ckpt_path = Path(args.checkpoint) if args.checkpoint else _checkpoint_path(root)
+    state = {"root": None, "files": {}} if args.restart else _load_checkpoint(ckpt_path)
+    state["root"] = str(root.resolve())
+    finished = state["files"]
+
+    pattern = "**/*" if args.recursive else "*"
+    todo = []
+    for p in sorted(root.glob(pattern)):
+        if not p.is_file() or p.suffix.lower() != ".pdf":
+            continue
+        rel = str(p.relative_to(root))
+        entry = finished.get(rel)
+        if entry and entry.get("stamp") == _stamp(p):
+            continue
+        todo.append(p)
+
+    print(f"{len(todo)} PDF(s) to import, {len(finished)} already done (checkpoint {ckpt_path})")
+    if not todo:
+        return 0
+
+    t0 = time.time()
+    n_docs = n_pages = n_chunks = n_failed = 0
+    batch_size = max(1, args.batch_size)
+
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        recs, skipped = [], []
+        for p in batch:
+            try:
+                with open(p, "rb") as f:
+                    rec = save_stream(p.name, f)
+            except Exception as e:
+                print(f"FAILED  {p}: {e}", file=sys.stderr)
+                n_failed += 1
+                continue
+            # a duplicate left half-done by a killed or failed run (no text, meta or
+            # vectors) goes through the batch again; its extraction is cached
+            if rec.get("duplicate") and is_ingested(rec["id"]):
+                skipped.append((p, rec))
+            elif any(r["id"] == rec["id"] for _, r in recs):
+                skipped.append((p, rec))
+            else:
+                recs.append((p, rec))
+
+        out = ingest_batch([r for _, r in recs], workers=args.workers) if recs \
+            else {"docs": [], "chunks": 0, "failed": [], "failed_ids": []}
+
+        ok_ids = {d["rec"]["id"] for d in out["docs"]}
+        for d in out["docs"]:
+            n_pages += d.get("n_pages", 0)
+        n_docs += len(out["docs"])
+        n_chunks += out["chunks"]
+        n_failed += len(out["failed"])
+
+        # checkpoint everything this batch finished (including duplicates);
+        # docs whose extraction or embedding failed are retried on the next run
+        done_ids = (ok_ids | {rec["id"] for _, rec in skipped}) - set(out["failed_ids"])
+        for p, rec in recs + skipped:
+            if rec["id"] in done_ids:
+                finished[str(p.relative_to(root))] = {
+                    "doc_id": rec["id"], "sha1": rec["sha1"], "stamp": _stamp(p),
+                }
+        _save_checkpoint(ckpt_path, state)
+
+        dt = max(time.time() - t0, 1e-6)
+        done = min(start + batch_size, len(todo))
+        print(f"[{done}/{len(todo)}] {n_docs} docs, {n_pages} pages, {n_chunks} chunks, "
+              f"{len(skipped)} dup in batch | {n_docs / dt:.2f} docs/s, "
+              f"{n_pages / dt:.1f} pages/s, {n_chunks / dt:.1f} chunks/s")
+
+    print(f"done: {n_docs} imported, {n_failed} failed in {time.time() - t0:.1f}s")
+    return 1 if n_failed else 0
+
+
+def cmd_eval_index(args) -> int:
+    """recall@k / latency / memory of the semantic index (SR_ANN_MODE, SR_VEC_COMPRESSION)"""
+    from services import semantic
+
+    res = semantic.evaluate_index(n_queries=args.queries, k=args.k)
+    print(json.dumps(res, indent=2))
+    if res.get("float32_bytes") and res.get("index_bytes"):
+        print(f"index is {res['float32_bytes'] / res['index_bytes']:.1f}x smaller than the float32 matrix")
+    return 0 if res.get("ok") in (True, None) else 1
+
+
+def cmd_check_encoder(args) -> int:
+    """cosine drift of an SR_EMB_BACKEND encoder vs. the full-precision model, on chunks of stored docs"""
+    from services import semantic, encoders
+
+    docs = list_docs()
+    random.Random(0).shuffle(docs)
+    chunks, missing = [], 0
+    for d in docs:
+        try:
+            text = get_text(d["id"])
+        except FileNotFoundError:
+            missing += 1  # indexed but its text never got stored (failed or half-finished ingest)
+            continue
+        chunks.extend(semantic._chunk_doc(d["id"], text or ""))
+        if len(chunks) >= 4 * args.samples:
+            break
+    if missing:
+        print(f"⚠️ Skipped {missing} document(s) with no stored text")
+    if not chunks:
+        print("no stored documents to sample from; upload or import some first")
+        return 1
+    sample = random.Random(1).sample(chunks, min(args.samples, len(chunks)))
+
+    res = encoders.check_drift(semantic.EMB_MODEL_NAME, sample, backend=args.backend or encoders.EMB_BACKEND,
+                               min_cosine=args.min_cosine)
+    print(json.dumps(res, indent=2))
+    return 0 if res.get("ok") in (True, None) else 1
+
+
+def cmd_embed_server(args) -> int:
+    """shared embedding sidecar: API workers started with SR_EMBED_SERVER=<address> send their texts here"""
+    from services import semantic
+
+    host, _ = rpc.parse_address(args.address)
+    if not (embed_server.authkey()[1] or rpc.is_loopback(host)):
+        print(f"set {embed_server.AUTHKEY_ENV} to listen on {host}; without it only loopback is served",
+              file=sys.stderr)
+        return 2
+    server = embed_server.EmbedServer(
+        semantic._encode_direct,
+        lambda: semantic._get_model().get_sentence_embedding_dimension(),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000.0,
+    )
+    semantic._get_model()  # load before accepting clients
+    embed_server.serve(args.address, server)
+    return 0
+
+
+def cmd_shard_server(args) -> int:
+    """one semantic index shard over this process's SMARTRESEARCH_DATA; API workers reach it via SR_SHARDS"""
+    from services import semantic
+
+    host, _ = rpc.parse_address(args.address)
+    if not (shards.authkey()[1] or rpc.is_loopback(host)):
+        print(f"set {shards.AUTHKEY_ENV} to listen on {host}; without it only loopback is served", file=sys.stderr)
+        return 2
+    semantic.use_shards([])  # a shard serves its own store, never routes onward
+    semantic.ensure_loaded()
+    shards.serve(args.address)
+    return 0
+
+
+def cmd_shards(args) -> int:
+    """run N local shard servers, each over its own <data store>/shard-<i>, until interrupted"""
+    key, explicit = shards.authkey()
+    if not (explicit or rpc.is_loopback(args.host)):
+        print(f"set {shards.AUTHKEY_ENV} to run shards on {args.host}; without it only 127.0.0.1 is allowed",
+              file=sys.stderr)
+        return 2
+    procs, addresses = [], []
+    for i in range(args.n):
+        address = f"{args.host}:{args.port + i}"
+        env = {**os.environ, "SMARTRESEARCH_DATA": str(DATA_DIR / f"shard-{i}")}
+        env.pop("SR_SHARDS", None)
+        # the shards live in their own data stores: hand them this store's key, which the API reads too
+        env[shards.AUTHKEY_ENV] = key.decode("utf-8")
+        procs.append(subprocess.Popen([sys.executable, __file__, "shard-server", "--address", address], env=env))
+        addresses.append(address)
+    print(f"start the API with SR_SHARDS={','.join(addresses)} (then POST /api/reindex to fill the shards)")
+    try:
+        for p in procs:
+            p.wait()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+    return max((p.returncode or 0) for p in procs)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="smartresearch", description="SmartResearch backend tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("upload-batch", help="ingest several PDFs in one batch")
+    p.add_argument("files", nargs="+", help="PDF files to ingest")
+    p.add_argument("--workers", type=int, default=BATCH_WORKERS, help="parallel extraction workers")
+    p.set_defaults(func=cmd_upload_batch)
+
+    p = sub.add_parser("import-dir", help="bulk-import a directory of PDFs (resumable)")
+    p.add_argument("directory", help="folder to walk for *.pdf")
+    p.add_argument("--workers", type=int, default=BATCH_WORKERS, help="parallel extraction workers")
+    p.add_argument("--batch-size", type=int, default=200, help="files per index commit")
+    p.add_argument("--checkpoint", help="checkpoint file (default: one per directory in the data store)")
+    p.add_argument("--no-recursive", dest="recursive", action="store_false", help="only the top-level folder")
+    p.add_argument("--restart", action="store_true", help="ignore the checkpoint and import everything again")
+    p.set_defaults(func=cmd_import_dir)
+
+    p = sub.add_parser("eval-index", help="measure recall@k and latency of the semantic index")
+    p.add_argument("--queries", type=int, default=200, help="sampled query vectors")
+    p.add_argument("--k", type=int, default=10, help="neighbours compared per query")
+    p.set_defaults(func=cmd_eval_index)
+
+    p = sub.add_parser("check-encoder", help="compare a quantized/ONNX encoder backend against the reference model")
+    p.add_argument("--backend", default=None, help="int8 | onnx | torch (default: SR_EMB_BACKEND)")
+    p.add_argument("--samples", type=int, default=200, help="chunks sampled from stored docs")
+    p.add_argument("--min-cosine", type=float, default=None, help="fail below this per-chunk cosine (default: SR_EMB_MIN_COSINE)")
+    p.set_defaults(func=cmd_check_encoder)
+
+    p = sub.add_parser("embed-server", help="run one shared micro-batching embedding process for all API workers")
+    p.add_argument("--address", default=os.getenv("SR_EMBED_SERVER") or "127.0.0.1:8765", help="host:port to listen on")
+    p.add_argument("--max-batch", type=int, default=embed_server.MAX_BATCH, help="texts per encoder call")
+    p.add_argument("--max-wait-ms", type=float, default=embed_server.MAX_WAIT_MS, help="how long a batch waits to fill")
+    p.set_defaults(func=cmd_embed_server)
+
+    p = sub.add_parser("shard-server", help="serve one shard of the semantic index (data under SMARTRESEARCH_DATA)")
+    p.add_argument("--address", required=True, help="host:port to listen on")
+    p.set_defaults(func=cmd_shard_server)
+
+    p = sub.add_parser("shards", help="run N local shard servers for SR_SHARDS (one process each)")
+    p.add_argument("--n", type=int, default=4, help="number of shards")
+    p.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    p.add_argument("--port", type=int, default=8801, help="port of shard 0 (shard i listens on port + i)")
+    p.set_defaults(func=cmd_shards)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 
 # --- new full metadata models ---
 class FullMetadata(BaseModel):
@@ -27,6 +27,44 @@ class UploadResponse(BaseModel):
     preview: str
     used_ocr: bool = False  # true if OCR was used instead of direct extraction
     meta: Optional[FullMetadata] = None
+    job_id: Optional[str] = None  # background ingestion job, poll /api/jobs/{job_id}
+    status: str = "done"          # 'queued' while the job is still pending
+    duplicate: bool = False       # same file content was already stored; existing doc returned
+
+
+# background ingestion jobs
+class JobStage(BaseModel):
+    """status and timing of one ingestion stage"""
+    name: str
+    status: str  # pending | waiting | running | done | skipped | cached | failed
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+    items_done: Optional[int] = None   # item counts for batch stages
+    items_total: Optional[int] = None
+
+
+class BatchUploadResponse(BaseModel):
+    """result of a multi-file upload"""
+    docs: List[UploadResponse]
+    chunks: int = 0  # semantic chunks embedded across the batch
+    failed: List[str] = Field(default_factory=list)  # filenames that could not be ingested
+
+
+class JobResponse(BaseModel):
+    """progress report for a background ingestion job"""
+    id: str
+    doc_id: Optional[str] = None  # None for batch jobs
+    name: str
+    status: str  # queued | running | done | failed
+    progress: float
+    error: Optional[str] = None
+    created: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    stages: List[JobStage]
+    result: Optional[Union[UploadResponse, BatchUploadResponse]] = None
 
 
 class SummarizeRequest(BaseModel):
@@ -79,11 +117,15 @@ class ClusterResponse(BaseModel):
 
 # text and search
 class TextResponse(BaseModel):
-    """text content returned for a document"""
+    """text content returned for a document (whole text, one page, or a char window)"""
     id: str
     name: str
     text: str
-    n_chars: int
+    n_chars: int                       # length of the whole document
+    n_pages: Optional[int] = None
+    page: Optional[int] = None         # set when a single page was requested
+    offset: int = 0                    # char offset of `text` within the document
+    next_offset: Optional[int] = None  # where the next window starts, None at the end
 
 
 class SearchRequest(BaseModel):
@@ -106,6 +148,23 @@ class SearchResponse(BaseModel):
     hits: List[SearchHit]
 
 
+class BatchSearchRequest(BaseModel):
+    """several semantic queries answered in one call"""
+    queries: List[str] = Field(..., min_length=1, max_length=256)
+    topk: int = Field(default=10, ge=1, le=100)
+
+
+class BatchSearchResult(BaseModel):
+    """hits for one query of a batch"""
+    q: str
+    hits: List[SearchHit]
+
+
+class BatchSearchResponse(BaseModel):
+    """per-query results, in request order"""
+    results: List[BatchSearchResult]
+
+
 class MetaResponse(BaseModel):
     """stored metadata response for a document"""
     id: str
@@ -1,18 +1,39 @@
-import os
+import os, threading
 from typing import Tuple
-from transformers import pipeline
 
 # default summariser model
 MODEL_NAME = os.getenv("SR_SUMM_MODEL", "sshleifer/distilbart-cnn-12-6")
 
-# initialise pipeline once (don’t reload on every call)
-_summariser = pipeline(
-    "summarization",
-    model=MODEL_NAME,
-    tokenizer=MODEL_NAME,
-    framework="pt",
-    truncation=True
-)
+# pipeline is built once, on first use (importing this module stays cheap)
+_summariser = None
+_summariser_lock = threading.Lock()
+
+
+def _get_summariser():
+    """Build the summarization pipeline on first call and reuse it afterwards."""
+    global _summariser
+    if _summariser is None:
+        with _summariser_lock:
+            if _summariser is None:
+                from transformers import pipeline
+                _summariser = pipeline(
+                    "summarization",
+                    model=MODEL_NAME,
+                    tokenizer=MODEL_NAME,
+                    framework="pt",
+                    truncation=True
+                )
+    return _summariser
+
+
+def is_loaded() -> bool:
+    return _summariser is not None
+
+
+def warmup():
+    """Load the summariser now instead of on the first request."""
+    _get_summariser()
+
 
 def abstractive_summarize(text: str, target: str = "medium") -> Tuple[str, int]:
     """
@@ -35,15 +56,16 @@ def abstractive_summarize(text: str, target: str = "medium") -> Tuple[str, int]:
     words = text.split()
     chunks = [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
 
+    summariser = _get_summariser()
     results = []
     for ch in chunks:
-        out = _summariser(ch, max_length=summary_len, min_length=50, do_sample=False)
+        out = summariser(ch, max_length=summary_len, min_length=50, do_sample=False)
         results.append(out[0]["summary_text"].strip())
 
     # optional “summary of summaries” if it’s long
     joined = " ".join(results)
     if len(results) > 2:
-        final = _summariser(joined, max_length=summary_len, min_length=50, do_sample=False)
+        final = summariser(joined, max_length=summary_len, min_length=50, do_sample=False)
         joined = final[0]["summary_text"].strip()
 
     return joined, len(chunks)
@@ -0,0 +1,368 @@
+import os, json
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+from services import quant
+
+# optional FAISS acceleration (used if installed)
+try:
+    import faiss
+    HAS_FAISS = True
+except Exception:
+    HAS_FAISS = False
+
+
+# config
+# auto = exact search for small corpora, IVF once it passes ANN_THRESHOLD chunks
+ANN_MODE = os.getenv("SR_ANN_MODE", "auto").lower()      # auto | flat | ivf | hnsw
+ANN_THRESHOLD = int(os.getenv("SR_ANN_THRESHOLD", "50000"))
+# IVF: number of coarse cells (0 = ~4*sqrt(N)) and cells probed per query
+IVF_NLIST = int(os.getenv("SR_ANN_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("SR_ANN_NPROBE", "16"))
+# HNSW: graph degree, build-time and query-time beam width
+HNSW_M = int(os.getenv("SR_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("SR_HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("SR_HNSW_EF_SEARCH", "64"))
+
+# training points per IVF cell (k-means on a sample, not the whole corpus)
+_TRAIN_PER_LIST = 64
+# retrain IVF once the corpus has grown this much past what it was trained on
+_RETRAIN_GROWTH = 4.0
+_BLOCK = 65536
+
+# ids -> (ids still present, their vectors); how the NumPy IVF reads the store
+Fetch = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+_warned_uncompressed = False
+
+
+def _warn_uncompressed():
+    """SR_VEC_COMPRESSION has no NumPy IVF counterpart: say so once instead of silently ignoring it"""
+    global _warned_uncompressed
+    if quant.COMPRESSION != "none" and not _warned_uncompressed:
+        _warned_uncompressed = True
+        print(f"⚠️ SR_VEC_COMPRESSION={quant.COMPRESSION} is ignored by the NumPy IVF index "
+              "(install FAISS for compressed IVF/HNSW); vectors stay float32")
+
+
+def choose_kind(n: int) -> str:
+    """Index kind for a corpus of n vectors under the configured SR_ANN_MODE."""
+    mode = ANN_MODE if ANN_MODE in ("flat", "ivf", "hnsw") else "auto"
+    if mode == "auto":
+        return "flat" if n < ANN_THRESHOLD else "ivf"
+    if mode == "hnsw" and not HAS_FAISS:
+        return "ivf"  # no HNSW without FAISS; the NumPy IVF is the closest thing
+    return mode
+
+
+def _nlist_for(n: int) -> int:
+    if IVF_NLIST > 0:
+        return max(1, min(IVF_NLIST, n))
+    return max(1, min(int(4 * np.sqrt(max(n, 1))), n // 39 or 1))
+
+
+def _train_sample(vecs: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    n = vecs.shape[0]
+    m = min(n, nlist * _TRAIN_PER_LIST)
+    if m == n:
+        return np.ascontiguousarray(vecs, dtype="float32")
+    rows = np.sort(np.random.default_rng(seed).choice(n, m, replace=False))
+    return np.ascontiguousarray(vecs[rows], dtype="float32")
+
+
+def _pad(D: List[np.ndarray], I: List[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """stack per-query results into faiss-style (m, k) arrays, padding with -1 / -inf"""
+    Dm = np.full((len(D), k), -np.inf, dtype="float32")
+    Im = np.full((len(I), k), -1, dtype="int64")
+    for j, (d, i) in enumerate(zip(D, I)):
+        Dm[j, : len(d)] = d
+        Im[j, : len(i)] = i
+    return Dm, Im
+
+
+def _sq_type(compression: str):
+    return faiss.ScalarQuantizer.QT_fp16 if compression == "fp16" else faiss.ScalarQuantizer.QT_8bit
+
+
+def _id_mapped(inner):
+    ix = faiss.IndexIDMap2(inner)
+    ix.own_fields = True
+    inner.this.disown()
+    return ix
+
+
+class FaissIndex:
+    """
+    FAISS index addressed by stable int64 ids, in one of three kinds:
+    flat (exact inner product), ivf (IVF, trained) or hnsw (graph), each
+    storing full float32 vectors or compressed codes (fp16 / int8 / PQ,
+    see quant.py). Vectors are expected to be L2-normalized, so inner
+    product = cosine.
+    """
+
+    backend = "faiss"
+
+    def __init__(self, kind: str, dim: int, index=None, trained_on: int = 0, compression: str = "none"):
+        self.kind = kind
+        self.dim = dim
+        self.trained_on = trained_on
+        self.compression = compression
+        self.index = index if index is not None else self._empty(kind, dim, 1, compression)
+
+    @staticmethod
+    def _empty(kind: str, dim: int, nlist: int = 1, compression: str = "none"):
+        ip = faiss.METRIC_INNER_PRODUCT
+        if kind == "ivf":
+            quantizer = faiss.IndexFlatIP(dim)
+            if compression == "pq":
+                ix = faiss.IndexIVFPQ(quantizer, dim, nlist, quant.pq_m(dim), 8, ip)
+            elif compression in ("fp16", "int8"):
+                ix = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, _sq_type(compression), ip)
+            else:
+                ix = faiss.IndexIVFFlat(quantizer, dim, nlist, ip)
+            ix.own_fields = True
+            quantizer.this.disown()
+            return ix
+        if kind == "hnsw":
+            if compression == "pq":
+                # HNSW-PQ is L2 only; on unit vectors that ranks like inner product, and hits are re-scored
+                inner = faiss.IndexHNSWPQ(dim, quant.pq_m(dim), HNSW_M)
+            elif compression in ("fp16", "int8"):
+                inner = faiss.IndexHNSWSQ(dim, _sq_type(compression), HNSW_M, ip)
+            else:
+                inner = faiss.IndexHNSWFlat(dim, HNSW_M, ip)
+            inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            return _id_mapped(inner)
+        if compression == "pq":
+            return _id_mapped(faiss.IndexPQ(dim, quant.pq_m(dim), 8, ip))
+        if compression in ("fp16", "int8"):
+            return _id_mapped(faiss.IndexScalarQuantizer(dim, _sq_type(compression), ip))
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    @classmethod
+    def build(cls, kind: str, vecs: np.ndarray, ids: np.ndarray, compression: str = "none") -> "FaissIndex":
+        dim = vecs.shape[1]
+        n = vecs.shape[0]
+        out = cls(kind, dim, cls._empty(kind, dim, _nlist_for(n), compression),
+                  trained_on=n, compression=compression)
+        if not out.index.is_trained:
+            nlist = out.index.nlist if kind == "ivf" else 1
+            sample = _train_sample(vecs, nlist) if compression != "pq" else \
+                _train_sample(vecs, max(nlist, quant.PQ_MIN_TRAIN * 2 // _TRAIN_PER_LIST))
+            out.index.train(sample)
+        out.add(vecs, ids)
+        return out
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.index.ntotal)
+
+    def add(self, vecs: np.ndarray, ids: np.ndarray):
+        for s in range(0, vecs.shape[0], _BLOCK):
+            self.index.add_with_ids(
+                np.ascontiguousarray(vecs[s: s + _BLOCK], dtype="float32"),
+                np.ascontiguousarray(ids[s: s + _BLOCK], dtype="int64"),
+            )
+
+    def remove(self, ids: np.ndarray) -> bool:
+        """Physically remove ids. False if this kind can't delete (HNSW): filter instead."""
+        if self.kind == "hnsw":
+            return False
+        self.index.remove_ids(np.ascontiguousarray(ids, dtype="int64"))
+        return True
+
+    def search(self, q: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.kind == "ivf":
+            self.index.nprobe = max(1, min(nprobe or IVF_NPROBE, self.index.nlist))
+        elif self.kind == "hnsw":
+            faiss.downcast_index(self.index.index).hnsw.efSearch = max(k, ef_search or HNSW_EF_SEARCH)
+        return self.index.search(np.ascontiguousarray(q, dtype="float32"), k)
+
+    def needs_retrain(self) -> bool:
+        if self.compression != quant.effective(quant.COMPRESSION, self.ntotal):
+            return True
+        trained = self.kind == "ivf" or self.compression in ("int8", "pq")
+        return trained and self.ntotal > _RETRAIN_GROWTH * max(self.trained_on, 1)
+
+    def memory_bytes(self) -> int:
+        return int(faiss.serialize_index(self.index).nbytes)
+
+    def save(self, path: Path):
+        faiss.write_index(self.index, str(path))
+
+    @classmethod
+    def load(cls, path: Path, meta: dict) -> "FaissIndex":
+        return cls(meta["kind"], int(meta["dim"]), faiss.read_index(str(path)),
+                   trained_on=int(meta.get("trained_on", 0)),
+                   compression=meta.get("compression", "none"))
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """spherical k-means (inner product on normalized vectors); returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    c = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ c.T, axis=1)
+        sums = np.zeros_like(c)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty cells from random points
+            sums[empty] = x[rng.choice(x.shape[0], int(empty.sum()))]
+        c = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return c.astype("float32")
+
+
+class NumpyIVF:
+    """
+    Pure-NumPy inverted-file index for when FAISS isn't installed.
+    Holds only centroids and per-cell id lists; candidate vectors are read
+    from the vector store through `fetch`, so nothing is duplicated in memory.
+    """
+
+    backend = "numpy"
+    kind = "ivf"
+    compression = "none"  # holds ids only; candidates are scored against the float32 store
+
+    def __init__(self, centroids: np.ndarray, lists: List[np.ndarray], fetch: Fetch, trained_on: int = 0):
+        _warn_uncompressed()
+        self.centroids = centroids
+        self.lists = lists
+        self.fetch = fetch
+        self.trained_on = trained_on
+        self.dim = centroids.shape[1]
+
+    @classmethod
+    def build(cls, vecs: np.ndarray, ids: np.ndarray, fetch: Fetch) -> "NumpyIVF":
+        n = vecs.shape[0]
+        centroids = _kmeans(_train_sample(vecs, _nlist_for(n)), _nlist_for(n))
+        out = cls(centroids, [np.zeros(0, dtype="int64") for _ in range(len(centroids))], fetch, trained_on=n)
+        out.add(vecs, ids)
+        return out
+
+    @property
+    def ntotal(self) -> int:
+        return int(sum(len(l) for l in self.lists))
+
+    def add(self, vecs: np.ndarray, ids: np.ndarray):
+        ids = np.asarray(ids, dtype="int64")
+        for s in range(0, vecs.shape[0], _BLOCK):
+            assign = np.argmax(np.asarray(vecs[s: s + _BLOCK], dtype="float32") @ self.centroids.T, axis=1)
+            blk = ids[s: s + _BLOCK]
+            for cell in np.unique(assign):
+                self.lists[cell] = np.concatenate([self.lists[cell], blk[assign == cell]])
+
+    def remove(self, ids: np.ndarray) -> bool:
+        ids = np.asarray(ids, dtype="int64")
+        self.lists = [l[~np.isin(l, ids)] if len(l) else l for l in self.lists]
+        return True
+
+    def search(self, q: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        q = np.asarray(q, dtype="float32").reshape(-1, self.dim)
+        probe = max(1, min(nprobe or IVF_NPROBE, len(self.lists)))
+        cells = np.argsort(-(q @ self.centroids.T), axis=1)[:, :probe]
+        D, I = [], []
+        for qi, row in zip(q, cells):
+            cand = np.concatenate([self.lists[c] for c in row])
+            ids, vecs = self.fetch(cand)
+            if len(ids) == 0:
+                D.append(np.zeros(0)); I.append(np.zeros(0, dtype="int64"))
+                continue
+            sims = vecs @ qi
+            top = np.argsort(-sims)[:k]
+            D.append(sims[top]); I.append(ids[top])
+        return _pad(D, I, k)
+
+    def needs_retrain(self) -> bool:
+        return self.ntotal > _RETRAIN_GROWTH * max(self.trained_on, 1)
+
+    def memory_bytes(self) -> int:
+        return int(self.centroids.nbytes + 8 * self.ntotal)
+
+    def save(self, path: Path):
+        sizes = np.array([len(l) for l in self.lists], dtype="int64")
+        ids = np.concatenate(self.lists) if self.lists else np.zeros(0, dtype="int64")
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, sizes=sizes, ids=ids)
+
+    @classmethod
+    def load(cls, path: Path, meta: dict, fetch: Fetch) -> "NumpyIVF":
+        with np.load(path) as z:
+            centroids, sizes, ids = z["centroids"], z["sizes"], z["ids"]
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        lists = [ids[bounds[i]: bounds[i + 1]] for i in range(len(sizes))]
+        return cls(centroids, lists, fetch, trained_on=int(meta.get("trained_on", 0)))
+
+
+def build(kind: str, vecs: np.ndarray, ids: np.ndarray, fetch: Fetch):
+    """
+    Build an index of the given kind over (vecs, ids), compressed per
+    SR_VEC_COMPRESSION (compressed indexes re-score their hits exactly).
+    Returns None for uncompressed flat search without FAISS
+    (callers scan the matrix directly).
+    """
+    compression = quant.effective(quant.COMPRESSION, vecs.shape[0])
+    if HAS_FAISS:
+        ix = FaissIndex.build(kind, vecs, ids, compression)
+    elif kind != "flat":
+        return NumpyIVF.build(vecs, ids, fetch)
+    elif compression == "none" or vecs.shape[0] == 0:
+        return None
+    else:
+        ix = quant.CompressedFlat.build(vecs, ids, compression)
+    return _wrap(ix, fetch)
+
+
+def _wrap(ix, fetch: Fetch):
+    return quant.Reranked(ix, fetch) if getattr(ix, "compression", "none") != "none" else ix
+
+
+def worth_saving(index) -> bool:
+    """trained or compressed indexes are persisted; a plain flat one is as cheap to rebuild as to load"""
+    return index is not None and (index.kind != "flat" or index.compression != "none")
+
+
+def save(index, path: Path, meta: dict, ids: np.ndarray):
+    """
+    Persist a trained index next to the ids it contains, so a restart can
+    load it and only replay what changed since instead of retraining.
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    index.save(tmp)
+    os.replace(tmp, path)
+    ids_path = path.with_name(path.name + ".ids.npy")
+    with open(ids_path.with_name(ids_path.name + ".tmp"), "wb") as f:
+        np.save(f, np.asarray(ids, dtype="int64"))
+    os.replace(ids_path.with_name(ids_path.name + ".tmp"), ids_path)
+    table = {**meta, "kind": index.kind, "backend": index.backend, "compression": index.compression,
+             "dim": int(index.dim), "trained_on": int(index.trained_on)}
+    meta_path = path.with_name(path.name + ".json")
+    meta_path.with_name(meta_path.name + ".tmp").write_text(json.dumps(table), encoding="utf-8")
+    os.replace(meta_path.with_name(meta_path.name + ".tmp"), meta_path)
+
+
+def load(path: Path, fetch: Fetch) -> Tuple[Optional[object], dict, np.ndarray]:
+    """Load a saved index: (index or None, meta, ids it contained at save time)."""
+    meta_path = path.with_name(path.name + ".json")
+    ids_path = path.with_name(path.name + ".ids.npy")
+    if not (path.exists() and meta_path.exists() and ids_path.exists()):
+        return None, {}, np.zeros(0, dtype="int64")
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    ids = np.load(ids_path)
+    if meta.get("backend") == "faiss" and HAS_FAISS:
+        return _wrap(FaissIndex.load(path, meta), fetch), meta, ids
+    if meta.get("backend") == "numpy" and meta.get("kind") == "flat":
+        return _wrap(quant.CompressedFlat.load(path, meta), fetch), meta, ids
+    if meta.get("backend") == "numpy":
+        return NumpyIVF.load(path, meta, fetch), meta, ids
+    return None, meta, ids
+
+
+def remove_files(path: Path):
+    for p in (path, path.with_name(path.name + ".json"), path.with_name(path.name + ".ids.npy")):
+        if p.exists():
+            p.unlink()
@@ -0,0 +1,231 @@
+import os
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+from PyPDF2.generic import ContentStream
+
+from services.ocr import OCR_DPI
+
+# never rasterize below this, whatever the glyph size says
+MIN_OCR_DPI = int(os.getenv("SR_OCR_MIN_DPI", "150"))
+
+# pages with fewer characters than this count as having no text layer
+MIN_TEXT_CHARS = 20
+# chars per square inch; a normal text page is ~30-60
+LOW_TEXT_DENSITY = 4.0
+# fraction of the page covered by images that makes it look like a scan
+SCAN_COVERAGE = 0.6
+# how deep Form XObjects are searched for the images they draw
+MAX_FORM_DEPTH = 4
+# operators that put marks on the page: text showing and path filling
+# (text converted to outlines is all fills)
+_PAINT_OPS = {b"Tj", b"TJ", b"'", b'"', b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*", b"sh"}
+
+# tesseract wants an x-height of ~20px; x-height is ~0.5em, so
+# dpi >= 20px / (0.5 * size_pt / 72) = 2880 / size_pt
+_GLYPH_DPI_FACTOR = 2880.0
+
+
+def _resolve(obj):
+    """follow an indirect reference if there is one"""
+    try:
+        return obj.get_object()
+    except AttributeError:
+        return obj
+
+
+def _page_size(page) -> Tuple[float, float]:
+    """page width/height in points"""
+    box = page.mediabox
+    return abs(float(box.width)), abs(float(box.height))
+
+
+def _has_fonts(page) -> bool:
+    try:
+        res = _resolve(page.get("/Resources")) or {}
+        fonts = _resolve(res.get("/Font")) or {}
+        return len(fonts) > 0
+    except Exception:
+        return False
+
+
+def _inline_images(stream, pdf) -> List[Tuple[int, int]]:
+    """pixel sizes of the inline (BI ... ID ... EI) images in a content stream"""
+    try:
+        ops = ContentStream(stream, pdf).operations
+    except Exception:
+        return []
+    return [_inline_size(operands) for operands, op in ops if op == b"INLINE IMAGE"]
+
+
+def _inline_size(ii) -> Tuple[int, int]:
+    settings = ii.get("settings", {}) if isinstance(ii, dict) else {}
+    return (int(settings.get("/W", settings.get("/Width", 0))),
+            int(settings.get("/H", settings.get("/Height", 0))))
+
+
+def _xobject_images(res, pdf, depth: int = 0) -> Dict[str, Tuple[int, int, float, float]]:
+    """
+    XObjects that put an image on the page: name -> (pixel width, pixel
+    height, width, height in the object's own units). Images are a unit
+    square; a Form XObject counts with the largest image it draws (nested
+    forms and inline images included) over its /BBox.
+    """
+    out = {}
+    try:
+        xobjs = _resolve(res.get("/XObject")) or {}
+    except Exception:
+        return out
+    for name, ref in xobjs.items():
+        try:
+            x = _resolve(ref)
+            subtype = x.get("/Subtype")
+            if subtype == "/Image":
+                out[str(name)] = (int(x.get("/Width", 0)), int(x.get("/Height", 0)), 1.0, 1.0)
+            elif subtype == "/Form" and depth < MAX_FORM_DEPTH:
+                inner = [(w, h) for w, h, _, _ in
+                         _xobject_images(_resolve(x.get("/Resources")) or {}, pdf, depth + 1).values()]
+                inner += _inline_images(x, pdf)
+                if inner:
+                    w_px, h_px = max(inner, key=lambda wh: wh[0] * wh[1])
+                    bbox = [float(v) for v in (x.get("/BBox") or [0, 0, 1, 1])]
+                    out[str(name)] = (w_px, h_px, abs(bbox[2] - bbox[0]), abs(bbox[3] - bbox[1]))
+        except Exception:
+            continue
+    return out
+
+
+def _images(page) -> Dict[str, Tuple[int, int, float, float]]:
+    """image-bearing XObjects on the page (see _xobject_images)"""
+    try:
+        res = _resolve(page.get("/Resources")) or {}
+    except Exception:
+        return {}
+    return _xobject_images(res, page.pdf)
+
+
+def _scan_content(page, images: Dict[str, Tuple[int, int, float, float]]
+                  ) -> Tuple[List[Tuple[float, float, int, int]], List[float], bool, bool]:
+    """
+    Walk the content stream once.
+    Returns (placed images as (w_pt, h_pt, w_px, h_px), effective font sizes
+    in pt, whether the stream could be parsed, whether it paints anything
+    besides those images: shown text, filled paths or Form XObjects).
+    Inline images count as placed.
+    Only the current cm / Tm scale is tracked (q/Q nesting is approximated),
+    which is plenty for telling a full-page scan from a text page.
+    """
+    placed, sizes, painted = [], [], False
+    try:
+        contents = page.get_contents()
+        if contents is None:
+            return placed, sizes, True, False
+        ops = ContentStream(contents, page.pdf).operations
+    except Exception:
+        return placed, sizes, False, False
+
+    stack: List[Tuple[float, float]] = []
+    ctm = (1.0, 1.0)   # current x/y scale
+    tm_scale = 1.0
+    for operands, op in ops:
+        if op in _PAINT_OPS:
+            painted = True
+            continue
+        try:
+            if op == b"q":
+                stack.append(ctm)
+            elif op == b"Q":
+                ctm = stack.pop() if stack else (1.0, 1.0)
+            elif op == b"cm" and len(operands) == 6:
+                a, b, c, d = (float(v) for v in operands[:4])
+                sx = (a * a + b * b) ** 0.5
+                sy = (c * c + d * d) ** 0.5
+                ctm = (ctm[0] * sx, ctm[1] * sy)
+            elif op == b"Tm" and len(operands) == 6:
+                a, b = float(operands[0]), float(operands[1])
+                tm_scale = (a * a + b * b) ** 0.5 or 1.0
+            elif op == b"Tf" and len(operands) == 2:
+                size = abs(float(operands[1])) * tm_scale * ctm[1]
+                if size > 0:
+                    sizes.append(size)
+            elif op == b"Do" and operands:
+                name = str(operands[0])
+                if name in images:
+                    w_px, h_px, w_unit, h_unit = images[name]
+                    placed.append((abs(ctm[0]) * w_unit, abs(ctm[1]) * h_unit, w_px, h_px))
+                else:
+                    painted = True  # a form: may hold text or outlines
+            elif op == b"INLINE IMAGE":
+                w_px, h_px = _inline_size(operands)
+                placed.append((abs(ctm[0]), abs(ctm[1]), w_px, h_px))
+        except Exception:
+            continue
+    return placed, sizes, True, painted
+
+
+def classify_page(page, text: Optional[str] = None) -> dict:
+    """
+    Cheaply decide whether a PyPDF2 page needs OCR, and at what DPI.
+    Looks at the text layer (length, density), font resources and how much
+    of the page is covered by images. Returns
+    {"needs_ocr", "dpi", "reason", "chars", "density", "coverage"}.
+    """
+    if text is None:
+        try:
+            text = (page.extract_text() or "").strip()
+        except Exception:
+            text = ""
+
+    w_pt, h_pt = _page_size(page)
+    area_in2 = max((w_pt / 72.0) * (h_pt / 72.0), 1e-6)
+    chars = len(text)
+    density = chars / area_in2
+    fonts = _has_fonts(page)
+
+    info = {"needs_ocr": False, "dpi": OCR_DPI, "reason": "text",
+            "chars": chars, "density": round(density, 2), "coverage": 0.0}
+
+    # healthy text layer: no need to look any closer
+    if chars >= MIN_TEXT_CHARS and density >= LOW_TEXT_DENSITY and fonts:
+        return info
+
+    images = _images(page)
+    placed, sizes, parsed, painted = _scan_content(page, images)
+
+    page_area = max(w_pt * h_pt, 1e-6)
+    coverage = min(1.0, sum(w * h for w, h, _, _ in placed) / page_area)
+    if images and not placed:
+        # image not found in the stream walk (e.g. inside a form): assume full page
+        coverage = 1.0
+    info["coverage"] = round(coverage, 3)
+
+    if chars < MIN_TEXT_CHARS:
+        if not images and not placed:
+            if parsed and not painted:
+                # nothing is drawn at all: nothing to recognise
+                info["reason"] = "blank"
+                return info
+            # text or outlines are drawn but don't extract (fonts without a usable
+            # encoding, text converted to paths), or a stream we can't read
+            info["needs_ocr"] = True
+            info["reason"] = "no-text-layer" if parsed else "unreadable-content"
+        else:
+            info["needs_ocr"] = True
+            info["reason"] = "no-text-layer"
+    elif coverage >= SCAN_COVERAGE and density < LOW_TEXT_DENSITY:
+        # scan with a thin (or junk) text layer on top
+        info["needs_ocr"] = True
+        info["reason"] = "scan-with-thin-text"
+    else:
+        return info
+
+    # pick the lowest DPI that keeps glyphs legible
+    dpi = float(OCR_DPI)
+    native = [w_px / (w / 72.0) for w, _, w_px, _ in placed if w > 0 and w_px > 0]
+    if native:
+        # rasterizing above the scan's own resolution adds nothing
+        dpi = min(dpi, max(native))
+    if sizes:
+        dpi = min(dpi, _GLYPH_DPI_FACTOR / median(sizes))
+    dpi = int(round(dpi / 25.0) * 25)
+    info["dpi"] = max(MIN_OCR_DPI, min(OCR_DPI, dpi))
+    return info
@@ -0,0 +1,148 @@
+import os, json, bisect, threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+# neighbours kept per document (/api/similar requests up to this many are a lookup)
+GRAPH_K = int(os.getenv("SR_NEIGHBOURS_K", "20"))
+
+
+class NeighbourGraph:
+    """
+    Top-k most similar documents per document, each list sorted by score.
+
+    - put() stores a freshly computed exact list.
+    - offer() inserts a newly added doc into an existing list if it makes
+      the top k (so lists stay exact as the corpus grows).
+    - remove() forgets a doc and strikes it from every list that holds it.
+      Those lists are still exact, just shorter; they are flagged `short`
+      and only recomputed once someone asks for more than they hold.
+
+    Lists are computed lazily for docs that don't have one yet, so an empty
+    graph is always valid. Saved as JSON next to the vector store.
+
+    Writers hold `lock`; get() doesn't need it because lists are never
+    edited in place, only replaced by a new list.
+    """
+
+    def __init__(self, path: Path, k: int = GRAPH_K):
+        self.path = Path(path)
+        self.k = max(1, int(k))
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.lists: Dict[str, List[Tuple[str, float]]] = {}
+        self.rev: Dict[str, Set[str]] = {}  # doc → docs whose list contains it
+        self.short: Set[str] = set()
+        self.dirty = False
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.lists
+
+    def get(self, doc_id: str, topk: int) -> Optional[List[Tuple[str, float]]]:
+        """the stored top `topk`, or None if the stored list can't answer it exactly"""
+        nb = self.lists.get(doc_id)
+        if nb is None:
+            return None
+        if topk > len(nb) and (len(nb) >= self.k or doc_id in self.short):
+            return None
+        return nb[:topk]
+
+    def kth(self, doc_id: str) -> float:
+        """
+        score a new doc must beat to enter this list: -inf while it has room,
+        its last score if it is full or short (past the tail nothing is known)
+        """
+        nb = self.lists.get(doc_id)
+        if nb is None:
+            return float("inf")
+        if len(nb) >= self.k or doc_id in self.short:
+            return nb[-1][1] if nb else float("inf")
+        return float("-inf")
+
+    def _unlink(self, doc_id: str, nb: List[Tuple[str, float]]):
+        for other, _ in nb:
+            holders = self.rev.get(other)
+            if holders is not None:
+                holders.discard(doc_id)
+                if not holders:
+                    del self.rev[other]
+
+    def put(self, doc_id: str, neighbours: List[Tuple[str, float]]):
+        with self.lock:
+            self._unlink(doc_id, self.lists.get(doc_id, []))
+            nb = [(d, float(s)) for d, s in neighbours[: self.k]]
+            self.lists[doc_id] = nb
+            for other, _ in nb:
+                self.rev.setdefault(other, set()).add(doc_id)
+            self.short.discard(doc_id)
+            self.dirty = True
+
+    def offer(self, doc_id: str, other: str, score: float):
+        """insert `other` into doc_id's list if it makes the top k"""
+        with self.lock:
+            if doc_id not in self.lists or other == doc_id:
+                return
+            nb = [e for e in self.lists[doc_id] if e[0] != other]
+            if len(nb) != len(self.lists[doc_id]):
+                self.lists[doc_id] = nb
+            if score <= self.kth(doc_id):
+                return
+            pos = bisect.bisect_left([-s for _, s in nb], -score)
+            nb.insert(pos, (other, float(score)))
+            self.rev.setdefault(other, set()).add(doc_id)
+            if len(nb) > self.k:
+                self._unlink(doc_id, [nb.pop()])
+            self.lists[doc_id] = nb
+            self.dirty = True
+
+    def remove(self, doc_id: str):
+        """forget a doc: its own list and every entry pointing at it"""
+        with self.lock:
+            if doc_id not in self.lists and doc_id not in self.rev:
+                return
+            self._unlink(doc_id, self.lists.pop(doc_id, []))
+            self.short.discard(doc_id)
+            for holder in self.rev.pop(doc_id, ()):
+                nb = self.lists.get(holder)
+                if nb is not None:
+                    self.short.add(holder)
+                    self.lists[holder] = [e for e in nb if e[0] != doc_id]
+            self.dirty = True
+
+    # persistence
+    def save(self, stamp: dict):
+        """write the graph with a stamp describing the store state it matches"""
+        with self.lock:
+            data = {**stamp, "k": self.k, "short": sorted(self.short),
+                    "lists": {d: [[o, s] for o, s in nb] for d, nb in self.lists.items()}}
+            self.dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def load(self, stamp: dict) -> bool:
+        """reload a saved graph if its stamp (and k) match; otherwise start empty"""
+        with self.lock:
+            self.clear()
+            if not self.path.exists():
+                return False
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"⚠️ Failed to read neighbour graph: {e}")
+                return False
+            if data.get("k") != self.k or any(data.get(key) != val for key, val in stamp.items()):
+                print("♻️ Neighbour graph is out of date, recomputing lazily")
+                return False
+            for doc_id, nb in data.get("lists", {}).items():
+                self.put(doc_id, [(o, s) for o, s in nb])
+            self.short = set(data.get("short", [])) & set(self.lists)
+            self.dirty = False
+            return True
+
+    def remove_file(self):
+        for p in (self.path, self.path.with_name(self.path.name + ".tmp")):
+            if p.exists():
+                p.unlink()
@@ -0,0 +1,142 @@
+import os, sqlite3, threading, hashlib
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# upper bound on stored vectors (MB of float32 payload); least recently used rows go first
+CACHE_MB = float(os.getenv("SR_EMB_CACHE_MB", "512"))
+# an eviction pass frees this fraction of the bound, so it doesn't run again on every insert
+EVICT_SLACK = 0.1
+
+# sqlite caps bound parameters per statement; lookups are split into pieces this size
+_IN_CHUNK = 500
+
+
+def text_key(text: str) -> bytes:
+    """sha1 of the exact chunk text"""
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent (encoder, sha1(chunk text)) → vector cache in SQLite, so
+    re-ingesting or reindexing only encodes chunks whose text changed.
+
+    Rows carry a last-used tick; once the payload passes `max_mb`, the
+    least recently used rows are evicted. The file is opened on first use.
+    """
+
+    def __init__(self, path: Path, max_mb: float = CACHE_MB):
+        self.path = Path(path)
+        self.max_mb = max_mb
+        self._conn = None
+        self._lock = threading.Lock()
+        self._tick = 0
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vecs ("
+                " encoder TEXT NOT NULL, hash BLOB NOT NULL, vec BLOB NOT NULL, used INTEGER NOT NULL,"
+                " PRIMARY KEY (encoder, hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS vecs_used ON vecs (used)")
+            self._tick = conn.execute("SELECT COALESCE(MAX(used), 0) FROM vecs").fetchone()[0]
+            self._bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM vecs").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_mb > 0
+
+    def get_many(self, encoder: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """{position in texts: cached vector} for every text already cached"""
+        if not self.enabled or not texts:
+            return {}
+        keys = [text_key(t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            db = self._db()
+            uniq = list(dict.fromkeys(keys))
+            for s in range(0, len(uniq), _IN_CHUNK):
+                part = uniq[s: s + _IN_CHUNK]
+                rows = db.execute(
+                    f"SELECT hash, vec FROM vecs WHERE encoder = ? AND hash IN ({','.join('?' * len(part))})",
+                    [encoder, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[bytes(h)] = np.frombuffer(blob, dtype="float32")
+            if found:
+                self._tick += 1
+                db.executemany("UPDATE vecs SET used = ? WHERE encoder = ? AND hash = ?",
+                               [(self._tick, encoder, h) for h in found])
+                db.commit()
+            out = {i: found[k] for i, k in enumerate(keys) if k in found}
+            self.hits += len(out)
+            self.misses += len(keys) - len(out)
+        return out
+
+    def put_many(self, encoder: str, texts: List[str], vecs: np.ndarray):
+        if not self.enabled or not texts:
+            return
+        vecs = np.asarray(vecs, dtype="float32")
+        with self._lock:
+            db = self._db()
+            self._tick += 1
+            rows = {text_key(t): vecs[i].tobytes() for i, t in enumerate(texts)}
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO vecs (encoder, hash, vec, used) VALUES (?, ?, ?, ?)",
+                           [(encoder, h, blob, self._tick) for h, blob in rows.items()])
+            added = db.total_changes - before
+            if added:
+                self._bytes += added * vecs.shape[1] * 4
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection):
+        """drop least recently used rows until the payload is EVICT_SLACK under the bound"""
+        limit = self.max_mb * 1024 * 1024
+        if self._bytes <= limit:
+            return
+        n_rows, total = db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vec)), 0) FROM vecs").fetchone()
+        if not n_rows:
+            self._bytes = 0
+            return
+        per_row = total / n_rows
+        drop = int((total - limit * (1 - EVICT_SLACK)) / per_row) + 1
+        if drop <= 0:
+            self._bytes = total
+            return
+        cur = db.execute("DELETE FROM vecs WHERE rowid IN (SELECT rowid FROM vecs ORDER BY used LIMIT ?)", (drop,))
+        self.evictions += cur.rowcount
+        self._bytes = db.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM vecs").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM vecs")
+            db.commit()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT COUNT(*) FROM vecs").fetchone()[0] if self._conn else None
+            total = self.hits + self.misses
+            return {
+                "path": str(self.path),
+                "rows": rows,
+                "bytes": int(self._bytes),
+                "max_mb": self.max_mb,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,191 @@
+import os, queue, itertools, threading, time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from services.rpc import RpcClient
+from services import rpc
+
+# largest micro-batch handed to the encoder in one call
+MAX_BATCH = int(os.getenv("SR_EMBED_MAX_BATCH", os.getenv("SR_EMB_BATCH", "64")))
+# how long the first request of a batch waits for others to join it
+MAX_WAIT_MS = float(os.getenv("SR_EMBED_MAX_WAIT_MS", "5"))
+# host:port of a shared embedding sidecar (`python cli.py embed-server`); empty = in-process worker
+SERVER_ADDRESS = os.getenv("SR_EMBED_SERVER", "")
+# shared secret of the sidecar (SR_EMBED_AUTHKEY); unset = per-install key in SMARTRESEARCH_DATA, loopback only
+AUTHKEY_ENV = "SR_EMBED_AUTHKEY"
+KEY_FILE = "embed_server.key"
+
+
+def authkey() -> Tuple[bytes, bool]:
+    """(key, set explicitly) for sidecar connections, see rpc.authkey"""
+    return rpc.authkey(AUTHKEY_ENV, KEY_FILE)
+
+
+class _Gather:
+    """collects the pieces of one request and resolves its future once all are in"""
+
+    def __init__(self, n_parts: int):
+        self.future: Future = Future()
+        self.parts: List[Optional[np.ndarray]] = [None] * n_parts
+        self.remaining = n_parts
+        self.lock = threading.Lock()
+
+    def done(self, slot: int, vecs: np.ndarray):
+        with self.lock:
+            self.parts[slot] = vecs
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last and not self.future.done():
+            self.future.set_result(np.vstack(self.parts) if len(self.parts) > 1 else self.parts[0])
+
+    def fail(self, err: BaseException):
+        with self.lock:
+            if not self.future.done():
+                self.future.set_exception(err)
+
+
+class EmbedServer:
+    """
+    One encoder shared by every caller in the process. A worker thread pulls
+    requests off a queue and coalesces them into micro-batches: the first
+    request waits up to `max_wait` seconds for others to join, until the
+    batch holds `max_batch` texts. Identical texts in a batch are encoded once.
+
+    Requests bigger than one batch (bulk ingest) are split into pieces that
+    queue behind small ones (searches), so a long ingest never stalls queries.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], dim_fn: Callable[[], int],
+                 max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT_MS / 1000.0):
+        self._encode = encode_fn
+        self._dim = dim_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self._q: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = self.batches = self.texts = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="sr-embed-server", daemon=True)
+                self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """queue texts for encoding; the future resolves to a (len(texts), dim) array"""
+        self._start()
+        texts = list(texts)
+        pieces = [texts[i: i + self.max_batch] for i in range(0, len(texts), self.max_batch)] or [[]]
+        prio = 0 if len(pieces) == 1 else 1
+        sink = _Gather(len(pieces))
+        with self._lock:
+            self.requests += 1
+        for slot, piece in enumerate(pieces):
+            self._q.put((prio, next(self._seq), piece, sink, slot))
+        return sink.future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.submit(texts).result()
+
+    def dim(self) -> int:
+        return self._dim()
+
+    def _loop(self):
+        carry = None
+        while True:
+            first = carry or self._q.get()
+            carry = None
+            batch, n = [first], len(first[2])
+            deadline = time.monotonic() + self.max_wait
+            while n < self.max_batch:
+                try:
+                    item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if n + len(item[2]) > self.max_batch:
+                    carry = item
+                    break
+                batch.append(item)
+                n += len(item[2])
+            self._run(batch)
+
+    def _run(self, batch):
+        texts = [t for _, _, piece, _, _ in batch for t in piece]
+        uniq = list(dict.fromkeys(texts))
+        try:
+            vecs = np.asarray(self._encode(uniq), dtype="float32") if uniq else None
+        except Exception as e:
+            for _, _, _, sink, _ in batch:
+                sink.fail(e)
+            return
+        pos = {t: i for i, t in enumerate(uniq)}
+        with self._lock:
+            self.batches += 1
+            self.texts += len(texts)
+        for _, _, piece, sink, slot in batch:
+            if vecs is None or not piece:
+                width = vecs.shape[1] if vecs is not None else 0
+                sink.done(slot, np.zeros((0, width), dtype="float32"))
+            else:
+                sink.done(slot, vecs[[pos[t] for t in piece]])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": "thread",
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "requests": self.requests,
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "queued": self._q.qsize(),
+            }
+
+
+class RemoteEmbedder(RpcClient):
+    """
+    Client for an embedding sidecar started with serve(): same encode() /
+    dim() / stats() as EmbedServer, so every uvicorn worker can share one
+    model copy. Keeps a small pool of connections (one per concurrent caller).
+    """
+
+    def __init__(self, address: str = SERVER_ADDRESS, key: Optional[bytes] = None):
+        super().__init__(address, key or authkey()[0])
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.call("encode", list(texts))
+
+    def dim(self) -> int:
+        return int(self.call("dim"))
+
+    def stats(self) -> dict:
+        try:
+            remote = self.call("stats")
+        except Exception as e:
+            return {"mode": "sidecar", "address": self.label, "error": str(e)}
+        return {**remote, "mode": "sidecar", "address": self.label}
+
+
+def serve(address: str, server: EmbedServer, key: Optional[bytes] = None):
+    """
+    Run the sidecar: accept connections on host:port and feed every client's
+    texts into the one micro-batching `server` (blocks forever). Without
+    SR_EMBED_AUTHKEY (or `key`) it only listens on loopback.
+    """
+    key, explicit = (key, True) if key else authkey()
+    ops = {"encode": server.encode, "dim": server.dim, "stats": server.stats}
+
+    def dispatch(msg):
+        if msg[0] not in ops:
+            raise ValueError(f"unknown request {msg[0]!r}")
+        return ops[msg[0]](*msg[1:])
+
+    rpc.serve(address, dispatch, key, "Embedding server",
+              banner="🧠 Embedding server listening on {host}:{port} "
+                     f"(max batch {server.max_batch}, max wait {server.max_wait * 1000:.0f} ms)",
+              explicit_key=explicit)
@@ -0,0 +1,167 @@
+import os, time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+# which runtime executes the sentence encoder:
+#   torch - the full-precision SentenceTransformer (reference)
+#   int8  - same model with its Linear layers dynamically quantized to int8 (CPU)
+#   onnx  - the transformer exported to ONNX and run by onnxruntime (needs onnxruntime)
+EMB_BACKEND = os.getenv("SR_EMB_BACKEND", "torch").lower()
+BACKENDS = ("torch", "int8", "onnx")
+# exported ONNX graphs are cached here, one per model
+ONNX_DIR = Path(os.getenv("SMARTRESEARCH_DATA", "./data_store")) / "onnx"
+ONNX_THREADS = int(os.getenv("SR_ONNX_THREADS", "0"))  # 0 = onnxruntime default (all cores)
+# equivalence check: lowest per-text cosine to the reference model that still passes
+MIN_COSINE = float(os.getenv("SR_EMB_MIN_COSINE", "0.99"))
+
+try:
+    import onnxruntime as ort
+    HAS_ONNX = True
+except ImportError:
+    ort = None
+    HAS_ONNX = False
+
+
+def _load_reference(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def _quantize_int8(model):
+    """dynamic int8 quantization of every nn.Linear (weights int8, activations quantized on the fly)"""
+    import torch
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _ort_transformer(session, config):
+    """
+    Drop-in for a SentenceTransformer's inner HF model: same call signature,
+    but the forward pass runs in onnxruntime. Tokenization, pooling and
+    normalization stay in sentence-transformers, so outputs line up with
+    the reference model.
+    """
+    import torch
+
+    class OrtTransformer(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.session = session
+            self.config = config
+            self.inputs = [i.name for i in session.get_inputs()]
+            # no real weights live here; this only gives the model a device
+            self.anchor = torch.nn.Parameter(torch.zeros(1), requires_grad=False)
+
+        def forward(self, return_dict: bool = False, **features):
+            feed = {k: features[k].cpu().numpy().astype("int64") for k in self.inputs if k in features}
+            hidden = self.session.run(None, feed)[0]
+            return (torch.from_numpy(hidden),)
+
+    return OrtTransformer()
+
+
+def _onnx_path(model_name: str) -> Path:
+    return ONNX_DIR / (model_name.replace("/", "__") + ".onnx")
+
+
+def _export_onnx(model, path: Path):
+    """export the transformer of a SentenceTransformer with dynamic batch / sequence axes"""
+    import torch
+    hf = model[0].auto_model
+    sample = model.tokenize(["export sample text"])
+    names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in sample]
+    axes = {k: {0: "batch", 1: "seq"} for k in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with torch.no_grad():
+        torch.onnx.export(
+            hf, tuple(sample[k] for k in names), str(tmp),
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes=axes, opset_version=14,
+        )
+    os.replace(tmp, path)
+    print(f"📦 Exported {path.name} for the onnx encoder backend")
+
+
+def _to_onnx(model, model_name: str):
+    path = _onnx_path(model_name)
+    if not path.exists():
+        _export_onnx(model, path)
+    opts = ort.SessionOptions()
+    if ONNX_THREADS > 0:
+        opts.intra_op_num_threads = ONNX_THREADS
+    session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+    model[0].auto_model = _ort_transformer(session, model[0].auto_model.config)
+    return model
+
+
+def effective(backend: str = EMB_BACKEND) -> str:
+    """the backend that will actually run (torch when the requested one can't be used here)"""
+    if backend not in BACKENDS or (backend == "onnx" and not HAS_ONNX):
+        return "torch"
+    return backend
+
+
+def load(model_name: str, backend: str = EMB_BACKEND):
+    """
+    SentenceTransformer for `model_name` running on `backend`. The result
+    keeps the SentenceTransformer API (encode, get_sentence_embedding_dimension).
+    Falls back to torch when the backend can't be used here.
+    """
+    if effective(backend) != backend:
+        why = "onnxruntime is not installed" if backend == "onnx" else "unknown backend"
+        print(f"⚠️ Encoder backend {backend!r} unavailable ({why}), using torch")
+        backend = "torch"
+    model = _load_reference(model_name)
+    if backend == "int8":
+        model = _quantize_int8(model)
+    elif backend == "onnx":
+        model = _to_onnx(model, model_name)
+    return model
+
+
+def _encode(model, texts: List[str], batch_size: int) -> np.ndarray:
+    return model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                        normalize_embeddings=True, show_progress_bar=False).astype("float32")
+
+
+def check_drift(model_name: str, texts: List[str], backend: str = EMB_BACKEND,
+                batch_size: int = 32, min_cosine: Optional[float] = None) -> dict:
+    """
+    Equivalence check: encode `texts` with the reference torch model and
+    with `backend`, and report the per-text cosine between the two
+    (mean / min / p1) plus throughput of each. ok = min cosine >= min_cosine.
+    """
+    min_cosine = MIN_COSINE if min_cosine is None else min_cosine
+    backend = effective(backend)
+    out = {"model": model_name, "backend": backend, "texts": len(texts), "min_cosine_required": min_cosine}
+    if not texts:
+        return {**out, "ok": None}
+
+    timings = {}
+    vecs = {}
+    for name in ("torch", backend):
+        if name in vecs:
+            continue
+        model = load(model_name, name)
+        _encode(model, texts[:2], batch_size)  # first call pays one-off setup
+        t0 = time.perf_counter()
+        vecs[name] = _encode(model, texts, batch_size)
+        timings[name] = time.perf_counter() - t0
+        del model
+
+    cos = np.sum(vecs["torch"] * vecs[backend], axis=1)
+    return {
+        **out,
+        "cosine_mean": round(float(cos.mean()), 6),
+        "cosine_min": round(float(cos.min()), 6),
+        "cosine_p1": round(float(np.percentile(cos, 1)), 6),
+        "max_drift": round(float(1.0 - cos.min()), 6),
+        "reference_texts_per_s": round(len(texts) / max(timings["torch"], 1e-9), 1),
+        "backend_texts_per_s": round(len(texts) / max(timings[backend], 1e-9), 1),
+        "speedup": round(timings["torch"] / max(timings[backend], 1e-9), 2),
+        "ok": bool(cos.min() >= min_cosine),
+    }
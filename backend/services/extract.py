@@ -1,15 +1,55 @@
+from typing import Iterator, List, Tuple
 from PyPDF2 import PdfReader
-from pdf2image import convert_from_path
-import pytesseract
 
-def pdf_to_text(path: str) -> str:
+from services.ocr import ocr_pages, OCR_WORKERS, OCR_BATCH_PAGES
+from services.classify import classify_page
+from services.jobs import stage_slot
+
+# bump whenever extraction output can change, so cached results are ignored
+EXTRACTOR_VERSION = 5
+
+
+def join_pages(pages: List[str]) -> str:
+    """Join per-page text into one document string (blank pages dropped)."""
+    return "\n".join(t for t in pages if t).strip()
+
+
+def iter_pdf_pages(path: str, ocr_window: int = 0) -> Iterator[Tuple[int, str, bool]]:
     """
-    Extract selectable text directly from a PDF.
-    If a page has no selectable text, use OCR instead.
-    If pages fail, skip them gracefully.
+    Stream (page_index, text, used_ocr) in page order.
+    Each page is classified first (text layer, fonts, image coverage), so
+    only pages that actually look scanned are OCR'd, each at the lowest DPI
+    that keeps its glyphs legible. Pages that don't need OCR are yielded as
+    soon as they are read; OCR pages are held back and done together once
+    `ocr_window` of them are pending (default: enough to keep every OCR
+    worker busy), so downstream stages can start before the whole PDF is done.
+    If pages fail, they come back empty.
     """
     reader = PdfReader(path)
-    chunks = []
+    window = ocr_window or max(1, OCR_WORKERS * OCR_BATCH_PAGES)
+    pending: List[Tuple[int, str, bool]] = []  # (index, text layer, needs_ocr)
+    page_dpi = {}
+
+    def _flush():
+        missing = [i for i, _, ocr in pending if ocr]
+        ocr_texts = {}
+        if missing:
+            try:
+                with stage_slot("ocr"):  # SR_STAGE_LIMITS caps concurrent OCR across jobs
+                    ocr_texts = ocr_pages(path, missing, page_dpi=page_dpi)
+            except Exception:
+                ocr_texts = {}
+        out = []
+        for i, text, ocr in pending:
+            ocr_text = ocr_texts.get(i, "") if ocr else ""
+            # keep whichever is longer: a thin text layer can beat a failed OCR
+            if ocr and len(ocr_text) > len(text):
+                out.append((i, ocr_text, True))
+            else:
+                out.append((i, text, False))
+        pending.clear()
+        page_dpi.clear()
+        return out
 
     for i, page in enumerate(reader.pages):
         try:
@@ -17,14 +57,45 @@ def pdf_to_text(path: str) -> str:
         except Exception:
             text = ""
 
-        if not text:
-            try:
-                images = convert_from_path(path, first_page=i + 1, last_page=i + 1)
-                text = pytesseract.image_to_string(images[0]).strip() if images else ""
-            except Exception:
-                text = ""
+        try:
+            info = classify_page(page, text)
+        except Exception:
+            info = {"needs_ocr": not text, "dpi": None}
+
+        if not info["needs_ocr"] and not pending:
+            yield i, text, False
+            continue
+
+        pending.append((i, text, info["needs_ocr"]))
+        if info["needs_ocr"] and info.get("dpi"):
+            page_dpi[i] = info["dpi"]
+        n_ocr = sum(1 for _, _, ocr in pending if ocr)
+        if n_ocr >= window or len(pending) >= 4 * window:
+            yield from _flush()
+
+    yield from _flush()
+
+
+def pdf_to_pages(path: str) -> Tuple[List[str], List[int]]:
+    """
+    Extract selectable text per page.
+    Pages with no selectable text are collected and OCR'd together
+    in parallel batches, then merged back in page order.
+    Returns (page_texts, indices_of_pages_that_needed_ocr).
+    """
+    texts, missing = [], []
+    for i, text, ocred in iter_pdf_pages(path):
+        texts.append(text)
+        if ocred:
+            missing.append(i)
+    return texts, missing
 
-        if text:
-            chunks.append(text)
 
-    return "\n".join(chunks).strip()
+def pdf_to_text(path: str) -> str:
+    """
+    Extract selectable text directly from a PDF.
+    If a page has no selectable text, use OCR instead.
+    If pages fail, skip them gracefully.
+    """
+    pages, _ = pdf_to_pages(path)
+    return join_pages(pages)
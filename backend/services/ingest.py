@@ -0,0 +1,282 @@
+import os, logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from typing import List
+
+from utils.storage import (
+    save_pages, save_meta, get_extraction, save_extraction, clear_text, count_chars, get_meta, get_text
+)
+from services.extract import pdf_to_pages, iter_pdf_pages, join_pages, EXTRACTOR_VERSION
+from services.ocr import ocr_pdf_to_pages, OCR_DPI, OCR_LANG
+from services.classify import MIN_OCR_DPI
+from services.metadata import enrich_from_text
+from services.summarize import textrankish_summary
+from services import semantic
+from services.jobs import stage_slot
+
+logger = logging.getLogger("smartresearch.ingest")
+
+# parallel per-document extraction for batch imports
+BATCH_WORKERS = int(os.getenv("SR_BATCH_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+
+def _stage(job, name: str, hold_slot: bool = True):
+    """job.stage(name) when running under a job, a no-op context otherwise"""
+    return job.stage(name, hold_slot) if job is not None else nullcontext()
+
+
+def extraction_key(sha1: str) -> str:
+    """cache key: file content + everything that can change the extracted text"""
+    return f"{sha1}_v{EXTRACTOR_VERSION}_{OCR_DPI}dpi_{MIN_OCR_DPI}min_{OCR_LANG}"
+
+
+def _ocr_fallback(rec: dict, pages: list, ocr_idx: list, job=None) -> dict:
+    """
+    Fall back to full-document OCR when extraction came back (nearly) empty
+    and the page classifier did not send any page to OCR itself.
+    Returns {"pages", "used_ocr", "ocr_pages"}.
+    """
+    used_ocr = bool(ocr_idx)
+    if len(join_pages(pages)) < 200 and not ocr_idx:
+        try:
+            # batch workers run without a job: still take the OCR slot (SR_STAGE_LIMITS)
+            with (_stage(job, "ocr") if job is not None else stage_slot("ocr")):
+                ocr_pages_text = ocr_pdf_to_pages(rec["path"])
+            if len(join_pages(ocr_pages_text)) > len(join_pages(pages)):
+                pages = ocr_pages_text
+                ocr_idx = list(range(len(pages)))
+                used_ocr = True
+        except Exception as e:
+            logger.warning(f"OCR failed for {rec['name']}: {e}")
+    elif job is not None:
+        job.skip("ocr")
+
+    return {"pages": [p.strip() for p in pages], "used_ocr": used_ocr, "ocr_pages": ocr_idx}
+
+
+def _extract_uncached(rec: dict, job=None) -> dict:
+    """Per-page extraction for a stored PDF (plus OCR fallback)."""
+    with _stage(job, "extract"):
+        pages, ocr_idx = pdf_to_pages(rec["path"])
+    return _ocr_fallback(rec, pages, ocr_idx, job)
+
+
+def _cached_pages(rec: dict, job=None):
+    """(page_texts, used_ocr) from the extraction cache, or None on a miss"""
+    if not rec.get("sha1"):
+        return None
+    cached = get_extraction(extraction_key(rec["sha1"]))
+    if cached is None:
+        return None
+    if job is not None:
+        job.skip("extract", "cached")
+        job.skip("ocr", "cached")
+    return cached.get("pages", []), bool(cached.get("used_ocr"))
+
+
+def _cache_extraction(rec: dict, out: dict):
+    """store a fresh extraction result under the file's cache key"""
+    if not rec.get("sha1"):
+        return
+    try:
+        save_extraction(extraction_key(rec["sha1"]), {
+            **out,
+            "sha1": rec["sha1"],
+            "version": EXTRACTOR_VERSION,
+            "dpi": OCR_DPI,
+            "min_dpi": MIN_OCR_DPI,
+            "lang": OCR_LANG,
+        })
+    except Exception as e:
+        logger.warning(f"Could not cache extraction for {rec['name']}: {e}")
+
+
+def extract_pages(rec: dict, job=None) -> tuple:
+    """
+    Read-through extraction cache keyed by (sha1, extractor version, OCR params):
+    the PDF/OCR work runs at most once per unique file and configuration.
+    Returns (page_texts, used_ocr).
+    """
+    hit = _cached_pages(rec, job)
+    if hit is not None:
+        return hit
+
+    out = _extract_uncached(rec, job)
+    _cache_extraction(rec, out)
+    return out["pages"], out["used_ocr"]
+
+
+def _stream_extract_embed(rec: dict, job=None) -> tuple:
+    """
+    Extraction feeding straight into semantic.add_doc_stream(): pages are
+    chunked and encoded while later pages are still being read/OCR'd.
+    The encoder concurrency limit is taken per batch, not for the whole doc.
+    Returns (page_texts, used_ocr) and fills the extraction cache.
+    """
+    pages, ocr_idx = [], []
+
+    def _source():
+        with _stage(job, "extract"):
+            for i, text, ocred in iter_pdf_pages(rec["path"]):
+                pages.append(text)
+                if ocred:
+                    ocr_idx.append(i)
+                yield text
+
+    with _stage(job, "embed", hold_slot=False):
+        semantic.add_doc_stream(rec["id"], _source(), encode_slot=lambda: stage_slot("embed"))
+
+    out = _ocr_fallback(rec, pages, ocr_idx, job)
+    if out["ocr_pages"] is not ocr_idx:
+        # full-document OCR replaced the (near-empty) text: re-embed it
+        with stage_slot("embed"):
+            semantic.add_doc(rec["id"], join_pages(out["pages"]))
+
+    _cache_extraction(rec, out)
+    return out["pages"], out["used_ocr"]
+
+
+def extract_text(rec: dict, job=None) -> tuple:
+    """Extracted text for a stored PDF as one string. Returns (text, used_ocr)."""
+    pages, used_ocr = extract_pages(rec, job)
+    return join_pages(pages), used_ocr
+
+
+def build_meta(text: str, job=None) -> dict:
+    """pdf-derived metadata + extractive summary in the stored meta layout"""
+    with _stage(job, "metadata"):
+        pdf_meta = enrich_from_text(text) or {}
+
+    with _stage(job, "summarize"):
+        summary = textrankish_summary(text, max_sentences=5)
+
+    return {
+        "pdf": pdf_meta,            # metadata extracted from PDF
+        "external": {},             # no external metadata yet
+        "final": {**pdf_meta,       # copy PDF meta as base
+                  "summary": summary,
+                  "abstract": summary},  # optional: reuse summary for abstract
+        "confidence": 1.0,          # full confidence in PDF source for now
+        "reliable": True,           # assume reliable until compared
+    }
+
+
+def _discard(did: str, embedded: bool = False):
+    """
+    Undo a half-finished ingest: drop the stored text and metadata (and the
+    vectors, if any were added) but keep the file and its index record, so
+    the next upload of the same bytes runs the pipeline again.
+    """
+    clear_text(did)
+    if embedded:
+        try:
+            semantic.remove_doc(did)
+        except Exception as e:
+            logger.warning(f"Could not remove partial embedding for {did}: {e}")
+
+
+def is_ingested(did: str) -> bool:
+    """
+    True once a doc went all the way through: text and metadata stored, and
+    vectors in the semantic store (unless its text yields no chunks at all).
+    """
+    try:
+        n_chars = count_chars(did)
+    except FileNotFoundError:
+        return False
+    if get_meta(did) is None:
+        return False
+    if n_chars == 0 or semantic.has_doc(did):
+        return True
+    return not semantic._chunk_doc(did, get_text(did))
+
+
+def ingest_doc(rec: dict, job=None, embed: bool = True) -> dict:
+    """
+    Run the per-document pipeline for a file already saved by save_file():
+    extract (+OCR), store per-page text, embed, metadata + summary.
+    Returns {"text", "used_ocr", "meta", "n_pages"}. Set embed=False when the caller
+    batches the semantic step itself. If a step after extraction fails, the
+    stored text is removed again (see _discard) and the error is re-raised.
+    """
+    pages, embedded = None, False
+    hit = _cached_pages(rec, job)
+    if hit is not None:
+        pages, used_ocr = hit
+    elif embed:
+        # overlap extraction with chunking/encoding
+        try:
+            pages, used_ocr = _stream_extract_embed(rec, job)
+            embedded = True
+        except Exception as e:
+            logger.warning(f"Streaming ingest failed for {rec['name']}, retrying sequentially: {e}")
+
+    if pages is None:
+        pages, used_ocr = extract_pages(rec, job)
+    text = save_pages(rec["id"], pages)
+
+    try:
+        if embed and not embedded:
+            with _stage(job, "embed"):
+                semantic.add_doc(rec["id"], text)
+            embedded = True
+
+        meta_payload = build_meta(text, job)
+        save_meta(rec["id"], meta_payload)
+    except Exception:
+        _discard(rec["id"], embedded)
+        raise
+
+    return {"text": text, "used_ocr": used_ocr, "meta": meta_payload, "n_pages": len(pages)}
+
+
+def ingest_batch(recs: List[dict], job=None, workers: int = BATCH_WORKERS) -> dict:
+    """
+    Ingest many saved files at once: extraction + metadata run in parallel,
+    then every document's chunks are pooled into one semantic.add_docs call
+    so the encoder sees large batches and the index is written once.
+    Returns {"docs": [{"rec", "text", "used_ocr", "meta", "n_pages"}], "chunks",
+    "failed" (file names), "failed_ids"}. Failed docs keep no text, so they can be
+    retried; if the pooled embedding fails, every doc of the batch is failed.
+    """
+    done, failed, failed_ids = [], [], []
+    with _stage(job, "extract"):
+        if job is not None:
+            job.count("extract", 0, len(recs))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            futs = {ex.submit(ingest_doc, rec, None, False): rec for rec in recs}
+            for fut in as_completed(futs):
+                rec = futs[fut]
+                try:
+                    done.append({"rec": rec, **fut.result()})
+                except Exception as e:
+                    logger.warning(f"Batch ingest failed for {rec['name']}: {e}")
+                    failed.append(rec["name"])
+                    failed_ids.append(rec["id"])
+                if job is not None:
+                    job.count("extract", len(done) + len(failed), len(recs))
+
+    # keep the caller's order for the response
+    order = {rec["id"]: i for i, rec in enumerate(recs)}
+    done.sort(key=lambda d: order[d["rec"]["id"]])
+
+    n_chunks = 0
+    if done:
+        try:
+            with _stage(job, "embed"):
+                n_chunks = semantic.add_docs([(d["rec"]["id"], d["text"]) for d in done])
+        except Exception as e:
+            logger.warning(f"Batch semantic embedding failed for {len(done)} doc(s): {e}")
+            for d in done:
+                # shards that did take their part are overwritten on the retry
+                _discard(d["rec"]["id"])
+                failed.append(d["rec"]["name"])
+                failed_ids.append(d["rec"]["id"])
+            done = []
+
+    return {"docs": done, "chunks": n_chunks, "failed": failed, "failed_ids": failed_ids}
+
+
+def preview_of(text: str, n: int = 600) -> str:
+    """short preview snippet for upload responses"""
+    return (text[:n] + "…") if len(text) > n else text
@@ -0,0 +1,216 @@
+import os, time, uuid, threading, logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("smartresearch.jobs")
+
+
+# config
+# total number of ingestion jobs that may run at the same time
+MAX_WORKERS = int(os.getenv("SR_JOB_WORKERS", "4"))
+
+# how many finished jobs we keep around for /api/jobs lookups
+MAX_HISTORY = int(os.getenv("SR_JOB_HISTORY", "500"))
+
+# stages every ingestion job walks through, in order
+STAGES = ["extract", "ocr", "embed", "metadata", "summarize", "index"]
+
+# per-stage concurrency caps; OCR and the encoder are the heavy ones
+DEFAULT_STAGE_LIMITS = {
+    "extract": 4,
+    "ocr": 1,
+    "embed": 1,
+    "metadata": 4,
+    "summarize": 4,
+    "index": 1,
+}
+
+
+def _parse_limits(raw: str) -> Dict[str, int]:
+    """
+    Parse SR_STAGE_LIMITS, e.g. "ocr=2,embed=1,metadata=8".
+    Unknown or malformed entries are ignored.
+    """
+    limits = dict(DEFAULT_STAGE_LIMITS)
+    for part in (raw or "").split(","):
+        name, _, val = part.partition("=")
+        name = name.strip().lower()
+        try:
+            n = int(val)
+        except ValueError:
+            continue
+        if name and n > 0:
+            limits[name] = n
+    return limits
+
+
+STAGE_LIMITS = _parse_limits(os.getenv("SR_STAGE_LIMITS", ""))
+_stage_sems = {name: threading.BoundedSemaphore(n) for name, n in STAGE_LIMITS.items()}
+_sems_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="sr-ingest")
+_jobs: "OrderedDict[str, Job]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+@contextmanager
+def stage_slot(name: str):
+    """Hold one of the concurrency slots for a stage while the block runs."""
+    with _sems_lock:
+        sem = _stage_sems.get(name)
+        if sem is None:
+            sem = _stage_sems[name] = threading.BoundedSemaphore(
+                DEFAULT_STAGE_LIMITS.get(name, 1)
+            )
+    with sem:
+        yield
+
+
+class Job:
+    """
+    Tracks one background ingestion run: overall status plus
+    per-stage status and timings.
+    """
+
+    def __init__(self, doc_id: Optional[str], name: str, stages: Optional[List[str]] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.doc_id = doc_id
+        self.name = name
+        self.status = "queued"       # queued | running | done | failed
+        self.error: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.stages: Dict[str, Dict] = OrderedDict(
+            (s, {"status": "pending", "started": None, "finished": None,
+                 "seconds": None, "error": None})
+            for s in (stages or STAGES)
+        )
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, hold_slot: bool = True):
+        """
+        Run a block as the named stage: waits for a stage slot, then
+        records start/finish times and any error raised inside.
+        With hold_slot=False only timings are recorded; the block is expected
+        to take stage_slot(name) itself around the expensive parts.
+        """
+        st = self.stages.setdefault(name, {"status": "pending", "started": None,
+                                           "finished": None, "seconds": None, "error": None})
+        st["status"] = "waiting"
+        with (stage_slot(name) if hold_slot else nullcontext()):
+            t0 = time.time()
+            with self._lock:
+                st.update(status="running", started=t0)
+            try:
+                yield
+            except Exception as e:
+                with self._lock:
+                    t1 = time.time()
+                    st.update(status="failed", finished=t1,
+                              seconds=round(t1 - t0, 3), error=str(e))
+                raise
+            with self._lock:
+                t1 = time.time()
+                st.update(status="done", finished=t1, seconds=round(t1 - t0, 3))
+
+    def count(self, name: str, done: int, total: int):
+        """Record item-level progress inside a stage (e.g. docs extracted in a batch)."""
+        with self._lock:
+            st = self.stages.get(name)
+            if st is not None:
+                st.update(items_done=done, items_total=total)
+
+    def skip(self, name: str, status: str = "skipped"):
+        """Mark a stage as not needed for this job ("skipped", or "cached" on a cache hit)."""
+        if name in self.stages:
+            self.stages[name]["status"] = status
+
+    @property
+    def progress(self) -> float:
+        """Fraction of stages that are finished (done, skipped, cached or failed)."""
+        if not self.stages:
+            return 1.0
+        finished = sum(1 for s in self.stages.values()
+                       if s["status"] in ("done", "skipped", "cached", "failed"))
+        return round(finished / len(self.stages), 3)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "doc_id": self.doc_id,
+                "name": self.name,
+                "status": self.status,
+                "progress": 1.0 if self.status == "done" else self.progress,
+                "error": self.error,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "stages": [{"name": n, **s} for n, s in self.stages.items()],
+                "result": self.result,
+            }
+
+
+def _run(job: Job, fn: Callable[[Job], Optional[dict]]):
+    job.status = "running"
+    job.started = time.time()
+    try:
+        job.result = fn(job)
+        job.status = "done"
+    except Exception as e:
+        logger.warning(f"Ingestion job {job.id} ({job.name}) failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished = time.time()
+
+
+def _trim_history():
+    """drop the oldest finished jobs once we go over MAX_HISTORY"""
+    if len(_jobs) <= MAX_HISTORY:
+        return
+    for jid in list(_jobs.keys()):
+        if len(_jobs) <= MAX_HISTORY:
+            break
+        if _jobs[jid].status in ("done", "failed"):
+            _jobs.pop(jid, None)
+
+
+def submit(doc_id: Optional[str], name: str, fn: Callable[[Job], Optional[dict]],
+           stages: Optional[List[str]] = None) -> Job:
+    """
+    Queue fn(job) on the ingestion pool and return the job handle right away.
+    fn's return value becomes job.result.
+    """
+    job = Job(doc_id, name, stages)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        _trim_history()
+    _executor.submit(_run, job, fn)
+    return job
+
+
+def get(job_id: str) -> Optional[Job]:
+    """Look up a job by id (None if unknown or already evicted)."""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def latest_for_doc(doc_id: str) -> Optional[Job]:
+    """Most recent job that ingested the given doc, if still tracked."""
+    with _jobs_lock:
+        for job in reversed(_jobs.values()):
+            if job.doc_id == doc_id:
+                return job
+    return None
+
+
+def list_jobs() -> List[Job]:
+    """All tracked jobs, oldest first."""
+    with _jobs_lock:
+        return list(_jobs.values())
@@ -1,11 +1,128 @@
-from pdf2image import convert_from_path
+import os, threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, List, Optional, Tuple
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 
-def ocr_pdf_to_text(path: str, dpi=300, lang="eng") -> str:
+# OCR fan-out: one process per core, each rasterizing a small page range
+OCR_WORKERS = int(os.getenv("SR_OCR_WORKERS", str(os.cpu_count() or 1)))
+# pages rasterized per poppler call (bounds per-worker image memory)
+OCR_BATCH_PAGES = int(os.getenv("SR_OCR_BATCH_PAGES", "4"))
+# rasterization / recognition settings (part of the extraction cache key)
+OCR_DPI = int(os.getenv("SR_OCR_DPI", "300"))
+OCR_LANG = os.getenv("SR_OCR_LANG", "eng")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Shared OCR process pool, created on first use (spawn, so no forked torch state)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, OCR_WORKERS),
+                mp_context=mp.get_context("spawn"),
+            )
+        return _pool
+
+
+def _page_ranges(pages: Iterable[int], max_len: int) -> List[Tuple[int, int]]:
+    """
+    Group 1-based page numbers into consecutive (first, last) runs
+    of at most max_len pages, e.g. [1,2,3,7,8] -> [(1,3), (7,8)].
+    """
+    runs: List[Tuple[int, int]] = []
+    for p in sorted(set(pages)):
+        if runs and p == runs[-1][1] + 1 and (p - runs[-1][0]) < max_len:
+            runs[-1] = (runs[-1][0], p)
+        else:
+            runs.append((p, p))
+    return runs
+
+
+def _ocr_range(path: str, first: int, last: int, dpi: int, lang: str) -> List[Tuple[int, str]]:
+    """Rasterize pages first..last in one poppler call and OCR them (runs in a worker)."""
+    images = convert_from_path(path, dpi=dpi, first_page=first, last_page=last)
+    out = []
+    for offset, img in enumerate(images):
+        try:
+            out.append((first + offset, pytesseract.image_to_string(img, lang=lang)))
+        except Exception:
+            out.append((first + offset, ""))
+        finally:
+            img.close()
+    return out
+
+
+def ocr_pages(path: str, pages: Iterable[int], dpi: int = OCR_DPI, lang: str = OCR_LANG,
+              page_dpi: Optional[Dict[int, int]] = None) -> Dict[int, str]:
+    """
+    OCR only the given 0-based page indices.
+    Pages are batched into contiguous ranges (per DPI, if page_dpi gives
+    a DPI for some pages) and spread over the process pool; at most two
+    ranges per worker are in flight, so memory stays bounded.
+    Returns {page_index: text}; pages that fail come back as "".
+    """
+    by_dpi: Dict[int, List[int]] = {}
+    for p in pages:
+        by_dpi.setdefault((page_dpi or {}).get(p, dpi), []).append(p + 1)
+    ranges = [
+        (first, last, d)
+        for d, nums in sorted(by_dpi.items())
+        for first, last in _page_ranges(nums, max(1, OCR_BATCH_PAGES))
+    ]
+    if not ranges:
+        return {}
+
+    results: Dict[int, str] = {}
+
+    def _collect(chunk):
+        for page_no, text in chunk:
+            results[page_no - 1] = text.strip()
+
+    # single small range: not worth shipping to another process
+    if len(ranges) == 1 and ranges[0][1] - ranges[0][0] < 1:
+        first, last, d = ranges[0]
+        _collect(_ocr_range(path, first, last, d, lang))
+        return results
+
+    pool = _get_pool()
+    max_in_flight = max(1, OCR_WORKERS) * 2
+    pending = {}
+    queue = list(ranges)
+
+    while queue or pending:
+        while queue and len(pending) < max_in_flight:
+            first, last, d = queue.pop(0)
+            fut = pool.submit(_ocr_range, path, first, last, d, lang)
+            pending[fut] = (first, last)
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            first, last = pending.pop(fut)
+            try:
+                _collect(fut.result())
+            except Exception:
+                for p in range(first, last + 1):
+                    results.setdefault(p - 1, "")
+
+    return results
+
+
+def ocr_pdf_to_pages(path: str, dpi: int = OCR_DPI, lang: str = OCR_LANG) -> List[str]:
+    """OCR every page of a PDF, returning one text per page in order."""
+    n_pages = int(pdfinfo_from_path(path).get("Pages", 0))
+    texts = ocr_pages(path, range(n_pages), dpi=dpi, lang=lang)
+    return [texts.get(i, "") for i in range(n_pages)]
+
+
+def ocr_pdf_to_text(path: str, dpi=OCR_DPI, lang=OCR_LANG) -> str:
     """
     Convert a scanned PDF into machine-readable text via OCR.
-    Uses pdf2image + pytesseract, one page at a time.
+    Pages are rasterized in small batches and OCR'd in parallel,
+    then joined back in page order.
     """
-    images = convert_from_path(path, dpi=dpi)
-    texts = [pytesseract.image_to_string(img, lang=lang) for img in images]
-    return "\n".join(texts).strip()
+    return "\n".join(ocr_pdf_to_pages(path, dpi=dpi, lang=lang)).strip()
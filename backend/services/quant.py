@@ -0,0 +1,318 @@
+import os, time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+
+# config
+# in-memory representation used for candidate search; float32 stays on disk for re-scoring
+COMPRESSION = os.getenv("SR_VEC_COMPRESSION", "none").lower()   # none | fp16 | int8 | pq
+# PQ sub-quantizers (0 = dim/4 bytes per vector, i.e. 16x smaller than float32)
+PQ_M = int(os.getenv("SR_PQ_M", "0"))
+# candidates fetched per requested hit before exact float32 re-scoring
+# (0 = 4 for fp16/int8, 16 for the much coarser PQ codes)
+RERANK_FACTOR = int(os.getenv("SR_RERANK_FACTOR", "0"))
+# recall@10 the evaluation (cli.py eval-index) must reach
+RECALL_TARGET = float(os.getenv("SR_RECALL_TARGET", "0.95"))
+
+MODES = ("none", "fp16", "int8", "pq")
+# PQ codebooks (256 centroids per sub-space) need ~39 points per centroid to train well
+PQ_MIN_TRAIN = 256 * 39
+
+_BLOCK = 65536
+
+# ids -> (ids still present, their float32 vectors), read from the vector store
+Fetch = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+
+def effective(mode: str, n: int) -> str:
+    """Compression actually used for n vectors: PQ falls back to int8 until there's enough to train it."""
+    mode = mode if mode in MODES else "none"
+    if mode == "pq" and n < PQ_MIN_TRAIN:
+        return "int8"
+    return mode
+
+
+def pq_m(dim: int) -> int:
+    """number of PQ sub-quantizers: SR_PQ_M, or the largest divisor of dim up to dim/4"""
+    target = PQ_M if PQ_M > 0 else max(1, dim // 4)
+    for m in range(min(target, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+# NumPy codecs (used when FAISS isn't installed)
+class Fp16Codec:
+    mode = "fp16"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def train(self, x: np.ndarray):
+        pass
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        return np.asarray(x, dtype="float16")
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        return codes.astype("float32") @ q
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def load_state(self, z):
+        pass
+
+
+class Int8Codec:
+    """per-dimension affine scalar quantization to 8 bits"""
+    mode = "int8"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.lo = np.full(dim, -1.0, dtype="float32")
+        self.scale = np.full(dim, 2.0 / 255, dtype="float32")
+
+    def train(self, x: np.ndarray):
+        lo, hi = x.min(axis=0), x.max(axis=0)
+        self.lo = lo.astype("float32")
+        self.scale = np.maximum((hi - lo) / 255.0, 1e-8).astype("float32")
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        c = np.rint((np.asarray(x, dtype="float32") - self.lo) / self.scale)
+        return (np.clip(c, 0, 255) - 128).astype("int8")
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # q·x ≈ q·((c + 128) * scale + lo) = c·(q*scale) + q·(128*scale + lo)
+        qs = (q * self.scale).astype("float32")
+        return codes.astype("float32") @ qs + float(q @ (128 * self.scale + self.lo))
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"lo": self.lo, "scale": self.scale}
+
+    def load_state(self, z):
+        self.lo, self.scale = z["lo"], z["scale"]
+
+
+def _kmeans_l2(x: np.ndarray, k: int, iters: int = 12, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    c = x[rng.choice(x.shape[0], k, replace=x.shape[0] < k)].copy()
+    x2 = (x * x).sum(axis=1, keepdims=True)
+    for _ in range(iters):
+        d = x2 - 2 * x @ c.T + (c * c).sum(axis=1)
+        assign = np.argmin(d, axis=1)
+        sums = np.zeros_like(c)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        c = sums / np.maximum(counts, 1)[:, None]
+        if empty.any():
+            c[empty] = x[rng.choice(x.shape[0], int(empty.sum()))]
+    return c.astype("float32")
+
+
+class PQCodec:
+    """product quantization: m sub-spaces x 256 centroids, one byte per sub-space"""
+    mode = "pq"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.m = pq_m(dim)
+        self.dsub = dim // self.m
+        self.codebooks = np.zeros((self.m, 256, self.dsub), dtype="float32")
+
+    def train(self, x: np.ndarray):
+        sample = x[np.random.default_rng(0).choice(x.shape[0], min(x.shape[0], PQ_MIN_TRAIN * 2), replace=False)]
+        for j in range(self.m):
+            self.codebooks[j] = _kmeans_l2(sample[:, j * self.dsub:(j + 1) * self.dsub], 256)
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype="float32")
+        codes = np.empty((x.shape[0], self.m), dtype="uint8")
+        for j in range(self.m):
+            sub = x[:, j * self.dsub:(j + 1) * self.dsub]
+            cb = self.codebooks[j]
+            d = -2 * sub @ cb.T + (cb * cb).sum(axis=1)
+            codes[:, j] = np.argmin(d, axis=1)
+        return codes
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # asymmetric distance: per-sub-space lookup tables of q·centroid
+        table = np.einsum("jkd,jd->jk", self.codebooks, q.reshape(self.m, self.dsub))
+        return table[np.arange(self.m), codes.astype("int64")].sum(axis=1)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    def load_state(self, z):
+        self.codebooks = z["codebooks"]
+
+
+_CODECS = {"fp16": Fp16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+
+class CompressedFlat:
+    """
+    NumPy flat index over compressed codes (no FAISS): the scan touches only
+    the codes; exact scores come from the Reranked wrapper.
+    """
+
+    backend = "numpy"
+    kind = "flat"
+
+    def __init__(self, codec, trained_on: int = 0):
+        self.codec = codec
+        self.compression = codec.mode
+        self.dim = codec.dim
+        self.trained_on = trained_on
+        self.n = 0
+        self._codes: Optional[np.ndarray] = None
+        self._ids = np.zeros(0, dtype="int64")
+
+    @classmethod
+    def build(cls, vecs: np.ndarray, ids: np.ndarray, mode: str) -> "CompressedFlat":
+        codec = _CODECS[mode](vecs.shape[1])
+        codec.train(np.asarray(vecs, dtype="float32"))
+        out = cls(codec, trained_on=vecs.shape[0])
+        out.add(vecs, ids)
+        return out
+
+    @property
+    def ntotal(self) -> int:
+        return self.n
+
+    def add(self, vecs: np.ndarray, ids: np.ndarray):
+        codes = self.codec.encode(vecs)
+        k = codes.shape[0]
+        if self._codes is None:
+            self._codes = np.empty((max(k, 1024),) + codes.shape[1:], dtype=codes.dtype)
+            self._ids = np.empty(self._codes.shape[0], dtype="int64")
+        if self.n + k > self._codes.shape[0]:
+            cap = self._codes.shape[0]
+            while cap < self.n + k:
+                cap *= 2
+            grown = np.empty((cap,) + codes.shape[1:], dtype=codes.dtype)
+            grown[: self.n] = self._codes[: self.n]
+            grown_ids = np.empty(cap, dtype="int64")
+            grown_ids[: self.n] = self._ids[: self.n]
+            self._codes, self._ids = grown, grown_ids
+        self._codes[self.n: self.n + k] = codes
+        self._ids[self.n: self.n + k] = ids
+        self.n += k
+
+    def remove(self, ids: np.ndarray) -> bool:
+        if self.n == 0:
+            return True
+        keep = ~np.isin(self._ids[: self.n], np.asarray(ids, dtype="int64"))
+        m = int(keep.sum())
+        self._codes[:m] = self._codes[: self.n][keep]
+        self._ids[:m] = self._ids[: self.n][keep]
+        self.n = m
+        return True
+
+    def search(self, q: np.ndarray, k: int, **_) -> Tuple[np.ndarray, np.ndarray]:
+        q = np.asarray(q, dtype="float32").reshape(-1, self.dim)
+        D = np.full((q.shape[0], k), -np.inf, dtype="float32")
+        I = np.full((q.shape[0], k), -1, dtype="int64")
+        if self.n == 0:
+            return D, I
+        kk = min(k, self.n)
+        for j, qi in enumerate(q):
+            sims = np.concatenate([self.codec.scores(self._codes[s: min(s + _BLOCK, self.n)], qi)
+                                   for s in range(0, self.n, _BLOCK)])
+            top = np.argpartition(-sims, kk - 1)[:kk]
+            top = top[np.argsort(-sims[top])]
+            D[j, :kk], I[j, :kk] = sims[top], self._ids[top]
+        return D, I
+
+    def needs_retrain(self) -> bool:
+        return self.compression != effective(COMPRESSION, self.n) or \
+            (self.compression in ("int8", "pq") and self.n > 4 * max(self.trained_on, 1))
+
+    def memory_bytes(self) -> int:
+        return int(self.n * (self._codes[0].nbytes if self.n else 0) + self.n * 8)
+
+    def save(self, path: Path):
+        with open(path, "wb") as f:
+            np.savez(f, codes=self._codes[: self.n] if self.n else np.zeros(0),
+                     ids=self._ids[: self.n], **self.codec.state())
+
+    @classmethod
+    def load(cls, path: Path, meta: dict) -> "CompressedFlat":
+        mode = meta["compression"]
+        codec = _CODECS[mode](int(meta["dim"]))
+        with np.load(path) as z:
+            codec.load_state(z)
+            codes, ids = z["codes"], z["ids"]
+        out = cls(codec, trained_on=int(meta.get("trained_on", 0)))
+        if len(ids):
+            out._codes, out._ids, out.n = codes, ids, len(ids)
+        return out
+
+
+class Reranked:
+    """
+    Wraps a compressed index: fetches RERANK_FACTOR x k candidates from the
+    codes, then re-scores them exactly against the float32 rows on disk.
+    """
+
+    def __init__(self, inner, fetch: Fetch, factor: int = RERANK_FACTOR):
+        self.inner = inner
+        self.fetch = fetch
+        self.factor = max(1, factor or (16 if inner.compression == "pq" else 4))
+
+    def __getattr__(self, name):
+        # kind, backend, dim, ntotal, compression, trained_on, add, remove, save, ...
+        return getattr(self.inner, name)
+
+    def search(self, q: np.ndarray, k: int, **kw) -> Tuple[np.ndarray, np.ndarray]:
+        q = np.asarray(q, dtype="float32").reshape(-1, self.inner.dim)
+        _, cand = self.inner.search(q, max(k, k * self.factor), **kw)
+        D = np.full((q.shape[0], k), -np.inf, dtype="float32")
+        I = np.full((q.shape[0], k), -1, dtype="int64")
+        for j, qi in enumerate(q):
+            ids, vecs = self.fetch(cand[j][cand[j] >= 0])
+            if len(ids) == 0:
+                continue
+            exact = np.asarray(vecs, dtype="float32") @ qi
+            top = np.argsort(-exact)[:k]
+            D[j, : len(top)], I[j, : len(top)] = exact[top], ids[top]
+        return D, I
+
+
+def recall_at_k(index, vecs: np.ndarray, ids: np.ndarray, n_queries: int = 200, k: int = 10,
+                seed: int = 0) -> dict:
+    """
+    Measure an index against exact float32 search: stored vectors (slightly
+    perturbed) serve as queries. Returns recall@k, mean latency and whether
+    it meets RECALL_TARGET.
+    """
+    n = vecs.shape[0]
+    if n == 0 or index is None:
+        return {"queries": 0, f"recall@{k}": None, "ms_per_query": None, "target": RECALL_TARGET, "ok": None}
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, min(n_queries, n), replace=False)
+    q = np.asarray(vecs[rows], dtype="float32") + rng.normal(0, 0.01, (len(rows), vecs.shape[1])).astype("float32")
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+
+    # ground truth: exact inner product over the full-precision matrix, in blocks
+    kk = min(k, n)
+    best = np.full((len(q), kk), -np.inf, dtype="float32")
+    best_ids = np.full((len(q), kk), -1, dtype="int64")
+    for s in range(0, n, _BLOCK):
+        sims = q @ np.asarray(vecs[s: s + _BLOCK], dtype="float32").T
+        cat = np.concatenate([best, sims], axis=1)
+        cat_ids = np.concatenate([best_ids, np.broadcast_to(ids[s: s + _BLOCK], sims.shape)], axis=1)
+        top = np.argsort(-cat, axis=1)[:, :kk]
+        best = np.take_along_axis(cat, top, axis=1)
+        best_ids = np.take_along_axis(cat_ids, top, axis=1)
+
+    t0 = time.perf_counter()
+    hits = 0
+    for j in range(len(q)):
+        _, I = index.search(q[j: j + 1], kk)
+        hits += len(set(I[0][I[0] >= 0].tolist()) & set(best_ids[j].tolist()))
+    ms = (time.perf_counter() - t0) * 1000 / len(q)
+    recall = hits / float(len(q) * kk)
+    return {"queries": len(q), f"recall@{k}": round(recall, 4), "ms_per_query": round(ms, 3),
+            "target": RECALL_TARGET, "ok": recall >= RECALL_TARGET}
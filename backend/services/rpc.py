@@ -0,0 +1,135 @@
+import os, secrets, ipaddress, threading
+from multiprocessing.connection import Listener, Client
+from pathlib import Path
+from typing import Any, Callable, List, Tuple
+
+# idle connections a client keeps open for reuse
+MAX_IDLE = 16
+# where generated per-install keys live (same store as the API)
+DATA_DIR = Path(os.getenv("SMARTRESEARCH_DATA", "./data_store"))
+
+
+def parse_address(addr: str) -> Tuple[str, int]:
+    host, _, port = addr.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False  # any other host name may resolve to a public interface
+
+
+def authkey(env: str, key_file: str) -> Tuple[bytes, bool]:
+    """
+    Shared secret for a serve() / RpcClient pair, and whether it was set
+    explicitly. Connections exchange pickles, so anyone holding the key can
+    run code in the server: there is no built-in default. $env wins; when it
+    is unset, a random key is generated once under DATA_DIR/key_file
+    (owner-only), which every process of this install reads back.
+    """
+    val = os.getenv(env, "")
+    if val:
+        return val.encode("utf-8"), True
+    path = DATA_DIR / key_file
+    if not path.exists():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass  # another process generated it first
+    key = path.read_bytes().strip()
+    if not key:
+        raise RuntimeError(f"{path} is empty: delete it or set {env}")
+    return key, False
+
+
+class RpcClient:
+    """
+    Request/response client for a serve() process: call("op", *args)
+    sends one tuple and returns the payload of the reply. Keeps a small
+    pool of connections (one per concurrent caller).
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._idle: List = []
+        self._lock = threading.Lock()
+        self.reachable = False
+
+    @property
+    def label(self) -> str:
+        return "%s:%d" % self.address
+
+    def call(self, *msg) -> Any:
+        for attempt in (0, 1):
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = Client(self.address, authkey=self.authkey)
+                conn.send(msg)
+                status, payload = conn.recv()
+            except (EOFError, OSError):
+                # stale pooled connection (server restarted): retry once on a fresh one
+                if conn is not None:
+                    conn.close()
+                self.reachable = False
+                if attempt:
+                    raise
+                continue
+            with self._lock:
+                if len(self._idle) < MAX_IDLE:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+            self.reachable = True
+            if status != "ok":
+                raise RuntimeError(f"{self.label}: {payload}")
+            return payload
+
+
+def _handle(conn, dispatch: Callable[[tuple], Any]):
+    """serve one client connection until it closes"""
+    with conn:
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", dispatch(msg))
+            except Exception as e:
+                reply = ("error", str(e))
+            conn.send(reply)
+
+
+def serve(address: str, dispatch: Callable[[tuple], Any], authkey: bytes, name: str, banner: str = "",
+          explicit_key: bool = False):
+    """
+    Accept connections on host:port and answer every request tuple with
+    dispatch(msg), one thread per connection (blocks forever). Errors
+    raised by dispatch are sent back and re-raised by RpcClient.call.
+    `banner` is printed once the port is bound. Only loopback addresses
+    are served unless the key was set explicitly (see authkey()).
+    """
+    host, port = parse_address(address)
+    if not (explicit_key or is_loopback(host)):
+        raise PermissionError(f"{name}: refusing to listen on {host} without an explicitly configured auth key")
+    with Listener((host, port), backlog=128, authkey=authkey) as listener:
+        if banner:
+            print(banner.format(host=host, port=port))
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"⚠️ {name} rejected a connection: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn, dispatch), daemon=True).start()
@@ -1,97 +1,617 @@
-import os, json
+import os, json, queue, threading, time, unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Tuple, Dict
+from contextlib import nullcontext
+from typing import List, Tuple, Dict, Iterable, Iterator, Callable, ContextManager, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-# optional FAISS acceleration (used if installed)
-try:
-    import faiss
-    _HAS_FAISS = True
-except Exception:
-    _HAS_FAISS = False
+from services import ann, quant, encoders, embed_server, shards
+from services.vector_store import VectorStore, StoreView, CentroidTable, CentroidView
+from services.doc_graph import NeighbourGraph
+from services.embed_cache import EmbeddingCache
 
 
 # config / globals
 DATA_DIR = Path(os.getenv("SMARTRESEARCH_DATA", "./data_store"))
-SEM_FILE = DATA_DIR / "semantic_chunks.json"
+VEC_FILE = DATA_DIR / "semantic_vecs.npy"   # preallocated float32 matrix, memory-mapped read/write
+IDS_FILE = DATA_DIR / "semantic_ids.json"   # chunk id table (row i ↔ ids[i], None = deleted)
+SEM_FILE = DATA_DIR / "semantic_chunks.json"  # legacy JSON store, migrated on first load
+ANN_FILE = DATA_DIR / "semantic_ann.index"  # trained IVF / HNSW index, reused across restarts
+GRAPH_FILE = DATA_DIR / "semantic_neighbours.json"  # top-k similar docs per doc (see doc_graph.py)
+EMB_CACHE_FILE = DATA_DIR / "embed_cache.sqlite"  # chunk text hash → vector, survives reindex / re-ingest
 
 EMB_MODEL_NAME = os.getenv("SR_EMB_MODEL", "allenai/specter2_base")
-_model = SentenceTransformer(EMB_MODEL_NAME)
+EMB_BACKEND = encoders.effective()  # torch | int8 | onnx (SR_EMB_BACKEND, see encoders.py)
+EMB_BATCH_SIZE = int(os.getenv("SR_EMB_BATCH", "64"))  # chunks per encoder forward pass
+STREAM_QUEUE_DEPTH = int(os.getenv("SR_STREAM_QUEUE", "4"))  # pages / chunk batches buffered between stages
+COMPACT_INTERVAL = float(os.getenv("SR_COMPACT_INTERVAL", "30"))  # seconds between background index compactions
+COMPACT_MIN_DELETES = int(os.getenv("SR_COMPACT_MIN_DELETES", "1"))  # pending deletes before a compaction runs
+QUERY_CACHE_SIZE = int(os.getenv("SR_QUERY_CACHE_SIZE", "2048"))  # cached query vectors (0 = off)
+QUERY_CACHE_TTL = float(os.getenv("SR_QUERY_CACHE_TTL", "3600"))  # seconds a cached query vector stays valid
+WRITE_BATCH = int(os.getenv("SR_WRITE_BATCH", "32"))  # queued writes applied before one snapshot swap
+GRAPH_CANDIDATES = int(os.getenv("SR_GRAPH_CANDIDATES", "256"))  # index hits per new doc re-ranked for its graph list
+
+# the encoder and the on-disk store are both loaded on first use (see _get_model / ensure_loaded)
+_model = None
+_model_lock = threading.Lock()
+_embedder = None  # embed_server.EmbedServer (in-process) or RemoteEmbedder (SR_EMBED_SERVER sidecar)
+_embedder_lock = threading.Lock()
+_load_lock = threading.RLock()
+_loaded = False
+
+# SR_SHARDS set: the index lives in shard server processes and this one only routes (see shards.py)
+_router = shards.ShardRouter(shards.SHARDS) if shards.SHARDS else None
 
 # in-memory store (aka the semantic swamp)
-_ids: List[str] = []              # chunk IDs like "doc1::0"
+# rows: chunk IDs like "doc1::0" + vectors + stable int ids (see vector_store.py);
+# width 0 until the store is opened or gets its first rows
+_store = VectorStore(VEC_FILE, IDS_FILE, 0, meta={"model": EMB_MODEL_NAME})
 _doc_lookup: Dict[str, str] = {}  # chunk_id → doc_id
-_vecs: np.ndarray = np.zeros(
-    (0, _model.get_sentence_embedding_dimension()), dtype="float32"
-)
-_index = None
+_doc_chunks: Dict[str, np.ndarray] = {}  # doc_id → int ids of its chunks (stable across compaction)
+_centroids = CentroidTable(_store.dim)  # doc_id → mean of its unit chunk vectors
+_graph = NeighbourGraph(GRAPH_FILE)  # doc_id → top-k similar docs, kept up to date on add/remove
+_index = None  # ann.FaissIndex / ann.NumpyIVF, or None = NumPy scan over the matrix
+
+# ids deleted from the store but not yet removed from _index (see _compact_index)
+_pending_deletes: set = set()
+_index_lock = threading.Lock()
+_compact_wake = threading.Event()
+_compactor = None
+_index_dirty = False      # ANN index changed since it was last saved
+_indexed_upto = -1        # highest int id handed to the index
+_rebuild_wanted = False   # index kind no longer fits the corpus size (see ann.choose_kind)
+_rebuild_log = None       # adds made while a background rebuild runs, replayed on swap
+
+
+class _Snapshot:
+    """
+    Everything a reader needs, frozen after one write batch: the store
+    rows, doc → chunk ids and doc centroids as they stood then. Readers
+    take `_snap` once and only use its fields, so they never block on a
+    writer and never see half of a write; the writer builds the next
+    snapshot and swaps the module reference (one atomic assignment).
+    """
+
+    __slots__ = ("version", "store", "centroids", "doc_chunks", "lookup")
+
+    def __init__(self, version: int, store: StoreView, centroids: CentroidView,
+                 doc_chunks: Dict[str, np.ndarray], lookup: Dict[str, str]):
+        self.version = version
+        self.store = store
+        self.centroids = centroids
+        self.doc_chunks = doc_chunks
+        # shared with the writer and only read with .get: new keys belong to rows this
+        # snapshot doesn't hold, and a dropped chunk falls back to its "doc::i" prefix
+        self.lookup = lookup
+
+    def doc_of(self, cid: str) -> str:
+        return self.lookup.get(cid) or cid.split("::")[0]
+
+
+# writes: one thread applies every mutation in order, then publishes a new _snap
+_snap = _Snapshot(0, _store.view(), _centroids.view(), {}, _doc_lookup)
+_write_q: "queue.Queue" = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+_write_seq = 0            # state-changing writes applied so far (= version of the next snapshot)
+_deferred: List[Callable[[], None]] = []  # writer work that must see the published snapshot
+
+
+class _QueryCache:
+    """
+    LRU + TTL cache of normalized query text → unit query vector.
+    Keys include the model name and encoder backend, so switching
+    SR_EMB_MODEL / SR_EMB_BACKEND never serves vectors from another encoder.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[str, ...], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def get(self, key: Tuple[str, ...]) -> Optional[np.ndarray]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            t, vec = item
+            if self.ttl > 0 and time.time() - t > self.ttl:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key: Tuple[str, ...], vec: np.ndarray):
+        if self.max_size <= 0:
+            return
+        vec = np.array(vec, dtype="float32")
+        vec.flags.writeable = False  # shared between callers
+        with self._lock:
+            self._data[key] = (time.time(), vec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "model": EMB_MODEL_NAME,
+                "backend": EMB_BACKEND,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+_query_cache = _QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+_chunk_cache = EmbeddingCache(EMB_CACHE_FILE)  # bounded by SR_EMB_CACHE_MB (0 = off)
 
 
 # internal helpers
+def _get_model():
+    """The sentence encoder, loaded once on first use (thread-safe)."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                t0 = time.time()
+                m = encoders.load(EMB_MODEL_NAME, EMB_BACKEND)
+                print(f"🧠 Loaded embedding model {EMB_MODEL_NAME} ({EMB_BACKEND}) in {time.time() - t0:.1f}s")
+                _model = m
+    return _model
+
+
+def _get_embedder():
+    """
+    Shared micro-batching front end to the encoder: every encode in this
+    process (ingest and search alike) goes through it. With SR_EMBED_SERVER
+    set it is a client of the sidecar instead, and no model is loaded here.
+    """
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if embed_server.SERVER_ADDRESS:
+                    _embedder = embed_server.RemoteEmbedder(embed_server.SERVER_ADDRESS)
+                else:
+                    _embedder = embed_server.EmbedServer(
+                        _encode_direct, lambda: _get_model().get_sentence_embedding_dimension())
+    return _embedder
+
+
+def _embedding_dim() -> int:
+    """vector width: taken from the store when it has one, so this doesn't load the model"""
+    return _store.dim or _get_embedder().dim()
+
+
 def _save():
-    """Persist chunk embeddings to disk."""
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    payload = {"ids": _ids, "vecs": _vecs.tolist(), "lookup": _doc_lookup}
-    SEM_FILE.write_text(json.dumps(payload), encoding="utf-8")
+    """Persist chunk embeddings to disk (matrix rows + id table)."""
+    _store.flush()
+
+
+def _migrate_json():
+    """One-time conversion of the old semantic_chunks.json into the binary store."""
+    global _doc_lookup
+    data = json.loads(SEM_FILE.read_text(encoding="utf-8"))
+    ids = data.get("ids", [])
+    vecs = np.array(data.get("vecs", []), dtype="float32")
+    _store.clear(vecs.shape[1] if ids else _embedding_dim())
+    if ids:
+        _store.append(ids, vecs)
+    _doc_lookup = data.get("lookup", {}) or {cid: cid.split("::")[0] for cid in ids}
+    _save()
+    SEM_FILE.rename(SEM_FILE.with_name(SEM_FILE.name + ".migrated"))
+    print(f"🔁 Migrated {len(ids)} chunk embeddings from {SEM_FILE.name} to {VEC_FILE.name}")
+
+
+def _normed(v: np.ndarray) -> np.ndarray:
+    """row-normalized float32 copy"""
+    v = np.asarray(v, dtype="float32")
+    return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+
+
+def _fetch(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids still live, their vectors) from the published snapshot; used by the NumPy IVF"""
+    view = _snap.store
+    rows = view.rows_for_ids(ids)
+    ok = rows >= 0
+    return np.asarray(ids)[ok], view.vecs[rows[ok]]
+
+
+def _rebuild_doc_index():
+    """
+    Rebuild the chunk lookup, doc → chunk ids map and doc centroids from the
+    store in one pass (load time only; afterwards they are kept incrementally).
+    """
+    global _doc_lookup, _doc_chunks
+    lookup, groups = {}, {}
+    for row in _store.live_rows():
+        cid = _store.ids[row]
+        did = _doc_lookup.get(cid) or cid.split("::")[0]
+        lookup[cid] = did
+        groups.setdefault(did, []).append(row)
+    _doc_lookup = lookup
+    _doc_chunks = {}
+    _centroids.dim = _store.dim
+    _centroids.clear()
+    for did, rows in groups.items():
+        rows = np.asarray(rows, dtype="int64")
+        _doc_chunks[did] = _store.int_ids[rows].copy()
+        _centroids.set(did, _store.vecs[rows].mean(axis=0))
 
 
 def _rebuild_index():
-    """Rebuild FAISS or NumPy index depending on what’s available."""
-    global _index
-    if _vecs.shape[0] == 0:
-        _index = None
-        return
+    """Full build of the search index for the current corpus size (load time / resets)."""
+    global _index, _index_dirty, _indexed_upto
+    with _index_lock:
+        _pending_deletes.clear()
+        rows = _store.live_rows()
+        _indexed_upto = int(_store.next_id) - 1
+        if len(rows) == 0:
+            _index = None
+            return
+        kind = ann.choose_kind(len(rows))
+        _index = ann.build(kind, _store.vecs[rows], _store.int_ids[rows], _fetch)
+        _index_dirty = ann.worth_saving(_index)
+    if _index_dirty:
+        print(f"🏗️ Built {kind}/{_index.compression} semantic index over {len(rows)} vectors")
+        _save_index()
+
 
-    if _HAS_FAISS:
-        dim = _vecs.shape[1]
-        ix = faiss.IndexFlatIP(dim)
-        normed_vecs = _vecs / np.linalg.norm(_vecs, axis=1, keepdims=True)
-        ix.add(normed_vecs.astype("float32"))
+def _load_index() -> bool:
+    """
+    Reuse the persisted ANN index if it still fits the store: ids deleted
+    since it was saved are removed and newer rows are added, no retraining.
+    False if there is nothing usable (caller rebuilds).
+    """
+    global _index, _index_dirty, _indexed_upto
+    rows = _store.live_rows()
+    kind = ann.choose_kind(len(rows))
+    compression = quant.effective(quant.COMPRESSION, len(rows))
+    if kind == "flat" and compression == "none":
+        return False
+    try:
+        ix, meta, saved = ann.load(ANN_FILE, _fetch)
+    except Exception as e:
+        print(f"⚠️ Could not load saved ANN index: {e}")
+        return False
+    if ix is None or ix.kind != kind or ix.dim != _store.dim or meta.get("model") != EMB_MODEL_NAME \
+            or (ix.backend == "faiss" or kind == "flat") and ix.compression != compression:
+        return False
+
+    live = _store.int_ids[rows]
+    gone = np.setdiff1d(saved, live)
+    new = ~np.isin(live, saved)
+    with _index_lock:
+        _pending_deletes.clear()
+        if len(gone) and not ix.remove(gone):
+            _pending_deletes.update(int(i) for i in gone)
+        if new.any():
+            ix.add(_normed(_store.vecs[rows[new]]), live[new])
         _index = ix
-    else:
-        _index = None
+        _indexed_upto = int(_store.next_id) - 1
+        _index_dirty = bool(len(gone) or new.any())
+    print(f"✅ Loaded {kind}/{ix.compression} semantic index ({ix.ntotal} vectors; {int(new.sum())} added, {len(gone)} removed since save)")
+    return True
 
 
-def _load():
-    """Load embeddings and IDs from disk (or start fresh)."""
-    global _ids, _vecs, _doc_lookup
-    if SEM_FILE.exists():
+def _save_index():
+    """Persist the ANN index with the ids it holds (flat indexes are cheaper to rebuild)."""
+    global _index_dirty
+    with _index_lock:
+        if not ann.worth_saving(_index):
+            _index_dirty = False
+            return
+        # the snapshot holds every id handed to the index (rows are published
+        # before _index_add); ids it has already dropped are still pending
+        view = _snap.store
+        live = view.int_ids[view.live_rows()]
+        held = np.union1d(live[live <= _indexed_upto],
+                          np.fromiter(_pending_deletes, dtype="int64", count=len(_pending_deletes)))
+        ann.save(_index, ANN_FILE, {"model": EMB_MODEL_NAME}, held)
+        _index_dirty = False
+
+
+def _index_add(vecs: np.ndarray, ids: np.ndarray):
+    """Add freshly appended rows to the index: O(len(vecs)), no rebuild."""
+    global _index, _index_dirty, _indexed_upto, _rebuild_wanted
+    if vecs.shape[0] == 0:
+        return
+    want = ann.choose_kind(_store.n_live)
+    with _index_lock:
+        if _index is None and (ann.HAS_FAISS or quant.COMPRESSION != "none"):
+            # first rows of an empty corpus: small index now, retrained as it grows
+            _index = ann.build("flat", vecs, ids, _fetch)
+        elif _index is not None:
+            _index.add(vecs, ids)
+        _index_dirty = _index is not None
+        if _rebuild_log is not None:
+            _rebuild_log.append((vecs, ids))
+        _indexed_upto = max(_indexed_upto, int(ids[-1]))
+        current = _index.kind if _index is not None else "flat"
+        if current != want or (_index is not None and _index.needs_retrain()):
+            _rebuild_wanted = True
+    _start_compactor()  # saves the index / runs the rebuild in the background
+    if _rebuild_wanted:
+        _compact_wake.set()
+
+
+def _index_remove(ids: Iterable[int]):
+    """
+    Forget index ids. Search filters them out right away; the physical
+    removal from the index happens later in the background compactor.
+    """
+    if _index is None:
+        return
+    with _index_lock:
+        _pending_deletes.update(int(i) for i in ids)
+    _start_compactor()
+    if len(_pending_deletes) >= COMPACT_MIN_DELETES:
+        _compact_wake.set()
+
+
+def _compact_index():
+    """Physically drop pending deletes from the index (HNSW can't: rebuild once they pile up)."""
+    global _index_dirty, _rebuild_wanted
+    with _index_lock:
+        if _index is None or not _pending_deletes:
+            _pending_deletes.clear()
+            return
+        n = len(_pending_deletes)
+        if _index.remove(np.fromiter(_pending_deletes, dtype="int64", count=n)):
+            _pending_deletes.clear()
+            _index_dirty = True
+        else:
+            if n > 0.2 * max(_index.ntotal, 1):
+                _rebuild_wanted = True
+            return
+    print(f"🧹 Compacted {n} deleted vectors out of the semantic index")
+
+
+def _background_rebuild():
+    """
+    Build a fresh index (e.g. flat → IVF once the corpus passes the ANN
+    threshold, or an IVF retrain) off the request path, then swap it in.
+    Searches keep using the old index meanwhile; adds made during the build
+    are logged and replayed onto the new index before the swap.
+    """
+    global _index, _rebuild_wanted, _rebuild_log, _index_dirty
+    with _index_lock:
+        _rebuild_wanted = False
+        _rebuild_log = []
+        # only rows already handed to the index; later ones arrive via _index_add
+        view = _snap.store
+        rows = view.live_rows()
+        dropped = set(_pending_deletes)
+        rows = rows[(view.int_ids[rows] <= _indexed_upto)
+                    & ~np.isin(view.int_ids[rows], np.fromiter(dropped, dtype="int64", count=len(dropped)))]
+        vecs, ids = view.vecs[rows], view.int_ids[rows].copy()
+        snap_max = _indexed_upto
+    kind = ann.choose_kind(len(rows))
+    try:
+        new = ann.build(kind, vecs, ids, _fetch) if len(rows) else None
+    except Exception:
+        with _index_lock:
+            _rebuild_log = None
+        raise
+    with _index_lock:
+        for v, i in _rebuild_log:
+            keep = i > snap_max  # rows appended before the snapshot are already in it
+            if new is not None and keep.any():
+                new.add(v[keep], i[keep])
+        _rebuild_log = None
+        _index = new
+        # deletes from before the snapshot were never added to the new index
+        _pending_deletes.difference_update(dropped)
+        _index_dirty = True
+    comp = new.compression if new is not None else "none"
+    print(f"🏗️ Rebuilt semantic index as {kind}/{comp} over {len(rows)} vectors")
+
+
+def _compactor_loop():
+    while True:
+        _compact_wake.wait(timeout=COMPACT_INTERVAL)
+        _compact_wake.clear()
         try:
-            data = json.loads(SEM_FILE.read_text(encoding="utf-8"))
-            _ids = data.get("ids", [])
-            _vecs = np.array(data.get("vecs", []), dtype="float32")
-            _doc_lookup = data.get("lookup", {})
-            print(f"✅ Loaded {_vecs.shape[0]} chunk embeddings from {SEM_FILE}")
+            if len(_pending_deletes) >= COMPACT_MIN_DELETES:
+                _compact_index()
+            if _rebuild_wanted:
+                _background_rebuild()
+            if _index_dirty:
+                _save_index()
+            if _graph.dirty:
+                with _graph.lock:  # the writer holds it for a whole batch, so lists and stamp agree
+                    _graph.save(_graph_stamp())
         except Exception as e:
-            print(f"⚠️ Failed to load semantic index: {e}")
-            _ids, _doc_lookup = [], {}
-            _vecs = np.zeros(
-                (0, _model.get_sentence_embedding_dimension()), dtype="float32"
-            )
-    else:
-        _ids, _doc_lookup = [], {}
-        _vecs = np.zeros(
-            (0, _model.get_sentence_embedding_dimension()), dtype="float32"
-        )
+            print(f"⚠️ Index maintenance failed: {e}")
+
+
+def _start_compactor():
+    """start the background index maintenance thread once"""
+    global _compactor
+    if _compactor is None:
+        _compactor = threading.Thread(target=_compactor_loop, name="sr-index-compactor", daemon=True)
+        _compactor.start()
+
+
+def _publish():
+    """swap in a snapshot of the current state (writer thread / load only)"""
+    global _snap
+    _snap = _Snapshot(_write_seq, _store.view(), _centroids.view(), dict(_doc_chunks), _doc_lookup)
+
+
+def _writer_loop():
+    """
+    Apply queued writes in order, up to WRITE_BATCH at a time, then publish
+    one snapshot for the batch and run the work that needs it (index adds,
+    neighbour graph updates) before answering the callers.
+    """
+    global _write_seq
+    while True:
+        jobs = [_write_q.get()]
+        while len(jobs) < WRITE_BATCH:
+            try:
+                jobs.append(_write_q.get_nowait())
+            except queue.Empty:
+                break
+        done = []
+        with _graph.lock:
+            changed = False
+            for fn, args, fut, publish in jobs:
+                try:
+                    done.append((fut, fn(*args), None))
+                except BaseException as e:
+                    done.append((fut, None, e))
+                if publish:
+                    _write_seq += 1
+                    changed = True
+            if changed:
+                _publish()
+            while _deferred:
+                try:
+                    _deferred.pop(0)()
+                except Exception as e:
+                    print(f"⚠️ Semantic index upkeep after a write failed: {e}")
+        for fut, result, err in done:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(result)
+
+
+def _write(fn: Callable, *args, wait: bool = True, publish: bool = True):
+    """
+    Run fn(*args) on the single writer thread, after every write queued
+    before it. Blocks for the result unless wait=False (then a Future).
+    publish=False marks jobs that don't change what readers see.
+    """
+    global _writer
+    if threading.current_thread() is _writer:
+        return fn(*args)
+    fut: Future = Future()
+    _write_q.put((fn, args, fut, publish))
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_writer_loop, name="sr-semantic-writer", daemon=True)
+                _writer.start()
+    return fut.result() if wait else fut
+
+
+def _load():
+    """Load embeddings (memory-mapped) and IDs from disk, or start fresh."""
+    global _loaded
+    try:
+        if not IDS_FILE.exists() and SEM_FILE.exists():
+            _migrate_json()
+
+        if _store.load():
+            print(f"✅ Loaded {_store.n_live} chunk embeddings from {VEC_FILE}")
+    except Exception as e:
+        print(f"⚠️ Failed to load semantic index: {e}")
+        _store.reset_memory(0)
+    _rebuild_doc_index()
+    _publish()
+    _graph.load(_graph_stamp())
+
+    if not _load_index():
+        _rebuild_index()
+    if _index is not None:
+        _start_compactor()
+    _loaded = True
 
-    _rebuild_index()
+
+def use_shards(addresses: List[str]):
+    """route this process's index calls to shard servers (empty = keep the index in-process)"""
+    global _router
+    _router = shards.ShardRouter(addresses) if addresses else None
 
 
 def ensure_loaded():
-    """Guarantees the index is ready before anything touches it."""
-    if (_vecs is None) or (_vecs.shape[0] == 0 and not SEM_FILE.exists()):
-        _load()
-    elif _index is None:
+    """Guarantees the index is ready before anything touches it (opens it on first call)."""
+    if _router is not None:
+        return  # the shards own their stores
+    if not _loaded:
+        with _load_lock:
+            if not _loaded:
+                _load()
+    elif _index is None and ann.HAS_FAISS and _snap.store.n_live:
+        _write(_ensure_index, wait=False, publish=False)
+
+
+def _ensure_index():
+    if _index is None and ann.HAS_FAISS and _store.n_live:
         _rebuild_index()
 
 
+def warmup():
+    """Load the encoder and the index now instead of on the first request."""
+    ensure_loaded()
+    _encode(["warmup"])
+    if _router is not None:
+        _router.scatter("status")  # fails here, not on the first query, if a shard is down
+
+
+def status() -> dict:
+    """what is loaded so far (for readiness checks); never triggers a load"""
+    remote = isinstance(_embedder, embed_server.RemoteEmbedder)
+    out = {
+        "model": EMB_MODEL_NAME,
+        "backend": EMB_BACKEND,
+        "model_loaded": _embedder.reachable if remote else _model is not None,
+        "embedder": _embedder.stats() if _embedder is not None else None,
+    }
+    if _router is not None:
+        parts = _router.status()
+        up = [p for p in parts if "error" not in p]
+        return {
+            **out,
+            "index_loaded": len(up) == len(parts) and all(p["index_loaded"] for p in up),
+            "vectors": sum(p["vectors"] for p in up),
+            "docs": sum(p["docs"] for p in up),
+            "index": "sharded",
+            "shards": parts,
+        }
+    return {
+        **out,
+        "index_loaded": _loaded,
+        "vectors": int(_snap.store.n_live),
+        "docs": len(_snap.centroids),
+        "writes": {"applied": _write_seq, "published": _snap.version, "queued": _write_q.qsize()},
+        "index": (_index.kind if _index is not None else "numpy") if _loaded else None,
+    }
+
+
 def _encode(texts: List[str]) -> np.ndarray:
-    """Encode text into normalized vector space."""
+    """Encode text into normalized vector space (micro-batched with concurrent callers)."""
     if not texts:
-        return np.zeros((0, _model.get_sentence_embedding_dimension()), dtype="float32")
-    v = _model.encode(
+        return np.zeros((0, _embedding_dim()), dtype="float32")
+    return _get_embedder().encode(texts)
+
+
+def _encode_direct(texts: List[str]) -> np.ndarray:
+    """One model call; only the embedding server's worker calls this."""
+    v = _get_model().encode(
         texts,
+        batch_size=EMB_BATCH_SIZE,
         convert_to_numpy=True,
         normalize_embeddings=True,
         show_progress_bar=False,
@@ -99,101 +619,398 @@ def _encode(texts: List[str]) -> np.ndarray:
     return v.astype("float32")
 
 
-# public functions
-def add_doc(doc_id: str, text: str):
+def _encode_chunks(texts: List[str], encode_slot: Callable[[], ContextManager] = nullcontext) -> np.ndarray:
     """
-    Splits a document into semantic chunks and adds them to the index.
-    Removes any existing chunks first to prevent duplication.
+    Encode document chunks, reusing the persisted vector of any chunk whose
+    exact text was encoded before by this model/backend. Only the misses
+    reach the encoder (inside encode_slot).
     """
-    global _vecs, _ids, _doc_lookup
-    ensure_loaded()
+    encoder = f"{EMB_MODEL_NAME}@{EMB_BACKEND}"
+    try:
+        cached = _chunk_cache.get_many(encoder, texts)
+    except Exception as e:
+        print(f"⚠️ Embedding cache lookup failed: {e}")
+        cached = {}
+    missing = [i for i in range(len(texts)) if i not in cached]
+    fresh = None
+    if missing:
+        todo = [texts[i] for i in missing]
+        with encode_slot():
+            fresh = _encode(todo)
+        try:
+            _chunk_cache.put_many(encoder, todo, fresh)
+        except Exception as e:
+            print(f"⚠️ Embedding cache write failed: {e}")
+    if not cached:
+        return fresh if fresh is not None else _encode([])
+
+    out = np.empty((len(texts), len(next(iter(cached.values())))), dtype="float32")
+    for i, v in cached.items():
+        out[i] = v
+    if missing:
+        out[missing] = fresh
+    return out
+
+
+def embed_cache_stats() -> dict:
+    if _router is not None:
+        parts = _router.scatter("embed_cache_stats")
+        out = {key: sum(p[key] or 0 for p in parts) for key in ("rows", "bytes", "hits", "misses", "evictions")}
+        total = out["hits"] + out["misses"]
+        return {**out, "hit_rate": round(out["hits"] / total, 4) if total else 0.0, "shards": len(parts)}
+    return _chunk_cache.stats()
+
+
+def clear_embed_cache():
+    if _router is not None:
+        _router.scatter("clear_embed_cache")
+        return
+    _chunk_cache.clear()
+
 
-    # clean slate for this doc
-    remove_doc(doc_id)
+def _normalize_query(q: str) -> str:
+    """canonical form of a query for caching: NFKC, collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFKC", q).split())
 
+
+def query_cache_stats() -> dict:
+    """Hit/miss counters and size of the query vector cache."""
+    return _query_cache.stats()
+
+
+def clear_query_cache():
+    _query_cache.clear()
+
+
+def _iter_chunks(doc_id: str, texts: Iterable[str]) -> Iterator[str]:
+    """
+    Incremental chunker: consumes text piece by piece (e.g. page by page)
+    and yields ~500-word paragraph chunks as soon as they are complete.
+    Produces exactly what chunking the joined text in one go would.
+    """
     # include filename context for literal recall
     filename_text = doc_id.replace("_", " ").replace("-", " ")
-    text = f"{filename_text}\n{text}"
+
+    def _lines():
+        yield filename_text
+        for t in texts:
+            yield from t.split("\n")
 
     # split into ~300–600 word chunks (paragraph-based)
-    paras = [p.strip() for p in text.split("\n") if len(p.strip()) > 40]
-    chunks, buf = [], ""
-    for p in paras:
+    buf = ""
+    for p in _lines():
+        p = p.strip()
+        if len(p) <= 40:
+            continue
         if len(buf.split()) + len(p.split()) < 500:
             buf += " " + p
         else:
-            chunks.append(buf.strip())
+            # prefix filename for context anchoring
+            yield f"{filename_text}. {buf.strip()}"
             buf = p
     if buf:
-        chunks.append(buf.strip())
+        yield f"{filename_text}. {buf.strip()}"
 
-    if not chunks:
-        return
 
-    # prefix filename for context anchoring
-    chunks = [f"{filename_text}. {c}" for c in chunks]
-    vecs = _encode(chunks)
-    if vecs.shape[0] == 0:
-        return
+def _chunk_doc(doc_id: str, text: str) -> List[str]:
+    """Split a document into ~500-word paragraph chunks, prefixed with its filename."""
+    return list(_iter_chunks(doc_id, [text]))
 
-    # append vectors + update in-memory maps
-    for i, v in enumerate(vecs):
-        chunk_id = f"{doc_id}::{i}"
-        _ids.append(chunk_id)
+
+def _append(entries: List[Tuple[str, str]], vecs: np.ndarray):
+    """
+    Append (chunk_id, doc_id) entries and their vectors to the store in one
+    vectorized write (amortized O(len(entries))) and add them to the FAISS index.
+    """
+    vecs = _normed(vecs)
+    for chunk_id, doc_id in entries:
         _doc_lookup[chunk_id] = doc_id
-        _vecs = np.vstack([_vecs, v.reshape(1, -1)]) if _vecs.size else v.reshape(1, -1)
+    new_ids = _store.append([cid for cid, _ in entries], vecs)
+    # the index only gets rows readers can already map back (see _save_index)
+    _deferred.append(lambda: _index_add(vecs, new_ids))
 
-    _save()
-    _rebuild_index()
-    print(f"📚 Added {len(chunks)} chunks for {doc_id} (total {_vecs.shape[0]} vectors)")
+    # doc index + centroids: entries arrive grouped by doc, so this is one step per doc
+    groups: List[str] = []
+    i = 0
+    while i < len(entries):
+        doc_id, j = entries[i][1], i
+        while j < len(entries) and entries[j][1] == doc_id:
+            j += 1
+        total = vecs[i:j].sum(axis=0)
+        prev = _doc_chunks.get(doc_id)
+        if prev is not None and len(prev):
+            total += _centroids.mean(doc_id) * len(prev)
+            _doc_chunks[doc_id] = np.concatenate([prev, new_ids[i:j]])
+        else:
+            _doc_chunks[doc_id] = new_ids[i:j].copy()
+        _centroids.set(doc_id, total / len(_doc_chunks[doc_id]))
+        groups.append(doc_id)
+        i = j
+    _deferred.append(lambda: _graph_add(groups, _snap))
+
+
+def _drop_docs(doc_ids: List[str]) -> bool:
+    """
+    Tombstone all chunks for the given docs (no matrix copy, no save).
+    Live rows are packed once enough tombstones pile up. True if anything changed.
+    """
+    ids = [_doc_chunks.pop(did) for did in dict.fromkeys(doc_ids) if did in _doc_chunks]
+    for did in doc_ids:
+        _centroids.drop(did)
+        _graph.remove(did)
+    if not ids:
+        return False
+    rows = _store.rows_for_ids(np.concatenate(ids))
+    rows = rows[rows >= 0]
+    for r in rows:
+        _doc_lookup.pop(_store.ids[r], None)
+    _index_remove(_store.delete(rows))
+    if _store.needs_compaction():
+        _store.compact()
+    return True
+
+
+# public functions
+def add_doc(doc_id: str, text: str):
+    """
+    Splits a document into semantic chunks and adds them to the index.
+    Removes any existing chunks first to prevent duplication.
+    """
+    add_docs([(doc_id, text)])
+
+
+def add_docs(docs: List[Tuple[str, str]]) -> int:
+    """
+    Bulk version of add_doc: chunks every document, encodes all chunks
+    together in large batches, then saves and rebuilds the index once.
+    Returns the number of chunks added.
+    """
+    if _router is not None:
+        parts: Dict[int, List[Tuple[str, str]]] = {}
+        for doc in docs:
+            parts.setdefault(_router.owner(doc[0]), []).append(doc)
+        return sum(_router.scatter_map({i: ("add", part) for i, part in parts.items()}))
+    ensure_loaded()
+
+    chunk_ids, chunks = [], []
+    for doc_id, text in docs:
+        for i, c in enumerate(_chunk_doc(doc_id, text)):
+            chunk_ids.append((f"{doc_id}::{i}", doc_id))
+            chunks.append(c)
+
+    # encode outside the writer; readers keep seeing the old chunks until the commit lands
+    vecs = _encode_chunks(chunks)
+    n = _write(_replace_docs, [doc_id for doc_id, _ in docs], chunk_ids, vecs)
+    if n:
+        print(f"📚 Added {n} chunks for {len(docs)} doc(s) (total {_store.n_live} vectors)")
+    return n
+
+
+def add_doc_stream(doc_id: str, pages: Iterable[str], queue_depth: int = STREAM_QUEUE_DEPTH,
+                   encode_slot: Callable[[], ContextManager] = nullcontext) -> int:
+    """
+    Streaming add_doc: pages flow from `pages` (typically a live extractor)
+    into the chunker and then the encoder through bounded queues, so
+    extraction, chunking and encoding overlap. Only `queue_depth` pages and
+    chunk batches are buffered at a time. Each encoder call runs inside
+    encode_slot() (e.g. a concurrency limit). Errors raised while iterating
+    `pages` are re-raised here. Returns the number of chunks added.
+    With shards, the pages are collected here and the owning shard
+    chunks and encodes them.
+    """
+    if _router is not None:
+        return _router.call(_router.owner(doc_id), "add_pages", doc_id, list(pages))
+    ensure_loaded()
+
+    done = object()
+    page_q: "queue.Queue" = queue.Queue(maxsize=max(1, queue_depth))
+    batch_q: "queue.Queue" = queue.Queue(maxsize=max(1, queue_depth))
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def _put(q, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return done
+
+    def _produce():
+        try:
+            for text in pages:
+                if not _put(page_q, text):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(page_q, done)
+
+    def _chunk():
+        def _pages():
+            while True:
+                item = _get(page_q)
+                if item is done:
+                    return
+                yield item
+
+        batch: List[str] = []
+        try:
+            for c in _iter_chunks(doc_id, _pages()):
+                batch.append(c)
+                if len(batch) >= EMB_BATCH_SIZE:
+                    if not _put(batch_q, batch):
+                        return
+                    batch = []
+            if batch:
+                _put(batch_q, batch)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(batch_q, done)
+
+    workers = [
+        threading.Thread(target=_produce, name=f"sr-pages-{doc_id}", daemon=True),
+        threading.Thread(target=_chunk, name=f"sr-chunks-{doc_id}", daemon=True),
+    ]
+    for t in workers:
+        t.start()
+
+    parts: List[np.ndarray] = []
+    try:
+        while True:
+            batch = _get(batch_q)
+            if batch is done:
+                break
+            parts.append(_encode_chunks(batch, encode_slot))
+    finally:
+        stop.set()
+        for t in workers:
+            t.join()
+
+    if errors:
+        raise errors[0]
+
+    # commit: replace any previous chunks for this doc in one go
+    vecs = np.vstack(parts) if parts else np.zeros((0, _embedding_dim()), dtype="float32")
+    n = _write(_replace_docs, [doc_id], [(f"{doc_id}::{i}", doc_id) for i in range(vecs.shape[0])], vecs)
+    if n:
+        print(f"📚 Streamed {n} chunks for {doc_id} (total {_store.n_live} vectors)")
+    return n
 
 
 def remove_doc(doc_id: str):
     """Remove all chunks for a given document."""
-    global _vecs, _ids, _doc_lookup
+    if _router is not None:
+        _router.call(_router.owner(doc_id), "remove", doc_id)
+        return
     ensure_loaded()
-    keep_indices = [i for i, cid in enumerate(_ids) if not cid.startswith(f"{doc_id}::")]
-    if len(keep_indices) < len(_ids):
-        _vecs = _vecs[keep_indices, :] if len(keep_indices) else np.zeros(
-            (0, _model.get_sentence_embedding_dimension()), dtype="float32"
-        )
-        _ids = [_ids[i] for i in keep_indices]
-        _doc_lookup = {cid: did for cid, did in _doc_lookup.items() if did != doc_id}
+    _write(_remove_docs, [doc_id])
+
+
+def reset():
+    """Drop every vector (ids keep counting up, so old FAISS ids are never reused)."""
+    if _router is not None:
+        _router.scatter("reset")
+        return
+    ensure_loaded()
+    _write(_reset)
+
+
+# writer side: everything below runs on the writer thread only
+def _replace_docs(doc_ids: List[str], entries: List[Tuple[str, str]], vecs: np.ndarray) -> int:
+    """drop the docs' old chunks and append the new ones; returns chunks added"""
+    changed = _drop_docs(doc_ids)
+    if vecs.shape[0] == 0:
+        if changed:
+            _save()
+        return 0
+    _append(entries, vecs)
+    _save()
+    return int(vecs.shape[0])
+
+
+def _remove_docs(doc_ids: List[str]):
+    if _drop_docs(doc_ids):
         _save()
-        _rebuild_index()
 
 
-def search(q: str, topk: int = 10) -> List[Tuple[str, float]]:
+def _reset():
+    global _doc_lookup, _doc_chunks
+    _doc_lookup, _doc_chunks = {}, {}
+    _centroids.clear()
+    _graph.clear()
+    _graph.remove_file()
+    _store.clear(_embedding_dim())
+    ann.remove_files(ANN_FILE)
+    _rebuild_index()
+
+
+def doc_vectors(normalized: bool = True) -> Tuple[List[str], np.ndarray]:
     """
-    Performs chunk-level semantic search and aggregates scores by document.
-    Uses FAISS if available, else falls back to NumPy similarity.
+    (doc ids, one vector per doc): the mean of each doc's chunk vectors,
+    unit-normalized unless normalized=False. Maintained incrementally, so
+    this is a copy of a ready matrix, not a pass over the chunks.
     """
+    if _router is not None:
+        parts = _router.scatter("doc_vectors", normalized)
+        mats = [m for ids, m in parts if len(ids)]
+        return [d for ids, _ in parts for d in ids], (np.vstack(mats) if mats else parts[0][1])
     ensure_loaded()
-    if _vecs.shape[0] == 0:
-        return []
+    doc_ids, mat, _ = _snap.centroids.matrix(normalized)
+    return doc_ids, mat
 
-    qv = _encode([q])
-    if qv.shape[0] == 0:
-        return []
 
-    qv = qv / np.linalg.norm(qv, axis=1, keepdims=True)
+def has_doc(doc_id: str) -> bool:
+    """True if the doc has vectors in the store"""
+    if _router is not None:
+        return _router.call(_router.owner(doc_id), "mean", doc_id) is not None
+    ensure_loaded()
+    return doc_id in _snap.doc_chunks
+
+
+def doc_mean(doc_id: str) -> Optional[np.ndarray]:
+    """raw mean chunk vector of a stored doc (None if unknown)"""
+    ensure_loaded()
+    return _snap.centroids.mean(doc_id)
 
-    # chunk-level similarity computation
-    if _HAS_FAISS and _index is not None:
-        D, I = _index.search(qv.astype("float32"), min(topk * 3, len(_ids)))
-        scores = [(_ids[i], float(D[0][j])) for j, i in enumerate(I[0])]
-    else:
-        sims = (qv @ (_vecs.T / np.linalg.norm(_vecs, axis=1))).flatten()
-        order = np.argsort(-sims)[: min(topk * 3, len(_ids))]
-        scores = [(_ids[i], float(sims[i])) for i in order]
 
-    # aggregate by doc
+
+def _encode_queries(queries: List[str]) -> np.ndarray:
+    """(len(queries), dim) unit vectors: cache hits reused, all misses encoded in one model call."""
+    texts = [_normalize_query(q) for q in queries]
+    out = np.zeros((len(texts), _embedding_dim()), dtype="float32")
+    missing: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        vec = _query_cache.get((EMB_MODEL_NAME, EMB_BACKEND, text))
+        if vec is None:
+            missing.setdefault(text, []).append(i)
+        else:
+            out[i] = vec[0]
+    if missing:
+        uniq = list(missing)
+        vecs = _normed(_encode(uniq))
+        for text, v in zip(uniq, vecs):
+            _query_cache.put((EMB_MODEL_NAME, EMB_BACKEND, text), v[None, :])
+            out[missing[text]] = v
+    return out
+
+
+def _aggregate(hits: List[Tuple[str, float]], topk: int) -> List[Tuple[str, float]]:
+    """chunk hits (doc_id, score) → doc hits: average of each doc's top-3 chunk scores"""
     doc_scores: Dict[str, List[float]] = {}
-    for cid, s in scores:
-        doc_id = _doc_lookup.get(cid, cid.split("::")[0])
+    for doc_id, s in hits:
         doc_scores.setdefault(doc_id, []).append(s)
 
-    # average of top-3 chunk scores = doc score
     agg = []
     for doc_id, vals in doc_scores.items():
         vals.sort(reverse=True)
@@ -203,42 +1020,306 @@ def search(q: str, topk: int = 10) -> List[Tuple[str, float]]:
     return agg[:topk]
 
 
-def similar(doc_id: str, topk: int = 10) -> List[Tuple[str, float]]:
+def search(q: str, topk: int = 10) -> List[Tuple[str, float]]:
+    """
+    Performs chunk-level semantic search and aggregates scores by document.
+    Uses the configured index (flat / IVF / HNSW, see ann.py), else a NumPy scan.
+    """
+    return search_batch([q], topk)[0]
+
+
+def search_batch(queries: List[str], topk: int = 10) -> List[List[Tuple[str, float]]]:
+    """
+    Batched search: all queries are encoded in one model call and searched
+    as a single matrix against the index. Returns per-query doc hits,
+    in the same order as `queries`. With shards, the query vectors go to
+    every shard and their chunk hits are merged before aggregation.
+    """
+    ensure_loaded()
+    if not queries:
+        return []
+    if _router is None and _snap.store.n_live == 0:
+        return [[] for _ in queries]
+    Q = _encode_queries(queries)
+    n_chunks = topk * 3
+
+    if _router is not None:
+        # a doc's chunks all live on one shard, so the best n_chunks overall
+        # are the best of the shards' own top n_chunks
+        parts = _router.scatter("chunk_hits", Q, n_chunks)
+        per_query = [sorted((h for p in parts for h in p[j]), key=lambda h: -h[1])[:n_chunks]
+                     for j in range(len(queries))]
+    else:
+        per_query = chunk_hits(Q, n_chunks)
+    return [_aggregate(hits, topk) for hits in per_query]
+
+
+def chunk_hits(Q: np.ndarray, n_chunks: int) -> List[List[Tuple[str, float]]]:
+    """
+    Chunk-level half of search_batch: the top `n_chunks` chunks for each
+    unit query vector in Q, as (doc_id, score) best first.
+    """
+    ensure_loaded()
+    snap = _snap
+    view = snap.store
+    if view.n_live == 0:
+        return [[] for _ in range(len(Q))]
+
+    ix = _index
+    if ix is not None:
+        with _index_lock:  # FAISS itself isn't safe against a concurrent add
+            # over-fetch by the number of deleted-but-not-compacted vectors
+            k = max(1, min(n_chunks + len(_pending_deletes), ix.ntotal))
+            D, I = ix.search(Q, k)
+        per_query = []
+        for d_row, i_row in zip(D, I):
+            # ids the snapshot doesn't hold (newer or deleted) map to -1
+            rows = view.rows_for_ids(i_row)
+            per_query.append([(snap.doc_of(view.ids[r]), float(d)) for r, d in zip(rows, d_row) if r >= 0][:n_chunks])
+        return per_query
+
+    # stored vectors are unit length already: one mat-mat product, no per-query renormalization
+    sims = view.vecs @ Q.T
+    sims[~view.alive] = -np.inf
+    m = min(n_chunks, view.n_live)
+    top = np.argpartition(-sims, m - 1, axis=0)[:m]
+    per_query = []
+    for j in range(Q.shape[0]):
+        col = top[:, j]
+        order = col[np.argsort(-sims[col, j])]
+        per_query.append([(snap.doc_of(view.ids[i]), float(sims[i, j])) for i in order])
+    return per_query
+
+
+def evaluate_index(n_queries: int = 200, k: int = 10) -> dict:
+    """
+    Recall@k and latency of the live index against exact float32 search,
+    plus its resident size next to the full-precision matrix.
+    With shards, each shard reports its own index.
+    """
+    if _router is not None:
+        parts = _router.scatter("evaluate", n_queries, k)
+        return {
+            "vectors": sum(p["vectors"] for p in parts),
+            "float32_bytes": sum(p["float32_bytes"] for p in parts),
+            "index_bytes": sum(p.get("index_bytes", 0) for p in parts),
+            "ok": all(p.get("ok") in (True, None) for p in parts),
+            "shards": parts,
+        }
+    ensure_loaded()
+    view = _snap.store
+    rows = view.live_rows()
+    out = {"vectors": int(len(rows)), "float32_bytes": int(len(rows) * view.dim * 4),
+           "compression_requested": quant.COMPRESSION}
+    ix = _index
+    if ix is None:
+        # plain NumPy scan over the float32 matrix: exact by construction
+        return {**out, "kind": "flat", "compression": "none", "index_bytes": 0,
+                f"recall@{k}": 1.0, "target": quant.RECALL_TARGET, "ok": True}
+    with _index_lock:
+        index_bytes = ix.memory_bytes()
+    # ground truth comes from the snapshot; the index is only locked per query
+    res = quant.recall_at_k(_SnapshotSearch(ix, view), view.vecs[rows], view.int_ids[rows], n_queries, k)
+    return {**out, "kind": ix.kind, "compression": ix.compression, "index_bytes": index_bytes, **res}
+
+
+class _SnapshotSearch:
+    """
+    An index as seen from one snapshot: each search takes _index_lock for
+    that query only, and hits the snapshot doesn't hold (added after it, or
+    deleted but not yet compacted) are dropped before the top k are cut.
+    """
+
+    def __init__(self, ix, view: StoreView):
+        self.ix, self.view = ix, view
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        with _index_lock:
+            kk = max(1, min(k + len(_pending_deletes), self.ix.ntotal))
+            D, I = self.ix.search(q, kk)
+        D_out = np.full((len(I), k), -np.inf, dtype="float32")
+        I_out = np.full((len(I), k), -1, dtype="int64")
+        for j, (d_row, i_row) in enumerate(zip(D, I)):
+            keep = np.flatnonzero(self.view.rows_for_ids(i_row) >= 0)[:k]
+            D_out[j, :len(keep)] = d_row[keep]
+            I_out[j, :len(keep)] = i_row[keep]
+        return D_out, I_out
+
+
+def _rank_docs(sims: np.ndarray, topk: int, snap: _Snapshot) -> List[Tuple[str, float]]:
+    """
+    Top distinct docs by their best chunk score (rows to skip must already
+    be -inf). Only the best rows are sorted, widening until topk docs turn up.
+    """
+    n_cand = int(np.isfinite(sims).sum())
+    want = topk * 4
+    while True:
+        m = min(want, n_cand)
+        if m == 0:
+            return []
+        cand = np.argpartition(-sims, m - 1)[:m] if m < len(sims) else np.arange(len(sims))
+        cand = cand[np.argsort(-sims[cand])]
+        seen, final = set(), []
+        for i in cand:
+            if not np.isfinite(sims[i]):
+                break
+            did = snap.doc_of(snap.store.ids[i])
+            if did not in seen:
+                seen.add(did)
+                final.append((did, float(sims[i])))
+                if len(final) >= topk:
+                    return final
+        if m >= n_cand:
+            return final
+        want *= 4
+
+
+def _exact_similar(doc_ids: List[str], topk: int, snap: _Snapshot) -> Dict[str, List[Tuple[str, float]]]:
+    """
+    Exact neighbours for several docs: their mean chunk vectors go through
+    one mat-mat product with the chunk matrix per block of docs.
+    """
+    view, cents = snap.store, snap.centroids
+    doc_ids = [d for d in doc_ids if d in cents and d in snap.doc_chunks]
+    out: Dict[str, List[Tuple[str, float]]] = {}
+    dead = ~view.alive
+    for b in range(0, len(doc_ids), 64):
+        block = doc_ids[b: b + 64]
+        M = np.vstack([cents.mean(d) for d in block])
+        S = M @ view.vecs.T
+        for did, sims in zip(block, S):
+            own = view.rows_for_ids(snap.doc_chunks[did])
+            sims[dead] = -np.inf
+            sims[own[own >= 0]] = -np.inf
+            out[did] = _rank_docs(sims, topk, snap)
+    return out
+
+
+def _candidate_similar(doc_ids: List[str], topk: int, snap: _Snapshot) -> Dict[str, List[Tuple[str, float]]]:
+    """
+    Neighbours without a scan of the whole matrix: the index proposes the
+    chunks nearest each doc's mean (bounded k), and only the docs they
+    belong to are scored exactly, by their best chunk against the mean.
+    Without an index (NumPy scan) this is _exact_similar.
+    """
+    ix = _index
+    if ix is None:
+        return _exact_similar(doc_ids, topk, snap)
+    view, cents = snap.store, snap.centroids
+    doc_ids = [d for d in doc_ids if d in cents and d in snap.doc_chunks]
+    if not doc_ids:
+        return {}
+    M = np.vstack([cents.mean(d) for d in doc_ids])
+    n_own = max(len(snap.doc_chunks[d]) for d in doc_ids)
+    with _index_lock:
+        # the doc's own chunks and deleted-but-not-compacted ones come back too
+        k = max(1, min(max(GRAPH_CANDIDATES, topk * 8) + n_own + len(_pending_deletes), ix.ntotal))
+        _, I = ix.search(_normed(M), k)
+    out: Dict[str, List[Tuple[str, float]]] = {}
+    for did, mean, i_row in zip(doc_ids, M, I):
+        rows = view.rows_for_ids(i_row)
+        cands = [c for c in dict.fromkeys(snap.doc_of(view.ids[r]) for r in rows[rows >= 0])
+                 if c != did and c in snap.doc_chunks]
+        parts = [view.rows_for_ids(snap.doc_chunks[c]) for c in cands]
+        keep = [i for i, r in enumerate(parts) if (r >= 0).any()]
+        if not keep:
+            out[did] = []
+            continue
+        parts = [parts[i][parts[i] >= 0] for i in keep]
+        starts = np.cumsum([0] + [len(r) for r in parts[:-1]])
+        best = np.maximum.reduceat(view.vecs[np.concatenate(parts)] @ mean, starts)
+        order = np.argsort(-best)[:topk]
+        out[did] = [(cands[keep[i]], float(best[i])) for i in order]
+    return out
+
+
+def _graph_stamp() -> dict:
+    """store state a saved neighbour graph must match to be reused"""
+    return {"model": EMB_MODEL_NAME, "next_id": int(_snap.store.next_id), "docs": len(_snap.centroids)}
+
+
+def _graph_add(doc_ids: List[str], snap: _Snapshot):
+    """
+    Fold freshly appended docs into the neighbour graph: each existing list
+    gets the new docs it would now rank (one mat-mat product against their
+    chunks), and the new docs get lists of their own from index candidates
+    re-ranked exactly (_candidate_similar). Runs on the writer after the
+    snapshot holding the docs, and the index adds for them, are published.
+    """
+    view = snap.store
+    new, rows = [], []
+    for did in dict.fromkeys(doc_ids):
+        r = view.rows_for_ids(snap.doc_chunks.get(did, np.zeros(0, dtype="int64")))
+        if (r >= 0).any():  # dropped again later in the same batch otherwise
+            new.append(did)
+            rows.append(r[r >= 0])
+    if not new:
+        return
+    fresh = set(new)
+    held = [d for d in _graph.lists if d not in fresh and d in snap.centroids]
+    if held:
+        C = np.vstack([snap.centroids.mean(d) for d in held])
+        starts = np.cumsum([0] + [len(r) for r in rows[:-1]])
+        best = np.maximum.reduceat(C @ view.vecs[np.concatenate(rows)].T, starts, axis=1)  # held × new docs
+        th = np.array([_graph.kth(d) for d in held], dtype="float32")
+        for h, g in zip(*np.nonzero(best > th[:, None])):
+            _graph.offer(held[h], new[g], float(best[h, g]))
+    for did, nb in _candidate_similar(new, _graph.k, snap).items():
+        _graph.put(did, nb)
+    _start_compactor()  # saves the graph in the background
+
+
+def _fill_graph(doc_id: str, neighbours: List[Tuple[str, float]], version: int):
+    """store a list a reader computed, unless a write landed since the snapshot it used"""
+    if version == _write_seq and doc_id in _centroids:
+        _graph.put(doc_id, neighbours)
+        _start_compactor()
+
+
+def similar(doc_id: str, topk: int = 10, exact: bool = False) -> List[Tuple[str, float]]:
     """
     Finds documents semantically similar to a given one
     by averaging cosine similarities across all chunks.
+    The average of a chunk's cosine to every query chunk equals its dot
+    product with the doc's mean chunk vector, so each other doc scores by
+    its best chunk against that mean. Answers come from the stored
+    neighbour graph; exact=True (or a list that can't cover topk)
+    recomputes from the vectors and refreshes the graph entry.
+    With shards, the owner sends the doc's mean vector to every shard
+    and their rankings are merged (always exact).
     """
+    if _router is not None:
+        mean = _router.call(_router.owner(doc_id), "mean", doc_id)
+        if mean is None:
+            return []
+        parts = _router.scatter("similar_to", mean, topk, doc_id)
+        return sorted((h for p in parts for h in p), key=lambda h: -h[1])[:topk]
     ensure_loaded()
-    chunk_indices = [i for i, cid in enumerate(_ids) if cid.startswith(f"{doc_id}::")]
-    if not chunk_indices:
+    if not exact:
+        hit = _graph.get(doc_id, topk)
+        if hit is not None:
+            return hit
+    snap = _snap
+    res = _exact_similar([doc_id], max(topk, _graph.k), snap).get(doc_id)
+    if res is None:
         return []
+    _write(_fill_graph, doc_id, res, snap.version, wait=False, publish=False)
+    return res[:topk]
 
-    qv = _vecs[chunk_indices, :]
-    qv = qv / np.linalg.norm(qv, axis=1, keepdims=True)
-    sims = (qv @ (_vecs.T / np.linalg.norm(_vecs, axis=1))).mean(axis=0)
-    order = np.argsort(-sims)
 
-    out = []
-    for i in order:
-        cid = _ids[i]
-        did = _doc_lookup.get(cid, cid.split("::")[0])
-        if did == doc_id:
-            continue
-        out.append((did, float(sims[i])))
-
-    # remove dupes and truncate
-    seen, final = set(), []
-    for did, s in out:
-        if did not in seen:
-            seen.add(did)
-            final.append((did, s))
-        if len(final) >= topk:
-            break
-    return final
-
-
-# initialize on import (so you don't have to remember)
-try:
-    _load()
-except Exception as e:
-    print("⚠️ Semantic index not loaded at startup:", e)
+def similar_to(vec: np.ndarray, topk: int = 10, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+    """
+    Docs ranked by their best chunk against `vec` (a doc's raw mean chunk
+    vector), leaving out `exclude`: the per-shard half of a sharded similar().
+    """
+    ensure_loaded()
+    snap = _snap
+    view = snap.store
+    if view.n_live == 0:
+        return []
+    sims = view.vecs @ np.asarray(vec, dtype="float32")
+    sims[~view.alive] = -np.inf
+    if exclude in snap.doc_chunks:
+        own = view.rows_for_ids(snap.doc_chunks[exclude])
+        sims[own[own >= 0]] = -np.inf
+    return _rank_docs(sims, topk, snap)
@@ -0,0 +1,98 @@
+import os, zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.rpc import RpcClient
+from services import rpc
+
+# comma-separated host:port list of shard servers (`python cli.py shard-server`); empty = one in-process index
+SHARDS = [a.strip() for a in os.getenv("SR_SHARDS", "").split(",") if a.strip()]
+# shared secret of router and shards (SR_SHARD_AUTHKEY); unset = per-install key in SMARTRESEARCH_DATA, loopback only
+AUTHKEY_ENV = "SR_SHARD_AUTHKEY"
+KEY_FILE = "shards.key"
+
+
+def authkey() -> Tuple[bytes, bool]:
+    """(key, set explicitly) for shard connections, see rpc.authkey"""
+    return rpc.authkey(AUTHKEY_ENV, KEY_FILE)
+
+
+def shard_of(doc_id: str, n_shards: int) -> int:
+    """stable doc → shard assignment (crc32, so every process agrees)"""
+    return zlib.crc32(doc_id.encode("utf-8")) % n_shards
+
+
+class ShardRouter:
+    """
+    Client side of a sharded semantic index. Every doc lives on exactly one
+    shard (shard_of), so all its chunks are scored in one place; requests
+    that concern one doc go to its owner, queries are scattered to every
+    shard in parallel and the caller merges the answers.
+    """
+
+    def __init__(self, addresses: List[str], key: Optional[bytes] = None):
+        key = key or authkey()[0]
+        self.clients = [RpcClient(a, key) for a in addresses]
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(self.clients)), thread_name_prefix="sr-shard")
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def owner(self, doc_id: str) -> int:
+        return shard_of(doc_id, len(self.clients))
+
+    def call(self, shard: int, *msg) -> Any:
+        return self.clients[shard].call(*msg)
+
+    def scatter(self, *msg) -> List[Any]:
+        """send the same request to every shard; answers in shard order"""
+        return self.scatter_map({i: msg for i in range(len(self.clients))})
+
+    def scatter_map(self, msgs: Dict[int, tuple]) -> List[Any]:
+        """send msgs[i] to shard i (in parallel); answers in the order of msgs"""
+        futures = [self._pool.submit(self.clients[i].call, *m) for i, m in msgs.items()]
+        return [f.result() for f in futures]
+
+    def status(self) -> List[dict]:
+        out = []
+        for c, res in zip(self.clients, [self._pool.submit(c.call, "status") for c in self.clients]):
+            try:
+                out.append({"address": c.label, **res.result()})
+            except Exception as e:
+                out.append({"address": c.label, "error": str(e)})
+        return out
+
+
+def serve(address: str, key: Optional[bytes] = None):
+    """
+    Run one shard: this process's own semantic store (under its
+    SMARTRESEARCH_DATA) answering a router's requests (blocks forever).
+    Without SR_SHARD_AUTHKEY (or `key`) it only listens on loopback.
+    """
+    key, explicit = (key, True) if key else authkey()
+    from services import semantic
+
+    ops = {
+        "add": semantic.add_docs,
+        "add_pages": lambda doc_id, pages: semantic.add_doc_stream(doc_id, iter(pages)),
+        "remove": semantic.remove_doc,
+        "reset": semantic.reset,
+        "chunk_hits": semantic.chunk_hits,
+        "mean": semantic.doc_mean,
+        "similar_to": semantic.similar_to,
+        "doc_vectors": semantic.doc_vectors,
+        "evaluate": semantic.evaluate_index,
+        "status": semantic.status,
+        "embed_cache_stats": semantic.embed_cache_stats,
+        "clear_embed_cache": semantic.clear_embed_cache,
+    }
+
+    def dispatch(msg):
+        if msg[0] not in ops:
+            raise ValueError(f"unknown request {msg[0]!r}")
+        return ops[msg[0]](*msg[1:])
+
+    rpc.serve(address, dispatch, key, "Shard server",
+              banner="🧩 Semantic shard listening on {host}:{port} "
+                     f"({semantic.status()['vectors']} vectors in {semantic.DATA_DIR})",
+              explicit_key=explicit)
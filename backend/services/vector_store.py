@@ -0,0 +1,455 @@
+import os, json
+from pathlib import Path
+from typing import Iterable, List, Optional
+import numpy as np
+
+# smallest preallocated matrix; capacity doubles from here
+MIN_CAPACITY = int(os.getenv("SR_STORE_MIN_ROWS", "1024"))
+# pack live rows together once this fraction of rows are tombstones
+COMPACT_RATIO = float(os.getenv("SR_STORE_COMPACT_RATIO", "0.25"))
+
+# rows copied per step when rewriting the matrix (bounds temporary memory)
+_COPY_BLOCK = 65536
+
+
+def _capacity_for(n: int) -> int:
+    """next power-of-two capacity that holds n rows"""
+    cap = max(1, MIN_CAPACITY)
+    while cap < n:
+        cap *= 2
+    return cap
+
+
+class VectorStore:
+    """
+    Growable float32 matrix backed by a preallocated .npy file that is
+    memory-mapped read/write, plus a JSON id table.
+
+    - Appends write into spare capacity; when it runs out the file is
+      reallocated at double the size, so appending N rows is amortized O(N).
+    - Deletes only tombstone rows (alive flag cleared; the id list is
+      append-only in memory and only writes None for them on disk).
+      Live rows are packed together once tombstones pass COMPACT_RATIO.
+    - Every row has a stable int64 id (strictly increasing with the row
+      number) that survives compaction, so external indexes keyed by it
+      (FAISS) never need renumbering.
+    - flush() only appends what changed since the last flush (new ids,
+      tombstoned rows) to a JSON-lines log next to the id table; the full
+      table is rewritten, and the log dropped, only when the matrix file is
+      (reallocation, compact(), clear()).
+
+    Row i ↔ ids[i] ↔ int_ids[i]; only the first `n` rows are in use.
+    view() shares the id list and the alive flags instead of copying them:
+    rows below a view's `n` are never rewritten in place, and the flags are
+    copied once, on the first delete after a view was taken.
+    """
+
+    def __init__(self, vec_path: Path, ids_path: Path, dim: int, meta: Optional[dict] = None):
+        self.vec_path = Path(vec_path)
+        self.ids_path = Path(ids_path)
+        self.log_path = self.ids_path.with_name(self.ids_path.name + ".log")
+        self.meta = dict(meta or {})
+        self.next_id = 0
+        self._gen = 0
+        self.reset_memory(dim)
+
+    def reset_memory(self, dim: int):
+        """forget every row in memory (the files on disk are left alone)"""
+        self.dim = int(dim)
+        self.n = 0
+        self.n_dead = 0
+        self.ids: List[Optional[str]] = []
+        self._buf: np.ndarray = np.zeros((0, self.dim), dtype="float32")
+        self._int_ids = np.zeros(0, dtype="int64")
+        self._alive = np.zeros(0, dtype=bool)
+        self._alive_shared = False  # a view holds _alive: copy it before clearing flags
+        # rows already recorded on disk / rows tombstoned since the last flush
+        self._logged = 0
+        self._dead_log: List[int] = []
+
+    # views over the used rows (tombstones included)
+    @property
+    def vecs(self) -> np.ndarray:
+        return self._buf[: self.n]
+
+    @property
+    def int_ids(self) -> np.ndarray:
+        return self._int_ids[: self.n]
+
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[: self.n]
+
+    @property
+    def n_live(self) -> int:
+        return self.n - self.n_dead
+
+    @property
+    def capacity(self) -> int:
+        return self._buf.shape[0]
+
+    def live_rows(self) -> np.ndarray:
+        """row numbers of all non-deleted rows"""
+        return np.flatnonzero(self.alive)
+
+    # persistence
+    def _table(self, capacity: Optional[int] = None) -> dict:
+        return {
+            **self.meta,
+            "dim": self.dim,
+            "rows": self.n,
+            "capacity": self.capacity if capacity is None else capacity,
+            "ids": self._persisted_ids(0, self.n),
+            "int_ids": self.int_ids.tolist(),
+            "next_id": int(self.next_id),
+            "log_gen": self._gen,
+        }
+
+    def _persisted_ids(self, start: int, end: int) -> List[Optional[str]]:
+        """ids of rows start..end as written to disk: None for deleted rows"""
+        return [cid if ok else None for cid, ok in zip(self.ids[start:end], self._alive[start:end])]
+
+    def _replay(self, gen: int):
+        """apply the id-table deltas flushed since the table was written"""
+        if not self.log_path.exists():
+            return
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        good = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                rec = None
+            if rec is None or not line.endswith(b"\n"):
+                # crash mid-flush: drop the partial record so later appends stay readable
+                print("⚠️ Semantic store log ends in a partial record, dropping it")
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(good)
+                break
+            good += len(line)
+            if rec.get("gen") != gen:
+                continue  # left over from before the last full rewrite
+            if "ids" in rec:
+                ids = rec["ids"][: self.capacity - self.n]
+                s, e = self.n, self.n + len(ids)
+                self._int_ids[s:e] = np.arange(rec["first_id"], rec["first_id"] + len(ids), dtype="int64")
+                self._alive[s:e] = [cid is not None for cid in ids]
+                self.ids.extend(ids)
+                self.n = e
+                self.next_id = max(self.next_id, int(rec["first_id"]) + len(ids))
+            for r in rec.get("dead", []):
+                if r < self.n and self._alive[r]:
+                    self._alive[r] = False
+
+    def load(self) -> bool:
+        """Open the on-disk store (memory-mapped). False if there is nothing on disk."""
+        if not (self.ids_path.exists() and self.vec_path.exists()):
+            self.reset_memory(self.dim)
+            return False
+        table = json.loads(self.ids_path.read_text(encoding="utf-8"))
+        try:
+            buf = np.lib.format.open_memmap(self.vec_path, mode="r+")
+        except PermissionError:
+            buf = np.load(self.vec_path, mmap_mode="r")  # read-only store: first write reallocates
+        ids = table.get("ids", [])
+        n = min(len(ids), int(table.get("rows", buf.shape[0])), buf.shape[0])
+        if n != len(ids):
+            print(f"⚠️ Semantic store rows/ids mismatch, keeping first {n}")
+
+        self.reset_memory(buf.shape[1])
+        self._buf = buf
+        self.n = n
+        self.ids = list(ids[:n])
+        int_ids = table.get("int_ids")
+        self._int_ids = np.zeros(buf.shape[0], dtype="int64")
+        self._int_ids[:n] = np.asarray(int_ids[:n] if int_ids else range(n), dtype="int64")
+        self._alive = np.zeros(buf.shape[0], dtype=bool)
+        self._alive[:n] = [cid is not None for cid in self.ids]
+        self.next_id = int(table.get("next_id", n))
+        self._gen = int(table.get("log_gen", 0))
+        self._replay(self._gen)
+        self.n_dead = self.n - int(self._alive[: self.n].sum())
+        self._logged = self.n
+        return True
+
+    def flush(self):
+        """
+        Persist: vector rows first, then one log record per kind of change
+        (which commits the new rows). Costs O(changes), not O(rows).
+        """
+        self.ids_path.parent.mkdir(parents=True, exist_ok=True)
+        if not (self.vec_path.exists() and self.ids_path.exists()):
+            self._rewrite(self.live_rows(), _capacity_for(self.n))
+            return
+        recs = []
+        if self.n > self._logged:
+            recs.append({"gen": self._gen, "first_id": int(self._int_ids[self._logged]),
+                         "ids": self._persisted_ids(self._logged, self.n)})
+        if self._dead_log:
+            recs.append({"gen": self._gen, "dead": self._dead_log})
+        if not recs:
+            return
+        if isinstance(self._buf, np.memmap):
+            self._buf.flush()
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in recs))
+        self._logged = self.n
+        self._dead_log = []
+
+    def _rewrite(self, keep: np.ndarray, capacity: int):
+        """
+        Copy the `keep` rows into a fresh file of the given capacity and
+        switch to it. Both files are written to temp names first and
+        renamed back to back, so a crash leaves either the old or the new store.
+        """
+        self.vec_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.vec_path.with_name(self.vec_path.name + ".tmp")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(capacity, self.dim))
+        for s in range(0, len(keep), _COPY_BLOCK):
+            blk = keep[s: s + _COPY_BLOCK]
+            out[s: s + len(blk)] = self._buf[blk]
+        out.flush()
+        del out
+
+        n = len(keep)
+        int_ids = np.zeros(capacity, dtype="int64")
+        int_ids[:n] = self._int_ids[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:n] = self._alive[keep]
+        self.ids = [self.ids[i] for i in keep]
+        self._int_ids, self._alive = int_ids, alive
+        self._alive_shared = False
+        self.n = n
+        self.n_dead = n - int(alive[:n].sum())
+
+        # the new table carries everything: bump the generation so log
+        # records written against the old one are skipped on load
+        self._gen += 1
+        ids_tmp = self.ids_path.with_name(self.ids_path.name + ".tmp")
+        ids_tmp.write_bytes(json.dumps(self._table(capacity)).encode("utf-8"))
+        os.replace(tmp, self.vec_path)
+        os.replace(ids_tmp, self.ids_path)
+        self.log_path.unlink(missing_ok=True)
+        self._logged = n
+        self._dead_log = []
+        self._buf = np.lib.format.open_memmap(self.vec_path, mode="r+")
+
+    # mutation
+    def clear(self, dim: Optional[int] = None):
+        """Drop every row (int ids keep counting up, so they are never reused)."""
+        self.reset_memory(dim or self.dim)
+        self._rewrite(np.zeros(0, dtype="int64"), _capacity_for(0))
+
+    def append(self, chunk_ids: List[str], vecs: np.ndarray) -> np.ndarray:
+        """
+        Vectorized bulk append into spare capacity (doubling it when full).
+        Returns the stable int ids given to the new rows.
+        """
+        vecs = np.asarray(vecs, dtype="float32").reshape(len(chunk_ids), -1) if len(chunk_ids) else \
+            np.zeros((0, self.dim), dtype="float32")
+        k = vecs.shape[0]
+        if k == 0:
+            return np.zeros(0, dtype="int64")
+        if self.n == 0 and self.dim != vecs.shape[1]:
+            self.dim = vecs.shape[1]  # an empty store takes the width of its first rows
+        if self.n + k > self.capacity or not self._buf.flags.writeable or self._buf.shape[1] != self.dim:
+            # reallocation copies everything anyway: drop tombstones on the way
+            keep = self.live_rows()
+            self._rewrite(keep, _capacity_for(len(keep) + k))
+
+        new_ids = np.arange(self.next_id, self.next_id + k, dtype="int64")
+        s, e = self.n, self.n + k
+        self._buf[s:e] = vecs
+        self._int_ids[s:e] = new_ids
+        self._alive[s:e] = True
+        self.ids.extend(chunk_ids)
+        self.n = e
+        self.next_id += k
+        return new_ids
+
+    def delete(self, rows: Iterable[int]) -> np.ndarray:
+        """Tombstone rows in place (no matrix copy). Returns the int ids that were removed."""
+        rows = np.asarray(list(rows), dtype="int64")
+        if rows.size == 0:
+            return np.zeros(0, dtype="int64")
+        rows = rows[self._alive[rows]]
+        if rows.size and self._alive_shared:
+            # copy-on-write: published views keep the flags they were taken with
+            self._alive = self._alive.copy()
+            self._alive_shared = False
+        self._alive[rows] = False
+        self._dead_log.extend(int(r) for r in rows if r < self._logged)
+        self.n_dead += len(rows)
+        return self._int_ids[rows].copy()
+
+    def needs_compaction(self) -> bool:
+        return self.n_dead > 0 and self.n_dead >= COMPACT_RATIO * self.n
+
+    def compact(self):
+        """Pack live rows together, dropping tombstones; int ids are preserved."""
+        keep = self.live_rows()
+        self._rewrite(keep, _capacity_for(len(keep)))
+
+    def rows_for_ids(self, ids: np.ndarray) -> np.ndarray:
+        """map int ids to current live row numbers (-1 where the id is gone)"""
+        return _rows_for_ids(self.int_ids, self.alive, ids)
+
+    def view(self) -> "StoreView":
+        """
+        Read-only snapshot of the used rows, O(1): rows below `n` are never
+        written in place (appends go past them, reallocation and compaction
+        switch to new arrays and a new id list), and the alive flags are
+        copied by the next delete instead (see delete()).
+        """
+        n = self.n
+        self._alive_shared = True
+        return StoreView(self._buf[:n], self._int_ids[:n], self._alive[:n], self.ids, n,
+                         self.n_live, self.dim, self.next_id)
+
+
+class StoreView:
+    """
+    Frozen view of a VectorStore as it was when view() was called: same
+    read API (vecs, ids, int_ids, alive, live_rows, rows_for_ids), and
+    nothing in it changes when the store is written afterwards. `ids` is
+    the store's shared list and may run past `n`; rows from `n` on are
+    not part of the view.
+    """
+
+    __slots__ = ("vecs", "int_ids", "alive", "ids", "n", "n_live", "dim", "next_id")
+
+    def __init__(self, vecs: np.ndarray, int_ids: np.ndarray, alive: np.ndarray,
+                 ids: List[Optional[str]], n: int, n_live: int, dim: int, next_id: int):
+        self.vecs, self.int_ids, self.alive, self.ids = vecs, int_ids, alive, ids
+        self.n = int(n)
+        self.n_live = int(n_live)
+        self.dim = int(dim)
+        self.next_id = int(next_id)
+
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.alive)
+
+    def rows_for_ids(self, ids: np.ndarray) -> np.ndarray:
+        return _rows_for_ids(self.int_ids, self.alive, ids)
+
+
+def _rows_for_ids(int_ids: np.ndarray, alive: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """int ids → row numbers among `int_ids` (sorted), -1 where absent or dead"""
+    ids = np.asarray(ids, dtype="int64")
+    n = len(int_ids)
+    if n == 0:
+        return np.full(len(ids), -1, dtype="int64")
+    rows = np.minimum(np.searchsorted(int_ids, ids), n - 1)
+    ok = (ids >= 0) & (int_ids[rows] == ids) & alive[rows]
+    return np.where(ok, rows, -1)
+
+
+class _CentroidReads:
+    """read side shared by CentroidTable and its frozen views"""
+
+    _unit: np.ndarray
+    _norms: np.ndarray
+    _alive: np.ndarray
+    _docs: List[Optional[str]]
+    _pos: dict
+
+    def __len__(self) -> int:
+        return len(self._pos)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._pos
+
+    def mean(self, doc_id: str) -> Optional[np.ndarray]:
+        """raw (unnormalized) mean chunk vector of a doc"""
+        i = self._pos.get(doc_id)
+        return None if i is None else self._unit[i] * self._norms[i]
+
+    def matrix(self, normalized: bool = True):
+        """(doc_ids, centroid matrix, norms) for every stored doc, in slot order"""
+        rows = np.flatnonzero(self._alive[: len(self._docs)])
+        unit = self._unit[rows]
+        norms = self._norms[rows]
+        return [self._docs[i] for i in rows], (unit if normalized else unit * norms[:, None]), norms
+
+
+class CentroidTable(_CentroidReads):
+    """
+    One normalized mean vector per document, kept in a single growable
+    in-memory matrix, plus the norm of each raw mean so the unnormalized
+    centroid can be recovered exactly.
+
+    Slots are append-only like the vector store: updating a doc writes a
+    new slot and retires the old one, and retired slots are packed away
+    into a fresh matrix once they outnumber live ones. A written slot is
+    never overwritten, which is what makes view() cheap.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = int(dim)
+        self.clear()
+
+    def clear(self):
+        self._unit = np.zeros((0, self.dim), dtype="float32")
+        self._norms = np.zeros(0, dtype="float32")
+        self._alive = np.zeros(0, dtype=bool)
+        self._docs: List[Optional[str]] = []
+        self._pos = {}
+
+    def _resize(self, keep: np.ndarray, cap: int):
+        """copy the `keep` slots into fresh arrays of capacity `cap`"""
+        unit = np.zeros((cap, self.dim), dtype="float32")
+        norms = np.zeros(cap, dtype="float32")
+        alive = np.zeros(cap, dtype=bool)
+        unit[: len(keep)] = self._unit[keep]
+        norms[: len(keep)] = self._norms[keep]
+        alive[: len(keep)] = self._alive[keep]
+        self._unit, self._norms, self._alive = unit, norms, alive
+        self._docs = [self._docs[i] for i in keep]
+        self._pos = {d: i for i, d in enumerate(self._docs) if d is not None}
+
+    def _retire(self, i: int):
+        self._alive[i] = False
+        self._docs[i] = None
+
+    def set(self, doc_id: str, mean: np.ndarray):
+        """store a doc's raw mean chunk vector"""
+        if not self._pos and len(mean) != self.dim:
+            self.dim = len(mean)  # an empty table takes the width of its first vector
+            self.clear()
+        old = self._pos.pop(doc_id, None)
+        if old is not None:
+            self._retire(old)
+        i = len(self._docs)
+        if i >= self._unit.shape[0]:
+            if len(self._docs) > 2 * len(self._pos):
+                # mostly retired slots: pack instead of growing
+                self._resize(np.flatnonzero(self._alive[:i]), max(64, self._unit.shape[0]))
+            else:
+                self._resize(np.arange(i), max(64, 2 * self._unit.shape[0]))
+            i = len(self._docs)
+        norm = float(np.linalg.norm(mean))
+        self._unit[i] = mean / max(norm, 1e-12)
+        self._norms[i] = norm
+        self._alive[i] = True
+        self._docs.append(doc_id)
+        self._pos[doc_id] = i
+
+    def drop(self, doc_id: str):
+        i = self._pos.pop(doc_id, None)
+        if i is not None:
+            self._retire(i)
+
+    def view(self) -> "CentroidView":
+        """frozen read-only snapshot (copies the flags and doc list, shares the rows)"""
+        n = len(self._docs)
+        return CentroidView(self._unit[:n], self._norms[:n], self._alive[:n].copy(),
+                            list(self._docs), dict(self._pos))
+
+
+class CentroidView(_CentroidReads):
+    """CentroidTable as it was when view() was called"""
+
+    def __init__(self, unit: np.ndarray, norms: np.ndarray, alive: np.ndarray,
+                 docs: List[Optional[str]], pos: dict):
+        self._unit, self._norms, self._alive, self._docs, self._pos = unit, norms, alive, docs, pos
@@ -0,0 +1,57 @@
+import hashlib
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# the services read their paths from the environment at import time
+os.environ["SMARTRESEARCH_DATA"] = tempfile.mkdtemp(prefix="sr_test_")
+os.environ.setdefault("SR_WARMUP", "none")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import ingest, semantic  # noqa: E402
+
+
+class HashEncoder:
+    """tiny deterministic stand-in for the sentence encoder"""
+
+    dim = 16
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kw):
+        out = np.empty((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            seed = int(hashlib.md5(t.encode("utf-8")).hexdigest()[:8], 16)
+            v = np.random.default_rng(seed).standard_normal(self.dim)
+            out[i] = v / np.linalg.norm(v)
+        return out
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """
+    Ingest without PDF parsing, NLTK or a real model: the "extracted" text is
+    the file's bytes, metadata is a fixed stub. Returns the list of texts that
+    reached the embedding step.
+    """
+    encoder = HashEncoder()
+    monkeypatch.setattr(semantic, "_get_model", lambda: encoder)
+
+    def fake_pages(rec, job=None):
+        return [Path(rec["path"]).read_bytes().decode("utf-8")], False
+
+    monkeypatch.setattr(ingest, "_cached_pages", fake_pages)
+    monkeypatch.setattr(ingest, "build_meta", lambda text, job=None: {
+        "pdf": {}, "external": {}, "final": {"summary": text[:40]}, "confidence": 1.0, "reliable": True,
+    })
+    return encoder
+
+
+def fake_pdf(label: str) -> bytes:
+    """unique file content that chunks into a few embeddable pieces"""
+    return " ".join(f"{label} sentence number {i} about retrieval." for i in range(60)).encode("utf-8")
@@ -0,0 +1,62 @@
+import json
+
+import cli
+from conftest import fake_pdf
+from services import ingest, semantic
+
+
+def _import(root, ckpt) -> int:
+    return cli.main(["import-dir", str(root), "--checkpoint", str(ckpt), "--workers", "2"])
+
+
+def _checkpointed(ckpt) -> dict:
+    return json.loads(ckpt.read_text(encoding="utf-8"))["files"]
+
+
+def test_resume_after_failed_embed(pipeline, monkeypatch, tmp_path):
+    root = tmp_path / "pdfs"
+    root.mkdir()
+    names = [f"paper{i}.pdf" for i in range(3)]
+    for name in names:
+        (root / name).write_bytes(fake_pdf(f"import {name}"))
+    ckpt = tmp_path / "ckpt.json"
+
+    add_docs = semantic.add_docs
+    broken = [True]
+
+    def flaky_add_docs(docs):
+        if broken:
+            raise RuntimeError("encoder unavailable")
+        return add_docs(docs)
+
+    monkeypatch.setattr(ingest.semantic, "add_docs", flaky_add_docs)
+
+    # nothing was embedded, so nothing may be checkpointed or look finished
+    assert _import(root, ckpt) == 1
+    assert _checkpointed(ckpt) == {}
+
+    broken.clear()
+    assert _import(root, ckpt) == 0
+    done = _checkpointed(ckpt)
+    assert sorted(done) == names
+    for entry in done.values():
+        assert semantic.has_doc(entry["doc_id"]) and ingest.is_ingested(entry["doc_id"])
+
+    # a third run has nothing left to do
+    monkeypatch.setattr(ingest.semantic, "add_docs", None)
+    assert _import(root, ckpt) == 0
+
+
+def test_unindexed_duplicate_is_not_skipped(pipeline, monkeypatch, tmp_path):
+    root = tmp_path / "pdfs"
+    root.mkdir()
+    (root / "lost.pdf").write_bytes(fake_pdf("lost vectors"))
+    ckpt = tmp_path / "ckpt.json"
+    assert _import(root, ckpt) == 0
+    did = _checkpointed(ckpt)["lost.pdf"]["doc_id"]
+
+    # text and metadata survive but the vectors are gone: --restart must re-embed it
+    semantic.remove_doc(did)
+    assert not ingest.is_ingested(did)
+    assert cli.main(["import-dir", str(root), "--checkpoint", str(ckpt), "--restart"]) == 0
+    assert semantic.has_doc(did)
@@ -0,0 +1,76 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import app as backend
+from conftest import fake_pdf
+from services import ingest, jobs, semantic
+from utils.storage import get_meta, get_text
+
+client = TestClient(backend.app)
+
+
+def _upload(name: str, data: bytes) -> dict:
+    r = client.post("/api/upload", files={"file": (name, data, "application/pdf")})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _wait(job_id: str, timeout: float = 30.0) -> jobs.Job:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job.status in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {jobs.get(job_id).status}")
+
+
+def test_reupload_after_failed_embed_reingests(pipeline, monkeypatch):
+    add_doc = semantic.add_doc
+    calls = []
+
+    def flaky_add_doc(doc_id, text):
+        calls.append(doc_id)
+        if len(calls) == 1:
+            raise RuntimeError("encoder unavailable")
+        return add_doc(doc_id, text)
+
+    monkeypatch.setattr(ingest.semantic, "add_doc", flaky_add_doc)
+    data = fake_pdf("flaky")
+
+    first = _upload("flaky.pdf", data)
+    assert _wait(first["job_id"]).status == "failed"
+    did = first["doc"]["id"]
+    # the failed run leaves nothing behind that would pass for a finished doc
+    assert get_meta(did) is None and not ingest.is_ingested(did)
+
+    again = _upload("flaky.pdf", data)
+    assert again["duplicate"] and again["job_id"] and again["job_id"] != first["job_id"]
+    assert _wait(again["job_id"]).status == "done"
+    assert semantic.has_doc(did) and get_meta(did) is not None
+    assert get_text(did) == data.decode("utf-8")
+
+    third = _upload("flaky.pdf", data)
+    assert third["duplicate"] and third["job_id"] is None
+    assert third["meta"] is not None and third["doc"]["n_chars"] == len(data)
+    assert calls == [did, did]
+
+
+def test_duplicate_of_running_job_reuses_it(pipeline, monkeypatch):
+    add_doc = semantic.add_doc
+    release = []
+
+    def slow_add_doc(doc_id, text):
+        while not release:
+            time.sleep(0.01)
+        return add_doc(doc_id, text)
+
+    monkeypatch.setattr(ingest.semantic, "add_doc", slow_add_doc)
+    data = fake_pdf("slow")
+
+    first = _upload("slow.pdf", data)
+    again = _upload("slow.pdf", data)
+    assert again["duplicate"] and again["job_id"] == first["job_id"]
+    release.append(True)
+    assert _wait(first["job_id"]).status == "done"
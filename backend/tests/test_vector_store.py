@@ -0,0 +1,41 @@
+import numpy as np
+
+from services.vector_store import VectorStore
+
+
+def _store(tmp_path, dim: int = 4) -> VectorStore:
+    return VectorStore(tmp_path / "vecs.npy", tmp_path / "ids.json", dim)
+
+
+def _rows(n: int, dim: int = 4) -> np.ndarray:
+    return np.random.default_rng(n).random((n, dim), dtype=np.float32)
+
+
+def test_view_is_unaffected_by_later_writes(tmp_path):
+    store = _store(tmp_path)
+    store.append([f"a::{i}" for i in range(5)], _rows(5))
+    view = store.view()
+
+    store.delete([1, 2])
+    store.append(["b::0", "b::1"], _rows(2))
+
+    assert view.n == 5 and view.n_live == 5
+    assert view.alive.tolist() == [True] * 5
+    assert view.live_rows().tolist() == [0, 1, 2, 3, 4]
+    assert view.rows_for_ids(np.arange(7)).tolist() == [0, 1, 2, 3, 4, -1, -1]
+    assert store.live_rows().tolist() == [0, 3, 4, 5, 6]
+
+
+def test_tombstones_survive_reload(tmp_path):
+    store = _store(tmp_path)
+    store.append([f"a::{i}" for i in range(5)], _rows(5))
+    store.flush()
+    store.delete([0, 3])
+    store.append(["b::0"], _rows(1))
+    store.flush()
+
+    again = _store(tmp_path)
+    assert again.load()
+    assert again.n_live == 4
+    assert [again.ids[r] for r in again.live_rows()] == ["a::1", "a::2", "a::4", "b::0"]
+    np.testing.assert_array_equal(again.vecs[again.live_rows()], store.vecs[store.live_rows()])
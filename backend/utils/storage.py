@@ -1,19 +1,30 @@
-import os, uuid, json, hashlib, time
+import os, io, uuid, json, hashlib, time, tempfile, bisect, threading
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, List, Optional
 
 # data directories
 DATA_DIR = Path(os.getenv("SMARTRESEARCH_DATA", "./data_store")).resolve()
 FILES = DATA_DIR / "files"
 TEXTS = DATA_DIR / "texts"
+EXTRACT_CACHE = DATA_DIR / "extract_cache"
 INDEX_FILE = DATA_DIR / "index.json"
 
+# uploads are streamed to disk in pieces of this size
+STREAM_CHUNK = 1024 * 1024
+
 # make sure base folders exist
-for p in (FILES, TEXTS):
+for p in (FILES, TEXTS, EXTRACT_CACHE):
     p.mkdir(parents=True, exist_ok=True)
 
+class UploadTooLarge(ValueError):
+    """raised by save_stream() when an upload goes over max_bytes"""
+
+
 # in-memory index cache
 _index: Dict[str, Dict] = {}
+_by_sha1: Dict[str, str] = {}  # content hash → doc id (dedup)
+# guards _index/_by_sha1 and index.json: uploads run in a thread pool
+_index_lock = threading.RLock()
 
 
 # helper functions
@@ -32,9 +43,10 @@ def _sha1(b: bytes) -> str:
 def _save_index():
     """write the in-memory index to disk as JSON"""
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    INDEX_FILE.write_text(
-        json.dumps(_index, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    with _index_lock:
+        INDEX_FILE.write_text(
+            json.dumps(_index, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
 
 
 def _load_index():
@@ -47,6 +59,17 @@ def _load_index():
             _index = {}
     else:
         _index = {}
+    _rebuild_sha1_lookup()
+
+
+def _rebuild_sha1_lookup():
+    """map each content hash to the oldest doc that has it"""
+    global _by_sha1
+    _by_sha1 = {}
+    for did, rec in sorted(_index.items(), key=lambda kv: kv[1].get("created", 0)):
+        sha = rec.get("sha1")
+        if sha and sha not in _by_sha1:
+            _by_sha1[sha] = did
 
 
 # preload existing index on import
@@ -54,32 +77,115 @@ _load_index()
 
 
 # file operations
+def find_by_sha1(sha1: str) -> Optional[dict]:
+    """return the index record of a stored file with this content hash, if any"""
+    with _index_lock:
+        did = _by_sha1.get(sha1)
+        rec = _index.get(did) if did else None
+    if rec and Path(rec.get("path", "")).exists():
+        return rec
+    return None
+
+
 def save_file(filename: str, content: bytes) -> dict:
     """
     save an uploaded file to disk and update the index.
     returns a record containing metadata for later retrieval.
+    if the same bytes were stored before, nothing is written and the
+    existing record is returned with "duplicate": True.
     """
-    did = _new_id()
-    fpath = FILES / f"{did}_{filename}"
-    fpath.write_bytes(content)
-
-    rec = {
-        "id": did,
-        "name": filename,
-        "path": str(fpath),
-        "bytes": len(content),
-        "sha1": _sha1(content),
-        "created": int(time.time()),
-    }
-
-    _index[did] = rec
-    _save_index()
+    return save_stream(filename, io.BytesIO(content))
+
+
+def save_stream(filename: str, src: BinaryIO, max_bytes: Optional[int] = None) -> dict:
+    """
+    stream a file-like object to disk in STREAM_CHUNK pieces, hashing as it goes,
+    then atomically rename it into FILES and update the index.
+    raises UploadTooLarge (and keeps nothing) once more than max_bytes are read.
+    duplicates are detected by hash as in save_file().
+    """
+    h = hashlib.sha1()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=FILES, prefix=".upload-", suffix=".part")
+    tmp = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = src.read(STREAM_CHUNK)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"{filename} is larger than {max_bytes} bytes")
+                h.update(block)
+                out.write(block)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    sha = h.hexdigest()
+    # dedup check and insert are one step, so parallel uploads of the same bytes get one doc id
+    with _index_lock:
+        existing = find_by_sha1(sha)
+        if existing:
+            tmp.unlink(missing_ok=True)
+            return {**existing, "duplicate": True}
+
+        did = _new_id()
+        fpath = FILES / f"{did}_{filename}"
+        os.replace(tmp, fpath)
+
+        rec = {
+            "id": did,
+            "name": filename,
+            "path": str(fpath),
+            "bytes": size,
+            "sha1": sha,
+            "created": int(time.time()),
+        }
+
+        _index[did] = rec
+        _by_sha1[sha] = did
+        _save_index()
     return rec
 
 
 def save_text(did: str, text: str):
     """save processed or extracted text for a given document id"""
-    (TEXTS / f"{did}.txt").write_text(text, encoding="utf-8")
+    save_pages(did, [text])
+
+
+def save_pages(did: str, pages: List[str]) -> str:
+    """
+    save per-page text for a document: <id>.txt holds the joined text
+    (blank pages dropped, pages separated by a newline) and <id>.pages.json
+    maps every page to its char and byte span in that file.
+    returns the joined text.
+    """
+    parts, chars, spans = [], 0, []
+    nbytes = 0
+    for page in pages:
+        page = (page or "").strip()
+        if not page:
+            spans.append([chars, chars, nbytes, nbytes])
+            continue
+        if parts:
+            parts.append("\n")
+            chars += 1
+            nbytes += 1
+        b = len(page.encode("utf-8"))
+        spans.append([chars, chars + len(page), nbytes, nbytes + b])
+        parts.append(page)
+        chars += len(page)
+        nbytes += b
+
+    text = "".join(parts)
+    # bytes, not write_text: offsets must not shift under newline translation
+    (TEXTS / f"{did}.txt").write_bytes(text.encode("utf-8"))
+    (TEXTS / f"{did}.pages.json").write_text(
+        json.dumps({"n_chars": chars, "pages": spans}), encoding="utf-8"
+    )
+    return text
 
 
 def get_text(did: str) -> str:
@@ -90,6 +196,104 @@ def get_text(did: str) -> str:
     raise FileNotFoundError(did)
 
 
+def _page_map(did: str) -> dict:
+    """
+    page offset map for a document; texts saved before page maps existed
+    are treated as a single page (built once from the file and stored).
+    """
+    p = TEXTS / f"{did}.pages.json"
+    if p.exists():
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    t = TEXTS / f"{did}.txt"
+    if not t.exists():
+        raise FileNotFoundError(did)
+    raw = t.read_bytes()
+    n_chars = len(raw.decode("utf-8", errors="replace"))
+    pmap = {"n_chars": n_chars, "pages": [[0, n_chars, 0, len(raw)]]}
+    p.write_text(json.dumps(pmap), encoding="utf-8")
+    return pmap
+
+
+def count_pages(did: str) -> int:
+    """number of pages recorded for a document"""
+    return len(_page_map(did)["pages"])
+
+
+def count_chars(did: str) -> int:
+    """length of the stored text in characters, without reading it"""
+    return int(_page_map(did)["n_chars"])
+
+
+def get_page(did: str, page: int) -> str:
+    """read a single page (0-based) of a document's text"""
+    spans = _page_map(did)["pages"]
+    if page < 0 or page >= len(spans):
+        raise IndexError(page)
+    _, _, b0, b1 = spans[page]
+    with open(TEXTS / f"{did}.txt", "rb") as f:
+        f.seek(b0)
+        return f.read(b1 - b0).decode("utf-8", errors="replace")
+
+
+def get_text_range(did: str, start: int, end: Optional[int] = None) -> str:
+    """
+    read characters [start, end) of a document's text, seeking straight to
+    the page that contains start instead of loading the whole file.
+    """
+    pmap = _page_map(did)
+    n_chars = pmap["n_chars"]
+    start = max(0, min(start, n_chars))
+    end = n_chars if end is None else max(start, min(end, n_chars))
+    if end == start:
+        return ""
+
+    # last page whose char span starts at or before `start`, and the last one
+    # starting before `end`: the bytes between them bound what has to be read
+    pages = pmap["pages"]
+    starts = [s[0] for s in pages]
+    i = max(0, bisect.bisect_right(starts, start) - 1)
+    j = max(i, bisect.bisect_left(starts, end) - 1)
+    c0, _, b0, _ = pages[i]
+    # a char is at most 4 utf-8 bytes; +1 covers the newline after page j
+    n_bytes = min((end - c0) * 4, pages[j][3] + 1 - b0)
+
+    with open(TEXTS / f"{did}.txt", "rb") as f:
+        f.seek(b0)
+        window = f.read(n_bytes).decode("utf-8", errors="replace")
+    return window[start - c0: end - c0]
+
+
+def get_text_head(did: str, n: int) -> str:
+    """first n characters of a document's text (previews, metadata lines)"""
+    p = TEXTS / f"{did}.txt"
+    if not p.exists():
+        raise FileNotFoundError(did)
+    with open(p, "r", encoding="utf-8", errors="replace", newline="") as f:
+        return f.read(n)
+
+
+def get_extraction(key: str) -> Optional[dict]:
+    """return a cached extraction result (per-page text etc.), or None on miss"""
+    p = EXTRACT_CACHE / f"{key}.json"
+    if p.exists():
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+    return None
+
+
+def save_extraction(key: str, payload: dict):
+    """store an extraction result under its cache key (written atomically)"""
+    p = EXTRACT_CACHE / f"{key}.json"
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, p)
+
+
 def save_meta(did: str, meta: dict):
     """store JSON metadata for a document"""
     (TEXTS / f"{did}.meta.json").write_text(
@@ -122,7 +326,9 @@ def list_docs() -> List[dict]:
     sorted newest-first (descending by id).
     """
     out = []
-    for did, rec in _index.items():
+    with _index_lock:
+        items = list(_index.items())
+    for did, rec in items:
         tpath = TEXTS / f"{did}.txt"
         n_chars = tpath.stat().st_size if tpath.exists() else 0
         out.append({"id": did, "name": rec["name"], "n_chars": int(n_chars)})
@@ -131,14 +337,28 @@ def list_docs() -> List[dict]:
     return out
 
 
+def clear_text(did: str):
+    """remove the stored text, page map and metadata of a document (its file and index record stay)"""
+    for ext in [".txt", ".pages.json", ".meta.json"]:
+        t = TEXTS / f"{did}{ext}"
+        if t.exists():
+            try:
+                t.unlink()
+            except Exception:
+                pass
+
+
 def delete_doc(did: str) -> bool:
     """
     delete a document and all related data (file, text, metadata).
     returns True if successfully deleted, False if not found.
     """
-    rec = _index.pop(did, None)
-    if not rec:
-        return False
+    with _index_lock:
+        rec = _index.pop(did, None)
+        if not rec:
+            return False
+        if _by_sha1.get(rec.get("sha1")) == did:
+            _rebuild_sha1_lookup()
 
     f = Path(rec.get("path", ""))
     if f.exists():
@@ -148,13 +368,7 @@ def delete_doc(did: str) -> bool:
             pass
 
     # remove extracted text + metadata
-    for ext in [".txt", ".meta.json"]:
-        t = TEXTS / f"{did}{ext}"
-        if t.exists():
-            try:
-                t.unlink()
-            except Exception:
-                pass
+    clear_text(did)
 
     _save_index()
     return True